@@ -6,9 +6,25 @@ from io import BytesIO
 from PIL import Image
 import time
 import pandas as pd
+import numpy as np
 import re
 import zipfile
 import random
+import threading
+import urllib.parse
+import os
+import sqlite3
+import contextlib
+import hashlib
+import weakref
+import contextvars
+import email.utils
+import heapq
+import math
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # --- 1. CONFIGURATION & CONSTANTS ---
 st.set_page_config(layout="wide", page_title="Jewelry AI Studio 12/9")
@@ -31,6 +47,17 @@ OPENAI_MODELS = {
     "GPT-5.6 Luna": "gpt-5.6-luna",
 }
 
+# Max in-flight calls per provider, shared by every batch/session on this server.
+# Raise a cap when that account's rate-limit tier goes up (needs an app restart).
+PROVIDER_CONCURRENCY = {
+    "claude": 4,
+    "openai": 6,
+    "gemini": 4,
+    "gemini_image": 10,   # image generation (Retouch) has its own, separate quota
+}
+RETOUCH_RETRIES = 2       # extra attempts per image before it is reported as failed
+BULK_SEO_RETRIES = 2      # default extra attempts per image in the Bulk SEO tab
+
 # Opening Angle Pool for Product Writer diversity
 # Weighted: "design detail" ~70%, other angles ~6% each for natural mix
 OPENING_ANGLE_POOL = [
@@ -1814,6 +1841,64 @@ DEFAULT_PROMPTS = [
      "variables": "metal_type", "sample_url": ""}
 ]
 
+# --- HTTP TRANSPORT (pooled keep-alive sessions) ---
+# Every outbound call goes through http_request(): one requests.Session per host,
+# so a bulk run reuses warm TCP+TLS connections instead of a new handshake per call.
+HTTP_DEFAULT_TIMEOUT = 30   # seconds — callers pass their own for slow endpoints (AI, uploads)
+HTTP_POOL_MAXSIZE = 16      # keep-alive connections per host (>= the biggest PROVIDER_CONCURRENCY)
+
+@st.cache_resource(show_spinner=False)
+def _http_pool():
+    """Process-wide: {host: Session} plus per-host call metrics, shared by all sessions/threads."""
+    return {"sessions": {}, "metrics": {}, "lock": threading.Lock()}
+
+def _http_session(host):
+    pool = _http_pool()
+    with pool["lock"]:
+        sess = pool["sessions"].get(host)
+        if sess is None:
+            sess = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE)
+            sess.mount("https://", adapter)
+            sess.mount("http://", adapter)
+            pool["sessions"][host] = sess
+    return sess
+
+def _http_record(host, seconds, status):
+    pool = _http_pool()
+    with pool["lock"]:
+        m = pool["metrics"].setdefault(host, {"calls": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0, "last_status": None})
+        m["calls"] += 1
+        m["total_s"] += seconds
+        m["max_s"] = max(m["max_s"], seconds)
+        m["last_status"] = status
+        if status is None or status >= 400: m["errors"] += 1
+
+def http_request(method, url, timeout=HTTP_DEFAULT_TIMEOUT, **kwargs):
+    """requests.request() over the pooled per-host Session. Same return/raise behavior as requests."""
+    host = urllib.parse.urlsplit(url).netloc
+    t0 = time.time()
+    status = None
+    try:
+        res = _http_session(host).request(method, url, timeout=timeout, **kwargs)
+        status = res.status_code
+        return res
+    finally:
+        _http_record(host, time.time() - t0, status)
+
+def http_get(url, **kwargs): return http_request("GET", url, **kwargs)
+def http_post(url, **kwargs): return http_request("POST", url, **kwargs)
+def http_put(url, **kwargs): return http_request("PUT", url, **kwargs)
+
+def http_metrics():
+    """Snapshot of per-host metrics for the Models tab."""
+    pool = _http_pool()
+    with pool["lock"]:
+        return [{"host": h, "calls": m["calls"], "errors": m["errors"],
+                 "avg_ms": int(m["total_s"] / m["calls"] * 1000) if m["calls"] else 0,
+                 "max_ms": int(m["max_s"] * 1000), "last_status": m["last_status"]}
+                for h, m in sorted(pool["metrics"].items())]
+
 # --- 2. CLOUD DATABASE FUNCTIONS ---
 def get_prompts():
     try:
@@ -1824,7 +1909,7 @@ def get_prompts():
         if not API_KEY or not BIN_ID: return DEFAULT_PROMPTS
         url = f"https://api.jsonbin.io/v3/b/{BIN_ID}/latest"
         headers = {"X-Master-Key": API_KEY}
-        response = requests.get(url, headers=headers, timeout=5)
+        response = http_get(url, headers=headers, timeout=5)
         if response.status_code == 200:
             return response.json().get("record", DEFAULT_PROMPTS)
         return DEFAULT_PROMPTS
@@ -1838,88 +1923,165 @@ def save_prompts(data):
         BIN_ID = clean_key(raw_bin)
         url = f"https://api.jsonbin.io/v3/b/{BIN_ID}"
         headers = {"Content-Type": "application/json", "X-Master-Key": API_KEY}
-        requests.put(url, json=data, headers=headers, timeout=10)
+        http_put(url, json=data, headers=headers, timeout=10)
     except Exception as e: st.error(f"Save failed: {e}")
 
 # --- 3. HELPER FUNCTIONS ---
-def img_to_base64(img):
+# Encoded JPEG/base64 strings are memoized: one resize + compress per image and target,
+# no matter how many provider calls or uploads reuse it. Looked up by object identity first
+# (weakref-checked, so a recycled id() never matches) and then by a pixel digest, so the
+# same picture reopened from bytes still hits. Bounded by total base64 size (LRU).
+IMG_B64_CACHE_MAX_BYTES = 96 * 1024 * 1024
+
+@st.cache_resource(show_spinner=False)
+def _img_b64_cache():
+    return {"entries": OrderedDict(), "ids": OrderedDict(), "bytes": 0, "lock": threading.Lock()}
+
+def _img_digest(img):
+    h = hashlib.blake2b(f"{img.mode}|{img.size}".encode(), digest_size=20)
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+def img_to_base64(img, max_size=1024, quality=90):
+    """JPEG-encode (fit within max_size², given quality) and base64 an image. Never modifies `img`."""
+    cache = _img_b64_cache()
+    with cache["lock"]:
+        ref_digest = cache["ids"].get(id(img))
+        digest = ref_digest[1] if ref_digest and ref_digest[0]() is img else None
+        hit = cache["entries"].get((digest, max_size, quality)) if digest else None
+        if hit is not None:
+            cache["entries"].move_to_end((digest, max_size, quality))
+            return hit
+    if digest is None:
+        digest = _img_digest(img)
+    key = (digest, max_size, quality)
+    with cache["lock"]:
+        cache["ids"][id(img)] = (weakref.ref(img), digest)
+        cache["ids"].move_to_end(id(img))
+        while len(cache["ids"]) > 4096: cache["ids"].popitem(last=False)
+        hit = cache["entries"].get(key)
+        if hit is not None:
+            cache["entries"].move_to_end(key)
+            return hit
+
+    work = img.convert('RGB') if img.mode in ('RGBA', 'P', 'LA') else img.copy()
+    work.thumbnail((max_size, max_size))
     buf = BytesIO()
-    if img.mode == 'RGBA': img = img.convert('RGB')
-    img.thumbnail((1024, 1024)) 
-    img.save(buf, format="JPEG", quality=90)
-    return base64.b64encode(buf.getvalue()).decode()
+    work.save(buf, format="JPEG", quality=quality)
+    encoded = base64.b64encode(buf.getvalue()).decode()
+
+    with cache["lock"]:
+        if key not in cache["entries"]:
+            cache["entries"][key] = encoded
+            cache["bytes"] += len(encoded)
+        while cache["bytes"] > IMG_B64_CACHE_MAX_BYTES and len(cache["entries"]) > 1:
+            _, old = cache["entries"].popitem(last=False)
+            cache["bytes"] -= len(old)
+    return encoded
+
+# --- JSON EXTRACTION (model output) ---
+# Model answers are JSON wrapped in anything from nothing to ``` fences and prose, and can stop
+# mid-value at max_tokens. One forward scan over the structural characters (regex jumps over
+# everything else) finds the first complete object/array; it can be fed the text chunk by
+# chunk as a response streams in, so a payload is available the moment its last brace arrives.
+_JSON_SCAN = re.compile(r'[{}\[\]",]')
+_JSON_STR_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*')   # a string's contents up to its closing quote
+_JSON_CLOSE = {"{": "}", "[": "]"}
+
+def json_stream():
+    """Scanner state for json_stream_feed / json_stream_result."""
+    return {"buf": "", "pos": 0, "start": -1, "stack": [], "in_str": False, "done": False, "value": None,
+            "last_comma": None, "trailing_commas": []}
+
+def _json_fragment_loads(buf, start, end, drop, suffix=""):
+    """json.loads(buf[start:end] + suffix) without the characters at positions in drop (trailing commas)."""
+    parts, i = [], start
+    for p in drop:
+        if start <= p < end:
+            parts.append(buf[i:p])
+            i = p + 1
+    parts.append(buf[i:end])
+    return json.loads("".join(parts) + suffix)
+
+def json_stream_feed(state, chunk):
+    """Scan the next piece of text. Returns the first complete JSON object/array once it has
+    arrived (and keeps returning it), else None. Text before it, and after it, is ignored."""
+    if state["done"]: return state["value"]
+    state["buf"] += chunk
+    buf, pos, stack = state["buf"], state["pos"], state["stack"]
+    while pos < len(buf):
+        if state["in_str"]:
+            try:   # the json module's C string scanner — fast on long html_content values
+                pos = json.decoder.scanstring(buf, pos, False)[1]
+                state["in_str"] = False
+                continue
+            except ValueError:   # unterminated so far (or a bad escape) — find where it stops
+                pos = _JSON_STR_BODY.match(buf, pos).end()
+            if pos == len(buf) or buf[pos] == "\\": break   # string (or an escape) continues in the next chunk
+            state["in_str"], pos = False, pos + 1
+            continue
+        if state["start"] < 0:
+            starts = [i for i in (buf.find("{", pos), buf.find("[", pos)) if i >= 0]
+            if not starts:
+                pos = len(buf)
+                continue
+            state["start"] = pos = min(starts)
+            stack.append(buf[pos])
+            pos += 1
+            continue
+        m = _JSON_SCAN.search(buf, pos)
+        if not m:
+            pos = len(buf)
+            continue
+        c, pos = m.group(), m.end()
+        if c == '"':
+            state["in_str"] = True
+        elif c == ",":
+            state["last_comma"] = (m.start(), "".join(_JSON_CLOSE[o] for o in reversed(stack)))
+        elif c in "{[":
+            stack.append(c)
+        else:
+            comma = state["last_comma"]
+            if comma and not buf[comma[0] + 1:m.start()].strip():
+                state["trailing_commas"].append(comma[0])   # "[1, 2,]" — models do this; JSON doesn't allow it
+            if _JSON_CLOSE[stack.pop()] == c:
+                if stack: continue
+                try:
+                    state["value"] = _json_fragment_loads(buf, state["start"], pos, state["trailing_commas"])
+                    state["done"] = True
+                    break
+                except ValueError:
+                    pass
+            # mismatched brackets or not JSON after all ("[IMAGE 1 of 3]") — look again after that opener
+            pos, state["start"], state["last_comma"], state["trailing_commas"] = state["start"] + 1, -1, None, []
+            stack.clear()
+    state["pos"] = pos
+    return state["value"]
+
+def json_stream_result(state):
+    """The complete value, or for text that stopped mid-value (max_tokens) a best-effort repair:
+    the open string and containers are closed in nesting order, else the text is cut back to the
+    last complete member. None when there is nothing to salvage."""
+    if state["done"] or state["start"] < 0: return state["value"]
+    buf, start, drop = state["buf"], state["start"], state["trailing_commas"]
+    # pos sits on a dangling backslash when the text ended inside an escape
+    body = (buf[start:state["pos"]] + '"') if state["in_str"] else buf[start:].rstrip()
+    body = body[:-1] if body.endswith(",") else body
+    closers = "".join(_JSON_CLOSE[o] for o in reversed(state["stack"]))
+    tries = [(body, closers)]
+    if state["last_comma"]: tries.append((buf[start:state["last_comma"][0]], state["last_comma"][1]))
+    for text, suffix in tries:
+        try: return _json_fragment_loads(text, 0, len(text), [p - start for p in drop], suffix)
+        except ValueError: pass
+    return None
 
 def parse_json_response(text):
+    """First JSON object/array in a model answer — fences and prose around it are ignored and
+    truncated output is repaired where possible. None when there is none."""
     if not text: return None
-    # Step 1: Try direct parse (cleanest case)
-    try:
-        return json.loads(text.strip())
-    except: pass
-    
-    # Step 2: Remove markdown code fences
-    cleaned = re.sub(r"```json\s*", "", text)
-    cleaned = re.sub(r"```\s*", "", cleaned).strip()
-    try:
-        return json.loads(cleaned)
-    except: pass
-    
-    # Step 3: Extract JSON object/array from surrounding text
-    # Find the first { or [ and match to its closing } or ]
-    for start_char, end_char in [('{', '}'), ('[', ']')]:
-        start_idx = cleaned.find(start_char)
-        if start_idx == -1: continue
-        depth = 0
-        in_string = False
-        escape_next = False
-        for i in range(start_idx, len(cleaned)):
-            c = cleaned[i]
-            if escape_next:
-                escape_next = False; continue
-            if c == '\\' and in_string:
-                escape_next = True; continue
-            if c == '"' and not escape_next:
-                in_string = not in_string; continue
-            if in_string: continue
-            if c == start_char: depth += 1
-            elif c == end_char: depth -= 1
-            if depth == 0:
-                try:
-                    return json.loads(cleaned[start_idx:i+1])
-                except: break
-    
-    # Step 4: Try to fix truncated JSON (AI response cut off)
-    # Find first { and attempt to repair by closing open braces/brackets
-    for start_char, end_char in [('{', '}'), ('[', ']')]:
-        start_idx = cleaned.find(start_char)
-        if start_idx == -1: continue
-        fragment = cleaned[start_idx:]
-        # Close any unclosed strings
-        in_str = False
-        esc = False
-        for ch in fragment:
-            if esc: esc = False; continue
-            if ch == '\\' and in_str: esc = True; continue
-            if ch == '"': in_str = not in_str
-        if in_str:
-            fragment += '"'
-        # Remove trailing comma before closing
-        fragment = re.sub(r',\s*$', '', fragment)
-        # Count unclosed braces/brackets and close them
-        open_braces = fragment.count('{') - fragment.count('}')
-        open_brackets = fragment.count('[') - fragment.count(']')
-        fragment += ']' * max(0, open_brackets)
-        fragment += '}' * max(0, open_braces)
-        try:
-            return json.loads(fragment)
-        except:
-            # Step 5: Last resort — try to salvage partial fields
-            try:
-                # Fix common issues: trailing commas, unescaped newlines in strings
-                fixed = re.sub(r',(\s*[}\]])', r'\1', fragment)
-                return json.loads(fixed)
-            except: pass
-    
-    return None
+    state = json_stream()
+    json_stream_feed(state, text)
+    return json_stream_result(state)
 
 def clean_filename(name):
     if not name: return "N/A"
@@ -1936,19 +2098,126 @@ def remove_html_tags(text):
     text = text.replace('&nbsp;', ' ').replace('&amp;', '&').replace('&gt;', '>').replace('&lt;', '<')
     return "\n".join([line.strip() for line in text.split('\n') if line.strip()])
 
+# --- SHOPIFY RATE LIMITER (leaky bucket, driven by response headers) ---
+# REST: X-Shopify-Shop-Api-Call-Limit "used/capacity" (leaks capacity/20 per sec: 40→2/s, Plus 400→20/s).
+# GraphQL: extensions.cost.throttleStatus (points available + restore rate).
+# Callers wait only as long as the bucket needs, instead of fixed sleeps.
+SHOPIFY_API_VERSION = "2026-04"
+SHOPIFY_BUCKET_HEADROOM = 2       # REST slots left free for other tools/apps hitting the same store
+SHOPIFY_GQL_DEFAULT_COST = 50     # cost assumed before the first GraphQL response tells us the real one
+
+@st.cache_resource(show_spinner=False)
+def _shopify_buckets():
+    """Process-wide bucket state per shop — every session and worker thread shares it."""
+    return {"shops": {}, "lock": threading.Lock()}
+
+def _shopify_domain(shop_url):
+    shop_url = shop_url.replace("https://", "").replace("http://", "").strip()
+    if not shop_url.endswith(".myshopify.com"): shop_url += ".myshopify.com"
+    return shop_url
+
+def _shopify_admin_base(shop):
+    """Admin API root for a shop. SHOPIFY_API_BASE_URL (secrets) points every Admin call at a
+    local stand-in server instead of https://<shop> — used to exercise loaders offline."""
+    try: override = str(st.secrets.get("SHOPIFY_API_BASE_URL", "") or "").rstrip("/")
+    except Exception: override = ""
+    return f"{override or 'https://' + shop}/admin/api/{SHOPIFY_API_VERSION}"
+
+def _shopify_bucket(state, shop):
+    b = state["shops"].get(shop)
+    if b is None:
+        now = time.time()
+        b = {"capacity": 40, "used": 0.0, "leak": 2.0, "t": now, "blocked_until": 0.0,
+             "gql_max": 1000.0, "gql_avail": 1000.0, "gql_restore": 50.0, "gql_t": now,
+             "gql_cost": SHOPIFY_GQL_DEFAULT_COST}
+        state["shops"][shop] = b
+    return b
+
+def _shopify_throttle_acquire(shop, graphql=False):
+    """Reserve one REST call (or one GraphQL query's estimated cost) and sleep until the bucket has room."""
+    state = _shopify_buckets()
+    with state["lock"]:
+        b = _shopify_bucket(state, shop)
+        now = time.time()
+        if graphql:
+            avail = min(b["gql_max"], b["gql_avail"] + b["gql_restore"] * (now - b["gql_t"]))
+            wait = max(0.0, (b["gql_cost"] - avail) / b["gql_restore"])
+            b["gql_avail"], b["gql_t"] = avail - b["gql_cost"], now
+        else:
+            level = max(0.0, b["used"] - b["leak"] * (now - b["t"]))
+            wait = max(0.0, (level + 1 - (b["capacity"] - SHOPIFY_BUCKET_HEADROOM)) / b["leak"])
+            b["used"], b["t"] = level + 1, now
+        wait = max(wait, b["blocked_until"] - now)
+    if wait > 0: time.sleep(wait)
+
+def _shopify_throttle_update(shop, res, body=None):
+    """Re-sync the bucket from what Shopify reported on this response."""
+    state = _shopify_buckets()
+    with state["lock"]:
+        b = _shopify_bucket(state, shop)
+        now = time.time()
+        limit = res.headers.get("X-Shopify-Shop-Api-Call-Limit", "")
+        if "/" in limit:
+            try:
+                used, cap = (int(x) for x in limit.split("/", 1))
+                b["capacity"], b["leak"] = cap, max(cap / 20.0, 1.0)
+                b["used"], b["t"] = float(used), now
+            except ValueError: pass
+        if res.status_code == 429:
+            try: retry_after = float(res.headers.get("Retry-After", "2"))
+            except ValueError: retry_after = 2.0
+            b["blocked_until"] = max(b["blocked_until"], now + retry_after)
+        cost = ((body or {}).get("extensions") or {}).get("cost") or {}
+        ts = cost.get("throttleStatus") or {}
+        if ts:
+            b["gql_max"] = float(ts.get("maximumAvailable", b["gql_max"]))
+            b["gql_avail"] = float(ts.get("currentlyAvailable", b["gql_avail"]))
+            b["gql_restore"] = max(float(ts.get("restoreRate", b["gql_restore"])), 1.0)
+            b["gql_t"] = now
+        if cost.get("requestedQueryCost"):
+            b["gql_cost"] = float(cost["requestedQueryCost"])
+
+def _shopify_request(method, shop_url, access_token, endpoint, timeout=30, retries=3, **kwargs):
+    """Admin REST call through the shared bucket. `endpoint` is relative to /admin/api/<version>/.
+    429s are retried after Retry-After; the final response is returned, exceptions propagate."""
+    shop = _shopify_domain(shop_url)
+    url = f"{_shopify_admin_base(shop)}/{endpoint}"
+    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
+    for attempt in range(retries):
+        _shopify_throttle_acquire(shop)
+        res = http_request(method, url, headers=headers, timeout=timeout, **kwargs)
+        _shopify_throttle_update(shop, res)
+        if res.status_code != 429: break
+    return res
+
+def _shopify_graphql(shop_url, access_token, query, variables=None, timeout=30, retries=3):
+    """Admin GraphQL call through the shared bucket. Returns (response, body_json_or_None).
+    THROTTLED errors are retried once the bucket has restored enough points."""
+    shop = _shopify_domain(shop_url)
+    url = f"{_shopify_admin_base(shop)}/graphql.json"
+    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
+    payload = {"query": query}
+    if variables: payload["variables"] = variables
+    body = None
+    for attempt in range(retries):
+        _shopify_throttle_acquire(shop, graphql=True)
+        res = http_post(url, headers=headers, json=payload, timeout=timeout)
+        try: body = res.json()
+        except ValueError: body = None
+        _shopify_throttle_update(shop, res, body)
+        throttled = res.status_code == 429 or any(
+            (e.get("extensions") or {}).get("code") == "THROTTLED" for e in ((body or {}).get("errors") or []) if isinstance(e, dict))
+        if not throttled: break
+    return res, body
+
 # --- SHOPIFY HELPER FUNCTIONS ---
 def update_shopify_image_seo_only(shop_url, access_token, product_id, image_seo_list, images_pil=None):
     """Update ALT TAGS in place on the product's EXISTING images — no delete/re-upload.
     Old behavior (PUT images array) replaced every image: new image IDs, new CDN URLs,
     broken references, and lost originals. Filenames are NOT changed (renaming requires
     re-upload, which we deliberately never do — CDN URLs must stay stable)."""
-    shop_url = shop_url.replace("https://", "").replace("http://", "").strip()
-    if not shop_url.endswith(".myshopify.com"): shop_url += ".myshopify.com"
-    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
-
-    list_url = f"https://{shop_url}/admin/api/2026-04/products/{product_id}/images.json"
     try:
-        r = requests.get(list_url, headers=headers, timeout=20)
+        r = _shopify_request("GET", shop_url, access_token, f"products/{product_id}/images.json", timeout=20)
     except Exception as e:
         return False, f"Connection Error: {str(e)}"
     if r.status_code != 200:
@@ -1964,50 +2233,51 @@ def update_shopify_image_seo_only(shop_url, access_token, product_id, image_seo_
         if not alt or alt == (img_info.get("alt") or ""):
             continue  # nothing to change for this image
         img_id = img_info["id"]
-        put_url = f"https://{shop_url}/admin/api/2026-04/products/{product_id}/images/{img_id}.json"
         try:
-            pr = requests.put(put_url, json={"image": {"id": img_id, "alt": alt}},
-                              headers=headers, timeout=20)
+            pr = _shopify_request("PUT", shop_url, access_token, f"products/{product_id}/images/{img_id}.json",
+                                  json={"image": {"id": img_id, "alt": alt}}, timeout=20)
             if pr.status_code in (200, 201):
                 updated += 1
             else:
                 errors.append(f"image {img_id}: {pr.status_code}")
         except Exception as e:
             errors.append(f"image {img_id}: {e}")
-        time.sleep(0.4)  # REST rate-limit safety
 
     if errors:
         return False, f"Updated {updated}, failed {len(errors)}: {'; '.join(errors[:3])}"
     return True, f"✅ Updated alt tags in place on {updated}/{len(live_images)} existing images (filenames/CDN URLs unchanged)"
 
+def _shopify_body_size_guard(shop_url, access_token, product_id, new_body):
+    """SIZE GUARD — a truncated/buggy generation must never replace a full description.
+    (A regex bug once wiped 24 product bodies; 80% floor per shopify-ai CLAUDE.md safety rules.)
+    Returns an error message when the push must be aborted, else None (after backing up the live body)."""
+    if not new_body:
+        return None
+    try:
+        cur = _shopify_request("GET", shop_url, access_token, f"products/{product_id}.json", timeout=20)
+    except Exception as e:
+        return f"⛔ SIZE GUARD: could not fetch current product to compare ({e}) — push aborted, retry."
+    if cur.status_code != 200:
+        return f"⛔ SIZE GUARD: fetch current product failed ({cur.status_code}) — push aborted, retry."
+    orig_body = (cur.json().get("product") or {}).get("body_html") or ""
+    if orig_body and len(new_body) < 0.8 * len(orig_body):
+        return (f"⛔ SIZE GUARD: new body_html {len(new_body):,} chars is under 80% of the "
+                f"live version ({len(orig_body):,} chars) — push aborted. Inspect the "
+                f"generated content for truncation before retrying.")
+    # local backup of the live body before overwriting (best-effort)
+    try:
+        with open(f"body_backup_app_{product_id}_{time.strftime('%Y%m%d')}.json", "w", encoding="utf-8") as f:
+            json.dump({"product_id": product_id, "body_html": orig_body,
+                       "saved_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f, ensure_ascii=False)
+    except Exception:
+        pass
+    return None
+
 def update_shopify_product_v2(shop_url, access_token, product_id, data, images_pil=None, upload_images=False):
-    shop_url = shop_url.replace("https://", "").replace("http://", "").strip()
-    if not shop_url.endswith(".myshopify.com"): shop_url += ".myshopify.com"
-    url = f"https://{shop_url}/admin/api/2026-04/products/{product_id}.json"
-    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
+    endpoint = f"products/{product_id}.json"
 
-    # SIZE GUARD — a truncated/buggy generation must never replace a full description.
-    # (A regex bug once wiped 24 product bodies; 80% floor per shopify-ai CLAUDE.md safety rules.)
-    new_body = data.get('html_content') or ""
-    if new_body:
-        try:
-            cur = requests.get(url, headers=headers, timeout=20)
-        except Exception as e:
-            return False, f"⛔ SIZE GUARD: could not fetch current product to compare ({e}) — push aborted, retry."
-        if cur.status_code != 200:
-            return False, f"⛔ SIZE GUARD: fetch current product failed ({cur.status_code}) — push aborted, retry."
-        orig_body = (cur.json().get("product") or {}).get("body_html") or ""
-        if orig_body and len(new_body) < 0.8 * len(orig_body):
-            return False, (f"⛔ SIZE GUARD: new body_html {len(new_body):,} chars is under 80% of the "
-                           f"live version ({len(orig_body):,} chars) — push aborted. Inspect the "
-                           f"generated content for truncation before retrying.")
-        # local backup of the live body before overwriting (best-effort)
-        try:
-            with open(f"body_backup_app_{product_id}_{time.strftime('%Y%m%d')}.json", "w", encoding="utf-8") as f:
-                json.dump({"product_id": product_id, "body_html": orig_body,
-                           "saved_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f, ensure_ascii=False)
-        except Exception:
-            pass
+    guard_err = _shopify_body_size_guard(shop_url, access_token, product_id, data.get('html_content') or "")
+    if guard_err: return False, guard_err
 
     product_payload = {
         "id": product_id,
@@ -2032,33 +2302,23 @@ def update_shopify_product_v2(shop_url, access_token, product_id, data, images_p
         if img_payloads: product_payload["images"] = img_payloads
 
     try:
-        response = requests.put(url, json={"product": product_payload}, headers=headers)
+        response = _shopify_request("PUT", shop_url, access_token, endpoint, json={"product": product_payload}, timeout=120)
         if response.status_code in [200, 201]: return True, "✅ Update Successful!"
         return False, f"Shopify API Error {response.status_code}: {response.text}"
     except Exception as e: return False, f"Connection Error: {str(e)}"
 
 def add_single_image_to_shopify(shop_url, access_token, product_id, image_bytes, file_name=None, alt_tag=None):
-    shop_url = shop_url.replace("https://", "").replace("http://", "").strip()
-    if not shop_url.endswith(".myshopify.com"): shop_url += ".myshopify.com"
-    url = f"https://{shop_url}/admin/api/2026-04/products/{product_id}/images.json"
-    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
-    
     if not image_bytes: return False, "No valid image data."
     b64_str = base64.b64encode(image_bytes).decode('utf-8')
     payload = {"image": {"attachment": b64_str, "filename": file_name or f"gen_ai_image_{int(time.time())}.jpg", "alt": alt_tag or "AI Generated Product Image"}}
     
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = _shopify_request("POST", shop_url, access_token, f"products/{product_id}/images.json", json=payload, timeout=120)
         if response.status_code in [200, 201]: return True, "✅ Added Successful!"
         return False, f"Shopify Error {response.status_code}: {response.text}"
     except Exception as e: return False, f"Connection Error: {str(e)}"
 
 def upload_only_images_to_shopify(shop_url, access_token, product_id, image_bytes_list):
-    shop_url = shop_url.replace("https://", "").replace("http://", "").strip()
-    if not shop_url.endswith(".myshopify.com"): shop_url += ".myshopify.com"
-    url = f"https://{shop_url}/admin/api/2026-04/products/{product_id}.json"
-    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
-    
     img_payloads = []
     for i, img_bytes in enumerate(image_bytes_list):
         if img_bytes:
@@ -2066,41 +2326,56 @@ def upload_only_images_to_shopify(shop_url, access_token, product_id, image_byte
     if not img_payloads: return False, "No valid images to upload."
     
     try:
-        response = requests.put(url, json={"product": {"id": product_id, "images": img_payloads}}, headers=headers)
+        response = _shopify_request("PUT", shop_url, access_token, f"products/{product_id}.json", json={"product": {"id": product_id, "images": img_payloads}}, timeout=120)
         if response.status_code in [200, 201]: return True, "✅ Upload Successful!"
         return False, f"Shopify Error {response.status_code}: {response.text}"
     except Exception as e: return False, f"Connection Error: {str(e)}"
 
-def get_shopify_product_images(shop_url, access_token, product_id):
-    shop_url = shop_url.replace("https://", "").replace("http://", "").strip()
-    if not shop_url.endswith(".myshopify.com"): shop_url += ".myshopify.com"
-    url = f"https://{shop_url}/admin/api/2026-04/products/{product_id}/images.json"
-    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
-    
+IMAGE_DOWNLOAD_WORKERS = 6
+IMAGE_DOWNLOAD_TIMEOUT = (5, 30)   # (connect, read) per image
+
+def shopify_image_variant(src, max_side):
+    """Shopify CDN size variant: .../ring.jpg?v=1 → .../ring_1024x1024.jpg?v=1 (CDN resizes, never upscales)."""
+    if not max_side or "cdn.shopify.com" not in src: return src
+    parsed = urllib.parse.urlsplit(src)
+    path = re.sub(r"(\.[A-Za-z0-9]+)$", rf"_{max_side}x{max_side}\1", parsed.path, count=1)
+    return urllib.parse.urlunsplit(parsed._replace(path=path))
+
+def _download_image(src, max_side=None):
+    """Fetch + decode one image; the size variant falls back to the original if the CDN refuses it."""
+    for url in dict.fromkeys([shopify_image_variant(src, max_side), src]):
+        try:
+            res = http_get(url, timeout=IMAGE_DOWNLOAD_TIMEOUT)
+            if res.status_code != 200: continue
+            img_pil = Image.open(BytesIO(res.content))
+            img_pil.load()   # decode here, in the worker thread
+            if img_pil.mode in ('RGBA', 'P'): img_pil = img_pil.convert('RGB')
+            return img_pil
+        except Exception:
+            continue
+    return None
+
+def download_images(srcs, max_side=None, max_workers=IMAGE_DOWNLOAD_WORKERS):
+    """Download several images concurrently. Returns PIL images in input order (failures dropped)."""
+    if not srcs: return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(srcs))) as pool:
+        results = list(pool.map(lambda s: _download_image(s, max_side), srcs))
+    return [img for img in results if img is not None]
+
+def get_shopify_product_images(shop_url, access_token, product_id, max_side=None):
+    """All product images as PIL, fetched in parallel. max_side (e.g. 1024) asks the CDN for a
+    resized variant — enough for AI input; leave None when full resolution is needed."""
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = _shopify_request("GET", shop_url, access_token, f"products/{product_id}/images.json", timeout=10)
         if response.status_code == 200:
-            pil_images = []
-            for img_info in response.json().get("images", []):
-                src = img_info.get("src")
-                if src:
-                    img_resp = requests.get(src, stream=True)
-                    if img_resp.status_code == 200:
-                        img_pil = Image.open(BytesIO(img_resp.content))
-                        if img_pil.mode in ('RGBA', 'P'): img_pil = img_pil.convert('RGB')
-                        pil_images.append(img_pil)
-            return pil_images, None
+            srcs = [img_info.get("src") for img_info in response.json().get("images", []) if img_info.get("src")]
+            return download_images(srcs, max_side=max_side), None
         return None, f"Shopify API Error {response.status_code}: {response.text}"
     except Exception as e: return None, f"Connection Error: {str(e)}"
 
 def get_shopify_product_details(shop_url, access_token, product_id):
-    shop_url = shop_url.replace("https://", "").replace("http://", "").strip()
-    if not shop_url.endswith(".myshopify.com"): shop_url += ".myshopify.com"
-    url = f"https://{shop_url}/admin/api/2026-04/products/{product_id}.json"
-    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
-    
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = _shopify_request("GET", shop_url, access_token, f"products/{product_id}.json", timeout=10)
         if response.status_code == 200:
             prod = response.json().get("product", {})
             return prod.get("body_html", ""), prod.get("title", ""), prod.get("handle", ""), None
@@ -2109,11 +2384,6 @@ def get_shopify_product_details(shop_url, access_token, product_id):
 
 def search_shopify_product_by_sku(shop_url, access_token, sku):
     """Search for a product by SKU via Shopify Admin API GraphQL."""
-    shop_url = shop_url.replace("https://", "").replace("http://", "").strip()
-    if not shop_url.endswith(".myshopify.com"): shop_url += ".myshopify.com"
-    url = f"https://{shop_url}/admin/api/2026-04/graphql.json"
-    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
-    
     query = """
     {
       productVariants(first: 1, query: "sku:%s") {
@@ -2133,9 +2403,8 @@ def search_shopify_product_by_sku(shop_url, access_token, sku):
     """ % sku.replace('"', '\\"')
     
     try:
-        response = requests.post(url, headers=headers, json={"query": query}, timeout=15)
-        if response.status_code == 200:
-            data = response.json()
+        response, data = _shopify_graphql(shop_url, access_token, query, timeout=15)
+        if response.status_code == 200 and data:
             edges = data.get("data", {}).get("productVariants", {}).get("edges", [])
             if edges:
                 node = edges[0]["node"]
@@ -2149,19 +2418,13 @@ def search_shopify_product_by_sku(shop_url, access_token, sku):
 
 # --- SHOPIFY ADMIN: LIST PRODUCTS & COLLECTIONS ---
 def _shopify_admin_get(shop_url, access_token, endpoint, timeout=30, retries=3):
-    """Robust GET for Shopify Admin API with retry and timeout."""
-    shop_url = shop_url.replace("https://", "").replace("http://", "").strip()
-    if not shop_url.endswith(".myshopify.com"): shop_url += ".myshopify.com"
-    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
-    url = f"https://{shop_url}/admin/api/2026-04/{endpoint}"
-    
+    """Robust GET for Shopify Admin API with retry and timeout.
+    Rate limiting (bucket pacing + 429 Retry-After) is handled by _shopify_request."""
     for attempt in range(retries):
         try:
-            res = requests.get(url, headers=headers, timeout=timeout)
+            res = _shopify_request("GET", shop_url, access_token, endpoint, timeout=timeout, retries=retries)
             if res.status_code == 200:
                 return res, None
-            elif res.status_code == 429:  # Rate limited
-                time.sleep(2 * (attempt + 1)); continue
             else:
                 return None, f"Error {res.status_code}: {res.text[:200]}"
         except requests.exceptions.Timeout:
@@ -2188,7 +2451,7 @@ def get_shopify_all_collections(shop_url, access_token):
             if not items: break
             for c in items:
                 col_type = "custom" if ctype == "custom_collections" else "smart"
-                all_collections.append({"id": c["id"], "title": c.get("title", ""), "handle": c.get("handle", ""), "type": col_type, "body_html": c.get("body_html", "")})
+                all_collections.append({"id": c["id"], "title": c.get("title", ""), "handle": c.get("handle", ""), "type": col_type, "body_html": c.get("body_html", ""), "updated_at": c.get("updated_at", "")})
             # Check for next page
             cursor = None
             link_header = res.headers.get("Link", "")
@@ -2198,18 +2461,22 @@ def get_shopify_all_collections(shop_url, access_token):
                         qp = urllib.parse.parse_qs(urllib.parse.urlparse(part.split(";")[0].strip().strip("<>")).query)
                         cursor = qp.get("page_info", [None])[0]
             if not cursor: break
-            time.sleep(0.2)
     return all_collections
 
-def get_shopify_products_page(shop_url, access_token, limit=250, page_info=None, collection_id=None):
-    """Fetch one page of products from Shopify admin."""
+def get_shopify_products_page(shop_url, access_token, limit=250, page_info=None, collection_id=None, updated_at_min=None, fields=None):
+    """Fetch one page of products from Shopify admin.
+    updated_at_min (ISO 8601) limits the walk to products changed since then; fields trims the payload."""
     if page_info:
-        # Cursor pagination — page_info already encodes the full query, just append it
+        # Cursor pagination — page_info already encodes the full query, just append it (only limit/fields may ride along)
         endpoint = f"products.json?limit={limit}&page_info={page_info}"
     elif collection_id:
         endpoint = f"collections/{collection_id}/products.json?limit={limit}"
     else:
         endpoint = f"products.json?limit={limit}"
+        if updated_at_min:
+            endpoint += f"&updated_at_min={urllib.parse.quote(updated_at_min)}"
+    if fields:
+        endpoint += f"&fields={fields}"
     
     res, err = _shopify_admin_get(shop_url, access_token, endpoint, timeout=60)
     if err:
@@ -2231,14 +2498,14 @@ def get_shopify_products_page(shop_url, access_token, limit=250, page_info=None,
             "all_skus": ", ".join(sku_list[:3]),
             "variants_count": len(p.get("variants", [])),
             "image_url": p.get("image", {}).get("src", "") if p.get("image") else "",
-            "body_html": p.get("body_html", ""),
+            "updated_at": p.get("updated_at", ""),
         })
+        if "body_html" in p: products[-1]["body_html"] = p["body_html"]   # absent from slim listings (fields=)
     
     # Parse next page cursor from Link header
     next_cursor = None
     link_header = res.headers.get("Link", "")
     if 'rel="next"' in link_header:
-        import urllib.parse
         for part in link_header.split(","):
             if 'rel="next"' in part:
                 url_part = part.split(";")[0].strip().strip("<>")
@@ -2248,13 +2515,14 @@ def get_shopify_products_page(shop_url, access_token, limit=250, page_info=None,
     
     return products, next_cursor, None
 
-def get_shopify_all_products(shop_url, access_token, collection_id=None, max_pages=50, progress_callback=None):
+def get_shopify_all_products(shop_url, access_token, collection_id=None, max_pages=50, progress_callback=None, updated_at_min=None, fields=None):
     """Fetch all products (paginated) from Shopify admin."""
     all_products = []
     cursor = None
     for page_num in range(max_pages):
         products, next_cursor, err = get_shopify_products_page(
-            shop_url, access_token, limit=250, page_info=cursor, collection_id=collection_id if not cursor else None
+            shop_url, access_token, limit=250, page_info=cursor, collection_id=collection_id if not cursor else None,
+            updated_at_min=updated_at_min, fields=fields
         )
         if err and not products:
             if all_products:
@@ -2266,16 +2534,692 @@ def get_shopify_all_products(shop_url, access_token, collection_id=None, max_pag
         if not next_cursor:
             break
         cursor = next_cursor
-        time.sleep(0.5)
     return all_products, None
 
+# --- BULK CATALOG EXPORT (GraphQL bulkOperationRunQuery) ---
+# One server-side job exports the whole catalog to a JSONL file; we poll it and stream-parse
+# the result instead of walking products.json 250 at a time. Nested connections come back as
+# separate lines carrying "__parentId", so children are grouped onto their product as we read.
+SHOPIFY_BULK_PRODUCTS_QUERY = """
+{
+  products%s {
+    edges {
+      node {
+        id title handle productType status updatedAt
+        featuredImage { url }
+        variants { edges { node { id sku inventoryQuantity } } }
+        images { edges { node { id url altText } } }
+        collections { edges { node { id } } }
+        metafields(namespace: "global") { edges { node { id namespace key value } } }
+      }
+    }
+  }
+}
+"""
+
+def _shopify_gid_num(gid):
+    """gid://shopify/Product/123 → "123" (the numeric id REST and the rest of the app use)."""
+    return str(gid or "").rsplit("/", 1)[-1]
+
+def _shopify_bulk_start(shop_url, access_token, query_filter=""):
+    """Kick off a bulk export. Returns (bulk_operation_gid, err)."""
+    inner = SHOPIFY_BULK_PRODUCTS_QUERY % (f'(query: {json.dumps(query_filter)})' if query_filter else "")
+    mutation = "mutation($q: String!) { bulkOperationRunQuery(query: $q) { bulkOperation { id status } userErrors { field message } } }"
+    try:
+        res, body = _shopify_graphql(shop_url, access_token, mutation, {"q": inner})
+    except Exception as e:
+        return None, f"Connection Error: {e}"
+    if res.status_code != 200 or not body:
+        return None, f"Shopify API Error {res.status_code}: {res.text[:200]}"
+    if body.get("errors"):
+        return None, "; ".join(str(e.get("message", e)) if isinstance(e, dict) else str(e) for e in body["errors"])
+    run = (body.get("data") or {}).get("bulkOperationRunQuery") or {}
+    if run.get("userErrors"):
+        return None, "; ".join(e.get("message", "") for e in run["userErrors"])
+    op = run.get("bulkOperation") or {}
+    if not op.get("id"):
+        return None, "Bulk operation did not start"
+    return op["id"], None
+
+def _shopify_bulk_wait(shop_url, access_token, op_id, progress_callback=None, timeout=900):
+    """Poll the bulk operation until it finishes. Returns (result_url_or_None, err).
+    A completed export with zero objects has no URL — that is an empty catalog, not an error."""
+    query = "query($id: ID!) { node(id: $id) { ... on BulkOperation { id status errorCode objectCount url partialDataUrl } } }"
+    deadline = time.time() + timeout
+    delay = 1.0
+    while True:
+        try:
+            res, body = _shopify_graphql(shop_url, access_token, query, {"id": op_id})
+        except Exception as e:
+            return None, f"Connection Error: {e}"
+        op = ((body or {}).get("data") or {}).get("node") or {}
+        status = op.get("status", "")
+        if progress_callback:
+            progress_callback(int(op.get("objectCount") or 0), status.lower() or "waiting")
+        if status == "COMPLETED":
+            return op.get("url"), None
+        if status in ("FAILED", "CANCELED", "CANCELING", "EXPIRED"):
+            return None, f"Bulk operation {status.lower()}: {op.get('errorCode') or 'no error code'}"
+        if res.status_code != 200:
+            return None, f"Shopify API Error {res.status_code}: {res.text[:200]}"
+        if time.time() > deadline:
+            return None, f"Bulk operation still {status.lower() or 'pending'} after {timeout}s"
+        time.sleep(delay)
+        delay = min(delay * 1.5, 5.0)
+
+def _shopify_bulk_product(node):
+    return {
+        "id": _shopify_gid_num(node.get("id")),
+        "title": node.get("title", "") or "",
+        "handle": node.get("handle", "") or "",
+        "product_type": node.get("productType", "") or "",
+        "status": (node.get("status") or "").lower(),
+        "total_inventory": 0,
+        "sku": "",
+        "all_skus": "",
+        "variants_count": 0,
+        "image_url": (node.get("featuredImage") or {}).get("url", "") or "",
+        "updated_at": node.get("updatedAt", "") or "",
+        "collection_ids": [],
+        "images": [],
+        "metafields": {},
+        "_skus": [],
+    }
+
+def _shopify_bulk_attach(prod, child):
+    kind = str(child.get("id", "")).split("/")[-2] if child.get("id") else ""
+    if kind == "ProductVariant":
+        prod["variants_count"] += 1
+        prod["total_inventory"] += child.get("inventoryQuantity") or 0
+        if child.get("sku"): prod["_skus"].append(child["sku"])
+    elif kind in ("ProductImage", "Image", "MediaImage"):
+        prod["images"].append({"id": _shopify_gid_num(child["id"]), "src": child.get("url", ""), "alt": child.get("altText") or ""})
+    elif kind == "Collection":
+        prod["collection_ids"].append(_shopify_gid_num(child["id"]))
+    elif kind == "Metafield":
+        prod["metafields"][f"{child.get('namespace', '')}.{child.get('key', '')}"] = child.get("value", "")
+
+def _shopify_bulk_parse(lines, progress_callback=None):
+    """Stream-parse bulk JSONL lines into get_shopify_products_page-shaped dicts (plus
+    updated_at, collection_ids, images and metafields). Order follows the export."""
+    products, by_gid, orphans = [], {}, {}
+    for n, line in enumerate(lines, 1):
+        if not line: continue
+        try: obj = json.loads(line)
+        except ValueError: continue
+        parent = obj.get("__parentId")
+        if parent is None:
+            prod = _shopify_bulk_product(obj)
+            by_gid[obj.get("id")] = prod
+            products.append(prod)
+            for child in orphans.pop(obj.get("id"), []): _shopify_bulk_attach(prod, child)
+        elif parent in by_gid:
+            _shopify_bulk_attach(by_gid[parent], obj)
+        else:
+            orphans.setdefault(parent, []).append(obj)
+        if progress_callback and n % 1000 == 0:
+            progress_callback(len(products), "downloading")
+    for prod in products:
+        skus = prod.pop("_skus")
+        prod["sku"] = skus[0] if skus else ""
+        prod["all_skus"] = ", ".join(skus[:3])
+        if not prod["image_url"] and prod["images"]:
+            prod["image_url"] = prod["images"][0]["src"]
+    return products
+
+def get_shopify_all_products_bulk(shop_url, access_token, query_filter="", progress_callback=None, timeout=900):
+    """Load the whole catalog with one bulk operation. Returns (products, err).
+    progress_callback(count, phase) is called while the job runs and while the file streams in."""
+    op_id, err = _shopify_bulk_start(shop_url, access_token, query_filter)
+    if err: return [], err
+    url, err = _shopify_bulk_wait(shop_url, access_token, op_id, progress_callback, timeout)
+    if err: return [], err
+    if not url: return [], None
+    try:
+        res = http_get(url, stream=True, timeout=120)
+        if res.status_code != 200:
+            return [], f"Bulk download failed: HTTP {res.status_code}"
+        with res:
+            products = _shopify_bulk_parse(res.iter_lines(decode_unicode=True), progress_callback)
+    except Exception as e:
+        return [], f"Bulk download failed: {e}"
+    if progress_callback: progress_callback(len(products), "done")
+    return products, None
+
+# --- LOCAL CATALOG STORE (SQLite) ---
+# One on-disk database shared by every session: products keyed by (shop, id) with their
+# updated_at, so a reload only fetches what changed since the last sync (updated_at_min).
+# Path comes from APP_DB_PATH in secrets; defaults to a file next to this script.
+APP_DB_FILENAME = "app_cache.sqlite3"
+CATALOG_SYNC_OVERLAP = 60   # seconds re-read on each incremental sync to cover clock skew / in-flight edits
+# Listings fetch only what the product table shows; body_html is loaded per product when it is needed
+CATALOG_LISTING_FIELDS = "id,title,handle,product_type,status,variants,image,updated_at"
+CATALOG_BODY_CHUNK = 250    # ids per products.json?ids= call when loading bodies
+APP_DB_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS products (
+        shop TEXT NOT NULL, id TEXT NOT NULL, updated_at TEXT, data TEXT NOT NULL,
+        PRIMARY KEY (shop, id))""",
+    """CREATE TABLE IF NOT EXISTS collections (
+        shop TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL,
+        PRIMARY KEY (shop, id))""",
+    """CREATE TABLE IF NOT EXISTS catalog_sync (
+        shop TEXT PRIMARY KEY, synced_at TEXT, product_count INTEGER, collections_at REAL)""",
+    """CREATE TABLE IF NOT EXISTS collection_members (
+        shop TEXT NOT NULL, collection_id TEXT NOT NULL, product_id TEXT NOT NULL,
+        PRIMARY KEY (shop, collection_id, product_id))""",
+    "CREATE INDEX IF NOT EXISTS collection_members_product ON collection_members (shop, product_id)",
+    """CREATE TABLE IF NOT EXISTS collection_index (
+        shop TEXT NOT NULL, collection_id TEXT NOT NULL, updated_at TEXT, indexed_at REAL,
+        PRIMARY KEY (shop, collection_id))""",
+    """CREATE TABLE IF NOT EXISTS collection_summaries (
+        shop TEXT NOT NULL, collection_id TEXT NOT NULL, version TEXT NOT NULL, summary TEXT, created REAL,
+        PRIMARY KEY (shop, collection_id, version))""",
+    """CREATE TABLE IF NOT EXISTS storefront_pages (
+        domain TEXT NOT NULL, kind TEXT NOT NULL, page INTEGER NOT NULL, etag TEXT, last_modified TEXT,
+        items TEXT, checked REAL, PRIMARY KEY (domain, kind, page))""",
+    """CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY, provider TEXT, model TEXT, created REAL, accessed REAL,
+        size INTEGER, hits INTEGER DEFAULT 0, response TEXT)""",
+    "CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)",
+    """CREATE TABLE IF NOT EXISTS batch_jobs (
+        id TEXT PRIMARY KEY, shop TEXT, model TEXT, auto_update INTEGER, created REAL, total INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS batch_job_items (
+        job_id TEXT NOT NULL, product_id TEXT NOT NULL, position INTEGER, state TEXT, opening_angle TEXT,
+        product TEXT, payload TEXT, error TEXT, update_msg TEXT, updated REAL,
+        PRIMARY KEY (job_id, product_id))""",
+    """CREATE TABLE IF NOT EXISTS llm_usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL, day TEXT, run_id TEXT, provider TEXT, model TEXT,
+        task TEXT, images INTEGER, input_tokens INTEGER, output_tokens INTEGER, latency_s REAL,
+        cost_usd REAL, cached INTEGER, ok INTEGER)""",
+    "CREATE INDEX IF NOT EXISTS llm_usage_day ON llm_usage (day)",
+    "CREATE INDEX IF NOT EXISTS llm_usage_run ON llm_usage (run_id)",
+]
+# Columns added after a table first shipped: (table, column, type) — added on startup when missing
+APP_DB_COLUMNS = [
+    ("llm_usage", "cache_read_tokens", "INTEGER"),
+    ("llm_usage", "cache_write_tokens", "INTEGER"),
+    ("batch_jobs", "mode", "TEXT"),                 # NULL = live calls, "offline" = provider batch API
+    ("batch_jobs", "provider_batches", "TEXT"),     # JSON list of submitted provider batches
+    ("batch_jobs", "claimed_by", "TEXT"),           # run currently working the job (see batch_job_claim)
+    ("batch_jobs", "claimed_at", "REAL"),           # last heartbeat of that run
+    ("catalog_sync", "members_at", "REAL"),         # last write to collection_members (in-memory index stamp)
+    ("products", "body_html", "TEXT"),              # loaded on demand — listings never carry bodies
+    ("products", "body_at", "TEXT"),                # products.updated_at the stored body belongs to
+]
+
+_DB_PATH = contextvars.ContextVar("app_db_path", default=None)   # set for background jobs (no secrets context)
+
+def _db_path():
+    if _DB_PATH.get(): return _DB_PATH.get()
+    try: path = str(st.secrets.get("APP_DB_PATH", "") or "")
+    except Exception: path = ""
+    return path or os.path.join(os.path.dirname(os.path.abspath(__file__)), APP_DB_FILENAME)
+
+@st.cache_resource(show_spinner=False)
+def _db_ready(path):
+    """Create the schema once per process (WAL so readers never block the sync writer)."""
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        for stmt in APP_DB_SCHEMA: conn.execute(stmt)
+        for table, column, decl in APP_DB_COLUMNS:
+            if column not in {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        conn.commit()
+    finally:
+        conn.close()
+    return True
+
+@contextlib.contextmanager
+def _db():
+    """Short-lived connection (sqlite3 connections must not cross threads); commits on success."""
+    path = _db_path()
+    _db_ready(path)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+def catalog_products(shop_url):
+    """All stored products for a shop, in product-id order (same order products.json returns).
+    Listing rows only — no body_html; catalog_product_bodies loads that for the products that need it."""
+    shop = _shopify_domain(shop_url)
+    try:
+        with _db() as conn:
+            rows = conn.execute("SELECT data FROM products WHERE shop = ? ORDER BY CAST(id AS INTEGER)", (shop,)).fetchall()
+    except sqlite3.Error:
+        return []
+    products = [json.loads(r["data"]) for r in rows]
+    for p in products: p.pop("body_html", None)   # rows stored before bodies moved to their own column
+    return products
+
+def _catalog_upsert(conn, shop, products):
+    """Store listing rows. A stored body is kept — it stays valid while body_at matches updated_at."""
+    conn.executemany("INSERT INTO products (shop, id, updated_at, data) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT(shop, id) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data",
+                     [(shop, p["id"], p.get("updated_at", ""), json.dumps({k: v for k, v in p.items() if k != "body_html"}))
+                      for p in products])
+
+def catalog_product_bodies(shop_url, access_token, products):
+    """Copies of products with body_html filled in. Stored bodies are used while they belong to the
+    product's current updated_at; the rest come from Shopify (ids + body only, one call per
+    CATALOG_BODY_CHUNK) and are stored. Returns (products, err) — on err the unloaded bodies are ""."""
+    shop = _shopify_domain(shop_url)
+    ids = [str(p["id"]) for p in products]
+    bodies, current = {}, {}
+    with _db() as conn:
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = conn.execute(f"SELECT id, updated_at, body_html, body_at, data FROM products "
+                                f"WHERE shop = ? AND id IN ({','.join('?' * len(chunk))})", (shop, *chunk))
+            for r in rows:
+                current[r["id"]] = r["updated_at"]
+                if r["body_html"] is not None and r["body_at"] == r["updated_at"]:
+                    bodies[r["id"]] = r["body_html"]
+                elif '"body_html"' in r["data"]:
+                    # Written before bodies moved out of data — untouched since, so still current
+                    legacy = json.loads(r["data"]).get("body_html")
+                    if legacy is not None: bodies[r["id"]] = legacy
+    missing = [i for i in dict.fromkeys(ids) if i not in bodies]
+    err = None
+    for start in range(0, len(missing), CATALOG_BODY_CHUNK):
+        chunk = missing[start:start + CATALOG_BODY_CHUNK]
+        res, err = _shopify_admin_get(shop_url, access_token,
+                                      f"products.json?ids={','.join(chunk)}&limit={len(chunk)}&fields=id,body_html", timeout=60)
+        if err: break
+        fetched = {str(p["id"]): p.get("body_html") or "" for p in res.json().get("products", [])}
+        bodies.update(fetched)
+        with _db() as conn:
+            conn.executemany("UPDATE products SET body_html = ?, body_at = ? WHERE shop = ? AND id = ?",
+                             [(body, current[pid], shop, pid) for pid, body in fetched.items() if pid in current])
+    return [{**p, "body_html": bodies.get(str(p["id"]), p.get("body_html") or "")} for p in products], err
+
+def catalog_sync_info(shop_url):
+    """{"synced_at", "product_count", "collections_at"} of the last sync, or None if never synced."""
+    shop = _shopify_domain(shop_url)
+    try:
+        with _db() as conn:
+            row = conn.execute("SELECT synced_at, product_count, collections_at FROM catalog_sync WHERE shop = ?", (shop,)).fetchone()
+    except sqlite3.Error:
+        return None
+    return dict(row) if row else None
+
+def catalog_find(shop_url, term):
+    """Look a product up by exact SKU, handle or id in the stored catalog. Returns the product dict or None."""
+    term = (term or "").strip().lower()
+    if not term: return None
+    for p in catalog_products(shop_url):
+        skus = [s.strip().lower() for s in (p.get("all_skus") or "").split(",")]
+        if term in (p.get("id", ""), (p.get("handle") or "").lower(), (p.get("sku") or "").lower()) or term in skus:
+            return p
+    return None
+
+def catalog_collection_products(shop_url, collection_id):
+    """Stored products that belong to a collection, from the membership index (or, before the
+    index exists, the collection ids bulk-loaded rows carry)."""
+    ids = catalog_collection_members(shop_url, collection_id)
+    if ids is None:
+        cid = str(collection_id)
+        return [p for p in catalog_products(shop_url) if cid in (p.get("collection_ids") or [])]
+    return [p for p in catalog_products(shop_url) if p["id"] in ids]
+
+def catalog_collections(shop_url, access_token, refresh=False):
+    """Collections from the store; fetched from Shopify on first use or when refresh=True."""
+    shop = _shopify_domain(shop_url)
+    info = catalog_sync_info(shop_url)
+    if not refresh and info and info.get("collections_at"):
+        with _db() as conn:
+            rows = conn.execute("SELECT data FROM collections WHERE shop = ? ORDER BY rowid", (shop,)).fetchall()
+        return [json.loads(r["data"]) for r in rows]
+    collections = get_shopify_all_collections(shop_url, access_token)
+    if collections:
+        with _db() as conn:
+            conn.execute("DELETE FROM collections WHERE shop = ?", (shop,))
+            conn.executemany("INSERT INTO collections (shop, id, data) VALUES (?, ?, ?)",
+                             [(shop, str(c["id"]), json.dumps(c)) for c in collections])
+            conn.execute("INSERT INTO catalog_sync (shop, collections_at) VALUES (?, ?) "
+                         "ON CONFLICT(shop) DO UPDATE SET collections_at = excluded.collections_at", (shop, time.time()))
+    return collections
+
+def catalog_sync(shop_url, access_token, full=False, progress_callback=None):
+    """Bring the stored catalog up to date and return (products, info, err).
+    First run (or full=True): whole catalog via the bulk export, falling back to products.json.
+    Afterwards: only products with updated_at >= last sync; deletions are detected by comparing
+    counts and, on mismatch, walking ids only. info = {"mode", "changed", "deleted"}."""
+    shop = _shopify_domain(shop_url)
+    last = catalog_sync_info(shop_url) or {}
+    started = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(time.time() - CATALOG_SYNC_OVERLAP))
+    info = {"mode": "incremental", "changed": 0, "deleted": 0}
+
+    if full or not last.get("synced_at"):
+        info["mode"] = "full"
+        products, err = get_shopify_all_products_bulk(shop_url, access_token, progress_callback=progress_callback)
+        bulk_ok = not err
+        if err:
+            # Bulk export refused (missing scope, another bulk job running, ...) — walk products.json instead
+            page_cb = (lambda count, page: progress_callback(count, f"page {page}")) if progress_callback else None
+            products, err = get_shopify_all_products(shop_url, access_token, progress_callback=page_cb,
+                                                     fields=CATALOG_LISTING_FIELDS)
+        if err and not products:
+            return catalog_products(shop_url), info, err
+        with _db() as conn:
+            if not err:   # only a complete load may drop rows the store no longer has
+                keep = {p["id"] for p in products}
+                gone = [r[0] for r in conn.execute("SELECT id FROM products WHERE shop = ?", (shop,)) if r[0] not in keep]
+                conn.executemany("DELETE FROM products WHERE shop = ? AND id = ?", [(shop, i) for i in gone])
+            _catalog_upsert(conn, shop, products)
+            if bulk_ok:
+                _collection_members_rebuild(conn, shop, products)
+            else:   # REST rows carry no memberships — every collection gets crawled below
+                conn.execute("DELETE FROM collection_index WHERE shop = ?", (shop,))
+                _collection_members_stamp(conn, shop)
+        info["changed"] = len(products)
+    else:
+        page_cb = (lambda count, page: progress_callback(count, f"changed products, page {page}")) if progress_callback else None
+        changed, err = get_shopify_all_products(shop_url, access_token, updated_at_min=last["synced_at"], progress_callback=page_cb,
+                                                fields=CATALOG_LISTING_FIELDS)
+        if err and not changed:
+            return catalog_products(shop_url), info, err
+        # A changed product may have joined or left collections (tags feed smart-collection rules)
+        memberships, members_err = {}, None
+        with _db() as conn:
+            n_collections = conn.execute("SELECT COUNT(*) FROM collections WHERE shop = ?", (shop,)).fetchone()[0]
+        if n_collections and len(changed) > COLLECTION_MEMBERS_CHUNK * n_collections:
+            # Mass edit: re-crawling every collection is fewer calls than looking products up
+            with _db() as conn:
+                conn.execute("DELETE FROM collection_index WHERE shop = ?", (shop,))
+                _collection_members_stamp(conn, shop)
+        elif changed:
+            if progress_callback: progress_callback(len(changed), "collection memberships")
+            memberships, members_err = _shopify_product_collection_ids(shop_url, access_token, [p["id"] for p in changed])
+        with _db() as conn:
+            for p in changed:
+                row = conn.execute("SELECT data FROM products WHERE shop = ? AND id = ?", (shop, p["id"])).fetchone()
+                if row:
+                    # REST rows lack the bulk-only fields (collection_ids, images, metafields) — keep the stored ones
+                    p = {**json.loads(row["data"]), **p}
+                if p["id"] in memberships:
+                    p["collection_ids"] = memberships[p["id"]]
+                _catalog_upsert(conn, shop, [p])
+            _collection_members_set_products(conn, shop, memberships)
+        info["changed"] = len(changed)
+        # Unresolved memberships hold the watermark back, so the next sync re-reads those products
+        err = err or members_err
+        # Deleted products never show up in an updated_at_min walk — reconcile ids when the counts disagree
+        count_res, _ = _shopify_admin_get(shop_url, access_token, "products/count.json")
+        with _db() as conn:
+            local_count = conn.execute("SELECT COUNT(*) FROM products WHERE shop = ?", (shop,)).fetchone()[0]
+        if count_res is not None and count_res.json().get("count") != local_count:
+            remote, id_err = get_shopify_all_products(shop_url, access_token, fields="id")
+            if not id_err:
+                remote_ids = {p["id"] for p in remote}
+                with _db() as conn:
+                    local_ids = {r[0] for r in conn.execute("SELECT id FROM products WHERE shop = ?", (shop,))}
+                    gone = local_ids - remote_ids
+                    conn.executemany("DELETE FROM products WHERE shop = ? AND id = ?", [(shop, i) for i in gone])
+                    _collection_members_set_products(conn, shop, {i: [] for i in gone})
+                info["deleted"] = len(gone)
+
+    catalog_index_collections(shop_url, access_token, progress_callback)
+    products = catalog_products(shop_url)
+    if err:   # partial walk — keep the old watermark so the next sync retries the gap
+        return products, info, err
+    with _db() as conn:
+        conn.execute("INSERT INTO catalog_sync (shop, synced_at, product_count) VALUES (?, ?, ?) "
+                     "ON CONFLICT(shop) DO UPDATE SET synced_at = excluded.synced_at, product_count = excluded.product_count",
+                     (shop, started, len(products)))
+    return products, info, err
+
+# --- COLLECTION MEMBERSHIP INDEX ---
+# collection id → product ids for every custom and smart collection, stored next to the catalog so
+# the Batch Writer collection filter is a set lookup instead of a collects/products crawl. A full
+# bulk sync rebuilds it from each product's collection ids; incremental syncs re-read memberships of
+# the changed products (GraphQL nodes) and re-crawl only collections whose updated_at moved (rule
+# edits, manual adds). collection_index records which collections are covered, and at which updated_at.
+COLLECTION_MEMBERS_CHUNK = 5   # products per nodes() call — 5 × collections(first: 100) stays well under the 1000-point cost cap
+PRODUCT_COLLECTIONS_QUERY = """
+query($ids: [ID!]!) {
+  nodes(ids: $ids) {
+    ... on Product { id collections(first: 100) { pageInfo { hasNextPage endCursor } edges { node { id } } } }
+  }
+}
+"""
+PRODUCT_COLLECTIONS_PAGE_QUERY = """
+query($id: ID!, $after: String) {
+  product(id: $id) { collections(first: 250, after: $after) { pageInfo { hasNextPage endCursor } edges { node { id } } } }
+}
+"""
+
+def _shopify_next_page_info(res):
+    """page_info cursor of the rel="next" Link header, or None on the last page."""
+    for part in res.headers.get("Link", "").split(","):
+        if 'rel="next"' in part:
+            qp = urllib.parse.parse_qs(urllib.parse.urlparse(part.split(";")[0].strip().strip("<>")).query)
+            return qp.get("page_info", [None])[0]
+    return None
+
+def _shopify_product_collection_ids(shop_url, access_token, product_ids):
+    """Collections (custom and smart) each product belongs to. Returns ({product_id: [collection_id]}, err);
+    products Shopify no longer has map to []. Stops at the first failed call with what it has so far."""
+    out = {}
+    ids = [str(i) for i in product_ids]
+    for start in range(0, len(ids), COLLECTION_MEMBERS_CHUNK):
+        chunk = ids[start:start + COLLECTION_MEMBERS_CHUNK]
+        try:
+            res, body = _shopify_graphql(shop_url, access_token, PRODUCT_COLLECTIONS_QUERY,
+                                         {"ids": [f"gid://shopify/Product/{i}" for i in chunk]})
+        except Exception as e:
+            return out, f"Collection membership lookup failed: {e}"
+        nodes = ((body or {}).get("data") or {}).get("nodes")
+        if res.status_code != 200 or nodes is None:
+            return out, f"Collection membership lookup failed: HTTP {res.status_code} {res.text[:200]}"
+        found = {}
+        for node in nodes:
+            if not node: continue
+            gid, conn = node.get("id"), node.get("collections") or {}
+            cids = [_shopify_gid_num(e["node"]["id"]) for e in conn.get("edges", [])]
+            page = conn.get("pageInfo") or {}
+            while page.get("hasNextPage"):   # rare: product in more than 100 collections
+                try:
+                    res, body = _shopify_graphql(shop_url, access_token, PRODUCT_COLLECTIONS_PAGE_QUERY,
+                                                 {"id": gid, "after": page.get("endCursor")})
+                except Exception as e:
+                    return out, f"Collection membership lookup failed: {e}"
+                more = (((body or {}).get("data") or {}).get("product") or {}).get("collections")
+                if res.status_code != 200 or more is None:
+                    return out, f"Collection membership lookup failed: HTTP {res.status_code} {res.text[:200]}"
+                cids += [_shopify_gid_num(e["node"]["id"]) for e in more.get("edges", [])]
+                page = more.get("pageInfo") or {}
+            found[_shopify_gid_num(gid)] = cids
+        for i in chunk:
+            out[i] = found.get(i, [])
+    return out, None
+
+def _shopify_collection_product_ids(shop_url, access_token, collection_id):
+    """Ids of every product in one collection (custom or smart). Returns (set, err)."""
+    ids, cursor = set(), None
+    for _ in range(200):
+        ep = f"collections/{collection_id}/products.json?limit=250&fields=id"
+        if cursor: ep += f"&page_info={cursor}"
+        res, err = _shopify_admin_get(shop_url, access_token, ep)
+        if err: return ids, err
+        ids.update(str(p["id"]) for p in res.json().get("products", []))
+        cursor = _shopify_next_page_info(res)
+        if not cursor: break
+    return ids, None
+
+def _collection_members_stamp(conn, shop):
+    """Mark the shop's membership index as changed so the in-memory copy is reloaded."""
+    conn.execute("INSERT INTO catalog_sync (shop, members_at) VALUES (?, ?) "
+                 "ON CONFLICT(shop) DO UPDATE SET members_at = excluded.members_at", (shop, time.time()))
+
+def _collection_members_rebuild(conn, shop, products):
+    """Replace the whole index from bulk-loaded products (each carries its collection_ids).
+    Every stored collection counts as covered — one no product points at is simply empty."""
+    stored = {r[0]: json.loads(r[1]).get("updated_at", "") for r in
+              conn.execute("SELECT id, data FROM collections WHERE shop = ?", (shop,))}
+    rows = [(shop, cid, p["id"]) for p in products for cid in (p.get("collection_ids") or [])]
+    now = time.time()
+    conn.execute("DELETE FROM collection_members WHERE shop = ?", (shop,))
+    conn.execute("DELETE FROM collection_index WHERE shop = ?", (shop,))
+    conn.executemany("INSERT OR IGNORE INTO collection_members (shop, collection_id, product_id) VALUES (?, ?, ?)", rows)
+    conn.executemany("INSERT INTO collection_index (shop, collection_id, updated_at, indexed_at) VALUES (?, ?, ?, ?)",
+                     [(shop, cid, stored.get(cid), now) for cid in set(stored) | {r[1] for r in rows}])
+    _collection_members_stamp(conn, shop)
+
+def _collection_members_set_products(conn, shop, memberships):
+    """Rewrite the rows of the given products: {product_id: [collection_id]} ([] = in no collection / deleted)."""
+    if not memberships: return
+    conn.executemany("DELETE FROM collection_members WHERE shop = ? AND product_id = ?", [(shop, pid) for pid in memberships])
+    conn.executemany("INSERT OR IGNORE INTO collection_members (shop, collection_id, product_id) VALUES (?, ?, ?)",
+                     [(shop, str(cid), pid) for pid, cids in memberships.items() for cid in cids])
+    _collection_members_stamp(conn, shop)
+
+def catalog_index_collection(shop_url, access_token, collection_id, updated_at=None):
+    """Crawl one collection's members from Shopify and store them. Returns (product_ids, err);
+    nothing is stored on error so the collection stays un-indexed and is retried next time."""
+    shop, cid = _shopify_domain(shop_url), str(collection_id)
+    ids, err = _shopify_collection_product_ids(shop_url, access_token, cid)
+    if err: return ids, err
+    with _db() as conn:
+        if updated_at is None:
+            row = conn.execute("SELECT data FROM collections WHERE shop = ? AND id = ?", (shop, cid)).fetchone()
+            updated_at = json.loads(row["data"]).get("updated_at", "") if row else None
+        conn.execute("DELETE FROM collection_members WHERE shop = ? AND collection_id = ?", (shop, cid))
+        conn.executemany("INSERT INTO collection_members (shop, collection_id, product_id) VALUES (?, ?, ?)",
+                         [(shop, cid, pid) for pid in ids])
+        conn.execute("INSERT OR REPLACE INTO collection_index (shop, collection_id, updated_at, indexed_at) VALUES (?, ?, ?, ?)",
+                     (shop, cid, updated_at, time.time()))
+        _collection_members_stamp(conn, shop)
+    return ids, None
+
+def catalog_index_collections(shop_url, access_token, progress_callback=None):
+    """Bring the index in line with the stored collections list: drop collections that are gone and
+    crawl the ones never indexed or whose updated_at changed since. Returns the number crawled."""
+    shop = _shopify_domain(shop_url)
+    with _db() as conn:
+        current = {r[0]: json.loads(r[1]).get("updated_at", "") for r in
+                   conn.execute("SELECT id, data FROM collections WHERE shop = ?", (shop,))}
+        indexed = {r[0]: r[1] for r in conn.execute("SELECT collection_id, updated_at FROM collection_index WHERE shop = ?", (shop,))}
+        if not current: return 0
+        gone = [cid for cid in indexed if cid not in current]
+        if gone:
+            conn.executemany("DELETE FROM collection_members WHERE shop = ? AND collection_id = ?", [(shop, c) for c in gone])
+            conn.executemany("DELETE FROM collection_index WHERE shop = ? AND collection_id = ?", [(shop, c) for c in gone])
+            _collection_members_stamp(conn, shop)
+        built = conn.execute("SELECT members_at FROM catalog_sync WHERE shop = ?", (shop,)).fetchone()
+        if not built or built[0] is None:
+            # Catalogs bulk-loaded before the index existed already carry memberships — seed from them
+            products = [json.loads(r[0]) for r in conn.execute("SELECT data FROM products WHERE shop = ?", (shop,))]
+            if products and all("collection_ids" in p for p in products):
+                _collection_members_rebuild(conn, shop, products)
+                indexed = dict(current)
+    stale = [cid for cid, updated in current.items() if cid not in indexed or indexed[cid] != updated]
+    for n, cid in enumerate(stale, 1):
+        catalog_index_collection(shop_url, access_token, cid, current[cid])
+        if progress_callback: progress_callback(n, f"indexing collections ({len(stale)})")
+    return len(stale)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _collection_members_map(path, shop, stamp):
+    """{collection_id: frozenset(product_ids)} for every indexed collection — one read per index change."""
+    members = {}
+    with _db() as conn:
+        covered = {r[0] for r in conn.execute("SELECT collection_id FROM collection_index WHERE shop = ?", (shop,))}
+        for cid, pid in conn.execute("SELECT collection_id, product_id FROM collection_members WHERE shop = ?", (shop,)):
+            if cid in covered: members.setdefault(cid, set()).add(pid)
+    return {cid: frozenset(members.get(cid, ())) for cid in covered}
+
+def catalog_collection_members(shop_url, collection_id):
+    """Product ids in a collection from the membership index, or None when it is not indexed yet."""
+    shop = _shopify_domain(shop_url)
+    try:
+        with _db() as conn:
+            row = conn.execute("SELECT members_at FROM catalog_sync WHERE shop = ?", (shop,)).fetchone()
+    except sqlite3.Error:
+        return None
+    if not row or row["members_at"] is None: return None
+    return _collection_members_map(_db_path(), shop, row["members_at"]).get(str(collection_id))
+
+# --- BATCH WRITER PRODUCT FRAME ---
+# The Batch Writer filters a columnar copy of the loaded catalog: typed columns, lowercase search
+# columns and an SKU trigram index (trigram → row positions), built once per product list. A search
+# term narrows SKU candidates through the trigram postings before the substring check, and title /
+# collection / stock filters are vectorized masks instead of per-rerun list comprehensions.
+SKU_NGRAM = 3
+
+def batch_frame_version(products):
+    """Content hash of the loaded product list — the frame and SKU index are rebuilt only when it changes."""
+    h = hashlib.sha1()
+    for p in products:
+        h.update(f"{p['id']}\x1f{p.get('updated_at', '')}\x1f{p.get('title', '')}\x1f{p.get('all_skus', '')}\x1f"
+                 f"{p.get('total_inventory', 0)}\x1f{p.get('image_url', '')}\x1e".encode())
+    return h.hexdigest()
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def batch_product_frame(version, _products):
+    """{frame, rows (id → row), sku_grams} for one product list. Frame rows follow _products order (row position = list index);
+    string columns are Arrow-backed so substring filters run in Arrow kernels, not per-row Python."""
+    text = "string[pyarrow]"
+    frame = pd.DataFrame({
+        "id": pd.array([str(p["id"]) for p in _products], dtype=text),
+        "title": pd.array([p.get("title") or "" for p in _products], dtype=text),
+        "sku": pd.array([p.get("sku") or "" for p in _products], dtype=text),
+        "image_url": pd.array([p.get("image_url") or "" for p in _products], dtype=text),
+        "total_inventory": pd.array([int(p.get("total_inventory") or 0) for p in _products], dtype="int64"),
+    })
+    frame["title_lc"] = frame["title"].str.lower()
+    # sku + all_skus on one line each — "\n" never occurs in a one-line search term, so matches can't straddle them
+    sku_text = [f"{p.get('sku') or ''}\n{p.get('all_skus') or ''}".lower() for p in _products]
+    frame["sku_lc"] = pd.array(sku_text, dtype=text)
+    grams = {}
+    for pos, sku in enumerate(sku_text):
+        for gram in {sku[i:i + SKU_NGRAM] for i in range(len(sku) - SKU_NGRAM + 1)}:
+            grams.setdefault(gram, []).append(pos)
+    return {"frame": frame, "rows": {str(p["id"]): pos for pos, p in enumerate(_products)},
+            "sku_grams": {g: np.asarray(rows, dtype=np.int32) for g, rows in grams.items()}}
+
+def _batch_sku_match(index, term):
+    """Boolean row mask of products whose SKUs contain term (lowercase)."""
+    frame = index["frame"]
+    if len(term) >= SKU_NGRAM:
+        postings = sorted((index["sku_grams"].get(term[i:i + SKU_NGRAM], np.empty(0, np.int32))
+                           for i in range(len(term) - SKU_NGRAM + 1)), key=len)
+        # Rare trigram → verify only its few rows; common ones ("br-") are cheaper as one full scan
+        if len(postings[0]) * 8 < len(frame):
+            rows = postings[0]
+            for other in postings[1:]:
+                rows = np.intersect1d(rows, other, assume_unique=True)
+            hit = np.zeros(len(frame), dtype=bool)
+            if len(rows):
+                hit[rows] = frame["sku_lc"].iloc[rows].str.contains(term, regex=False).to_numpy(dtype=bool)
+            return hit
+    return frame["sku_lc"].str.contains(term, regex=False).to_numpy(dtype=bool)
+
+def batch_frame_filter(index, term="", member_ids=None, stock="All"):
+    """Rows of the product frame matching a name/SKU substring, a collection's member ids and the stock filter."""
+    frame = index["frame"]
+    mask = np.ones(len(frame), dtype=bool)
+    term = (term or "").strip().lower()
+    if term:
+        mask &= frame["title_lc"].str.contains(term, regex=False).to_numpy(dtype=bool) | _batch_sku_match(index, term)
+    if member_ids is not None:
+        members = np.zeros(len(frame), dtype=bool)
+        members[[index["rows"][pid] for pid in member_ids if pid in index["rows"]]] = True
+        mask &= members
+    if stock == "In Stock (> 0)":
+        mask &= frame["total_inventory"].to_numpy() > 0
+    elif stock == "Out of Stock (≤ 0)":
+        mask &= frame["total_inventory"].to_numpy() <= 0
+    return frame[mask]
+
 def update_shopify_description_only(shop_url, access_token, product_id, data):
-    """Update only title, body_html, and meta fields — no images."""
-    shop_url = shop_url.replace("https://", "").replace("http://", "").strip()
-    if not shop_url.endswith(".myshopify.com"): shop_url += ".myshopify.com"
-    url = f"https://{shop_url}/admin/api/2026-04/products/{product_id}.json"
-    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
-    
+    """Update only title, body_html, and meta fields — no images. Same SIZE GUARD as update_shopify_product_v2."""
+    guard_err = _shopify_body_size_guard(shop_url, access_token, product_id, data.get('html_content') or "")
+    if guard_err: return False, guard_err
     product_payload = {
         "id": product_id,
         "title": data.get('product_title_h1'),
@@ -2287,7 +3231,7 @@ def update_shopify_description_only(shop_url, access_token, product_id, data):
     }
     
     try:
-        response = requests.put(url, json={"product": product_payload}, headers=headers)
+        response = _shopify_request("PUT", shop_url, access_token, f"products/{product_id}.json", json={"product": product_payload}, timeout=60)
         if response.status_code in [200, 201]: return True, "✅ Updated"
         return False, f"Error {response.status_code}: {response.text[:200]}"
     except Exception as e: return False, str(e)
@@ -2296,45 +3240,170 @@ def update_shopify_description_only(shop_url, access_token, product_id, data):
 # ============================================================
 # --- STORE CATALOG FETCHER (for internal linking) ---
 # ============================================================
-@st.cache_data(ttl=3600, show_spinner=False)
-def fetch_store_catalog(store_domain="www.bikerringshop.com"):
-    """Fetch real collections and products from the public Shopify storefront for internal linking."""
-    catalog = {"collections": [], "products": []}
-    
-    # Fetch collections
+# Every listing page is kept on disk (storefront_pages) with its ETag / Last-Modified: a restart
+# serves the stored copy, and once a page is older than STOREFRONT_CATALOG_TTL it is revalidated
+# with a conditional GET — unchanged pages come back as 304 with no body. Pages are requested
+# concurrently in waves until a short page marks the end, so there is no product cap.
+STOREFRONT_PAGE_SIZE = 250
+STOREFRONT_FETCH_WORKERS = 4
+STOREFRONT_CATALOG_TTL = 3600   # seconds a stored page is trusted without asking the storefront
+STOREFRONT_MAX_PAGES = 400      # runaway guard (100k products), not a catalog limit
+
+def _storefront_row(kind, item):
+    if kind == "collections":
+        return {"title": item.get("title", ""), "handle": item.get("handle", ""),
+                "path": f"/collections/{item.get('handle', '')}"}
+    return {
+        "title": item.get("title", ""),
+        "handle": item.get("handle", ""),
+        "path": f"/products/{item.get('handle', '')}",
+        "type": item.get("product_type", ""),
+        "tags": ", ".join(item.get("tags", [])[:10]) if item.get("tags") else ""
+    }
+
+def _storefront_page_get(store_domain, kind, page, cached=None):
+    """One listing page, conditional on the stored copy. Returns ({items, etag, last_modified, changed}, err).
+    Runs in fetch worker threads — HTTP only, no database or secrets access."""
+    headers = {}
+    if cached:
+        if cached.get("etag"): headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"): headers["If-Modified-Since"] = cached["last_modified"]
     try:
-        res = requests.get(f"https://{store_domain}/collections.json?limit=250", timeout=15)
-        if res.status_code == 200:
-            for c in res.json().get("collections", []):
-                catalog["collections"].append({
-                    "title": c.get("title", ""),
-                    "handle": c.get("handle", ""),
-                    "path": f"/collections/{c.get('handle', '')}"
-                })
-    except: pass
-    
-    # Fetch products (multiple pages for larger stores)
-    page = 1
-    while page <= 5:  # Max 5 pages = 1250 products
-        try:
-            res = requests.get(f"https://{store_domain}/products.json?limit=250&page={page}", timeout=15)
-            if res.status_code == 200:
-                products = res.json().get("products", [])
-                if not products: break
-                for p in products:
-                    catalog["products"].append({
-                        "title": p.get("title", ""),
-                        "handle": p.get("handle", ""),
-                        "path": f"/products/{p.get('handle', '')}",
-                        "type": p.get("product_type", ""),
-                        "tags": ", ".join(p.get("tags", [])[:10]) if p.get("tags") else ""
-                    })
-                page += 1
-            else: break
-        except: break
-    
+        res = http_get(f"https://{store_domain}/{kind}.json?limit={STOREFRONT_PAGE_SIZE}&page={page}", headers=headers, timeout=15)
+        if res.status_code == 304 and cached:
+            return {**cached, "changed": False}, None
+        if res.status_code != 200:
+            return None, f"HTTP {res.status_code}"
+        items = [_storefront_row(kind, item) for item in res.json().get(kind, [])]
+    except Exception as e:
+        return None, str(e)
+    return {"items": items, "etag": res.headers.get("ETag"), "last_modified": res.headers.get("Last-Modified"), "changed": True}, None
+
+def storefront_listing(store_domain, kind):
+    """All rows of a storefront listing ("collections" or "products"). Returns (rows, err); on err the rows
+    are the pages fetched so far plus the stored copy of the rest."""
+    with _db() as conn:
+        stored = {r["page"]: {"items": json.loads(r["items"]), "etag": r["etag"], "last_modified": r["last_modified"],
+                              "checked": r["checked"]}
+                  for r in conn.execute("SELECT page, etag, last_modified, items, checked FROM storefront_pages "
+                                        "WHERE domain = ? AND kind = ?", (store_domain, kind))}
+    now = time.time()
+    complete = bool(stored) and sorted(stored) == list(range(1, len(stored) + 1)) and len(stored[len(stored)]["items"]) < STOREFRONT_PAGE_SIZE
+    if complete and all(now - (p["checked"] or 0) < STOREFRONT_CATALOG_TTL for p in stored.values()):
+        return [row for n in sorted(stored) for row in stored[n]["items"]], None
+
+    # Revalidate every known page in the first wave, then extend in worker-sized waves until a short page
+    pages, last, err = {}, None, None
+    start, wave = 1, max(len(stored), STOREFRONT_FETCH_WORKERS)
+    with ThreadPoolExecutor(max_workers=STOREFRONT_FETCH_WORKERS) as pool:
+        while last is None and err is None and start <= STOREFRONT_MAX_PAGES:
+            nums = list(range(start, min(start + wave, STOREFRONT_MAX_PAGES + 1)))
+            futures = [pool.submit(_storefront_page_get, store_domain, kind, n, stored.get(n)) for n in nums]
+            for n, fut in zip(nums, futures):
+                page, page_err = fut.result()
+                if page_err:
+                    err = f"Storefront {kind} page {n}: {page_err}"
+                    break
+                pages[n] = page
+                if len(page["items"]) < STOREFRONT_PAGE_SIZE:
+                    last = n
+                    break
+            start, wave = start + len(nums), STOREFRONT_FETCH_WORKERS
+
+    with _db() as conn:
+        conn.executemany("INSERT OR REPLACE INTO storefront_pages (domain, kind, page, etag, last_modified, items, checked) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         [(store_domain, kind, n, p["etag"], p["last_modified"], json.dumps(p["items"]), now)
+                          for n, p in pages.items() if p["changed"]])
+        conn.executemany("UPDATE storefront_pages SET checked = ? WHERE domain = ? AND kind = ? AND page = ?",
+                         [(now, store_domain, kind, n) for n, p in pages.items() if not p["changed"]])
+        if last is not None:
+            conn.execute("DELETE FROM storefront_pages WHERE domain = ? AND kind = ? AND page > ?", (store_domain, kind, last))
+    if err:
+        pages = {**stored, **pages}
+    return [row for n in sorted(pages) for row in pages[n]["items"]], err
+
+@st.cache_data(ttl=STOREFRONT_CATALOG_TTL, show_spinner=False)
+def fetch_store_catalog(store_domain="www.bikerringshop.com"):
+    """Fetch real collections and products from the public Shopify storefront for internal linking.
+    Every page, served from the on-disk copy while it is fresh (see storefront_listing)."""
+    collections, _ = storefront_listing(store_domain, "collections")
+    products, _ = storefront_listing(store_domain, "products")
+    catalog = {"collections": collections, "products": products}
+    catalog["version"] = catalog_version(catalog)
     return catalog
 
+# --- CATALOG RELEVANCE INDEX ---
+# Ranking the catalog against the product being written is a BM25 lookup over an inverted
+# index (title / tag / type words and word pairs → products, term weights precomputed), built
+# once per catalog version and shared by every product in a batch. Material, style and type
+# words keep the extra weight the old keyword lists gave them.
+CATALOG_MATERIAL_TERMS = ["brass", "sterling silver", "stainless steel", "gold", "silver", "copper", "titanium",
+                          "tungsten", "bronze", "platinum", "pewter", "925", "316l", "plated", "two tone", "rhodium"]
+CATALOG_STYLE_TERMS = ["skull", "gothic", "celtic", "biker", "viking", "tribal", "christian", "cross", "dragon", "snake",
+                       "eagle", "lion", "wolf", "crown", "angel", "demon", "masonic", "freemason", "templar", "steampunk",
+                       "punk", "flame", "skeleton", "death", "pirate", "anchor", "nautical", "buddha", "om", "zen", "hamsa",
+                       "evil eye", "pentagram", "norse", "odin", "thor", "rune", "samurai", "japanese", "chinese"]
+CATALOG_TYPE_TERMS = ["ring", "pendant", "necklace", "bracelet", "chain", "earring", "wallet chain", "cuff", "bangle",
+                      "charm", "brooch", "pin"]
+CATALOG_TERM_BOOST = {**{t: 1.5 for t in CATALOG_TYPE_TERMS}, **{t: 2.0 for t in CATALOG_STYLE_TERMS},
+                      **{t: 3.0 for t in CATALOG_MATERIAL_TERMS}}
+CATALOG_STOPWORDS = {"a", "an", "and", "the", "of", "for", "with", "in", "on", "to", "by", "or", "is", "it", "this", "x"}
+CATALOG_BM25_K1 = 1.2
+CATALOG_BM25_B = 0.75
+
+def _catalog_terms(text):
+    """Words and adjacent word pairs ("sterling silver") of a text, lowercased, stopwords dropped."""
+    words = [w for w in re.findall(r"[a-z0-9]+", (text or "").lower()) if w not in CATALOG_STOPWORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+def catalog_version(catalog):
+    """Content hash of a catalog — the relevance index is rebuilt only when this changes."""
+    h = hashlib.sha1()
+    for p in catalog.get("products", []):
+        h.update(f"{p.get('path')}\x1f{p.get('title')}\x1f{p.get('type')}\x1f{p.get('tags')}\x1e".encode())
+    return h.hexdigest()
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def catalog_index(version, _catalog):
+    """{postings: {term: [(product index, bm25 weight)]}, lines: prompt line per product} for one catalog version."""
+    products = _catalog.get("products", [])
+    docs = [_catalog_terms(f"{p.get('title', '')} {p.get('tags', '')} {p.get('type', '')}") for p in products]
+    avg_len = sum(len(d) for d in docs) / max(len(docs), 1) or 1.0
+    tfs = {}
+    for i, doc in enumerate(docs):
+        for term in doc:
+            counts = tfs.setdefault(term, {})
+            counts[i] = counts.get(i, 0) + 1
+    postings = {}
+    for term, counts in tfs.items():
+        idf = math.log(1 + (len(docs) - len(counts) + 0.5) / (len(counts) + 0.5))
+        postings[term] = [(i, idf * tf * (CATALOG_BM25_K1 + 1) /
+                           (tf + CATALOG_BM25_K1 * (1 - CATALOG_BM25_B + CATALOG_BM25_B * len(docs[i]) / avg_len)))
+                          for i, tf in counts.items()]
+    lines = []
+    for p in products:
+        parts = [f"- {p['path']}  →  \"{p['title']}\""]
+        if p.get('type'): parts.append(f"  [{p['type']}]")
+        if p.get('tags'): parts.append(f"  {{{p['tags']}}}")
+        lines.append("".join(parts))
+    return {"postings": postings, "lines": lines}
+
+def catalog_rank(catalog, product_context, limit=150):
+    """Indexes of the `limit` catalog products most related to product_context, best first; products
+    with no shared term keep catalog order after the matches."""
+    products = catalog.get("products", [])
+    index = catalog_index(catalog.get("version") or catalog_version(catalog), catalog)
+    scores = {}
+    for term in set(_catalog_terms(product_context)):
+        boost = CATALOG_TERM_BOOST.get(term, 1.0)
+        for i, weight in index["postings"].get(term, ()):
+            scores[i] = scores.get(i, 0.0) + boost * weight
+    ranked = heapq.nsmallest(limit, scores, key=lambda i: (-scores[i], i))
+    if len(ranked) < limit:
+        ranked += [i for i in range(len(products)) if i not in scores][:limit - len(ranked)]
+    return ranked
+
 def format_catalog_for_prompt(catalog, max_collections=50, max_products=150, product_context=""):
     """Format catalog data into a compact string for the AI prompt.
     Includes product tags and type to help AI match related items.
@@ -2353,202 +3422,583 @@ def format_catalog_for_prompt(catalog, max_collections=50, max_products=150, pro
     
     if catalog.get("products"):
         products = catalog["products"]
+        index = catalog_index(catalog.get("version") or catalog_version(catalog), catalog)
         
-        # Smart filtering: if we know what product is being written,
-        # prioritize related items by matching keywords
+        # Smart filtering: if we know what product is being written, related items come first
         if product_context and len(products) > max_products:
-            context_lower = product_context.lower()
-            
-            # Extract key terms from the product being written
-            # Common material/style keywords to match against
-            match_terms = []
-            material_keywords = ["brass", "sterling silver", "stainless steel", "gold", "silver", 
-                                 "copper", "titanium", "tungsten", "bronze", "platinum", "pewter",
-                                 "925", "316l", "plated", "two-tone", "rhodium"]
-            style_keywords = ["skull", "gothic", "celtic", "biker", "viking", "tribal", "christian",
-                              "cross", "dragon", "snake", "eagle", "lion", "wolf", "crown", "angel",
-                              "demon", "masonic", "freemason", "templar", "steampunk", "punk",
-                              "flame", "skeleton", "death", "pirate", "anchor", "nautical",
-                              "buddha", "om", "zen", "hamsa", "evil eye", "pentagram", "norse",
-                              "odin", "thor", "rune", "samurai", "japanese", "chinese"]
-            type_keywords = ["ring", "pendant", "necklace", "bracelet", "chain", "earring",
-                             "wallet chain", "cuff", "bangle", "charm", "brooch", "pin"]
-            
-            for term in material_keywords + style_keywords + type_keywords:
-                if term in context_lower:
-                    match_terms.append(term)
-            
-            if match_terms:
-                def relevance_score(product):
-                    """Score how related a product is to the current one."""
-                    searchable = (product.get("title", "") + " " + product.get("tags", "") + " " + product.get("type", "")).lower()
-                    score = 0
-                    for term in match_terms:
-                        if term in searchable:
-                            # Material matches are worth more
-                            if term in material_keywords: score += 3
-                            # Style matches are valuable
-                            elif term in style_keywords: score += 2
-                            # Type matches help for cross-selling
-                            elif term in type_keywords: score += 1
-                    return score
-                
-                # Sort by relevance (highest first), then take top N
-                scored = sorted(products, key=relevance_score, reverse=True)
-                products = scored[:max_products]
-            else:
-                products = products[:max_products]
+            shown = catalog_rank(catalog, product_context, max_products)
         else:
-            products = products[:max_products]
+            shown = range(min(len(products), max_products))
         
-        lines.append(f"\n=== REAL PRODUCTS ({len(products)} of {len(catalog['products'])} shown, sorted by relevance) ===")
+        lines.append(f"\n=== REAL PRODUCTS ({len(shown)} of {len(products)} shown, sorted by relevance) ===")
         lines.append("Format: path → \"title\" [product_type] {tags}")
-        for p in products:
-            parts = [f"- {p['path']}  →  \"{p['title']}\""]
-            if p.get('type'): parts.append(f"  [{p['type']}]")
-            if p.get('tags'): parts.append(f"  {{{p['tags']}}}")
-            lines.append("".join(parts))
+        lines.extend(index["lines"][i] for i in shown)
     
     return "\n".join(lines)
 
 # ============================================================
-# --- CLAUDE API FUNCTION ---
+# --- LLM RESPONSE CACHE ---
 # ============================================================
-def call_claude_api(claude_key, prompt, img_pil_list=None, model_id="claude-sonnet-5"):
-    """Call Claude API for Text/SEO tasks with optional image support"""
-    url = "https://api.anthropic.com/v1/messages"
-    headers = {"Content-Type": "application/json", "x-api-key": claude_key, "anthropic-version": "2023-06-01"}
-    
-    content = []
-    if img_pil_list:
-        for idx, img in enumerate(img_pil_list):
-            content.append({"type": "text", "text": f"[IMAGE {idx+1} of {len(img_pil_list)}]"})
-            content.append({"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": img_to_base64(img)}})
-    content.append({"type": "text", "text": prompt})
-    
-    payload = {"model": model_id, "max_tokens": 8192, "messages": [{"role": "user", "content": content}]}
-    
-    for attempt in range(3):
-        try:
-            res = requests.post(url, json=payload, headers=headers, timeout=180)
-            if res.status_code == 200:
-                data = res.json()
-                text_content = ""
-                for block in data.get("content", []):
-                    if block.get("type") == "text": text_content += block.get("text", "")
-                # Check if response was truncated
-                stop_reason = data.get("stop_reason", "")
-                if stop_reason == "max_tokens":
-                    text_content += "}"  # Try to close truncated JSON
-                return text_content, None
-            elif res.status_code == 529: time.sleep(3); continue
-            else: return None, f"Claude API Error {res.status_code}: {res.text}"
-        except: time.sleep(2)
-    return None, "Claude API failed after retries"
+# Content-addressed: the key is a hash of provider, model id and the exact request body
+# (prompt text, image bytes, generation config), so a rerun / retry / "Start Over" that
+# sends the same request gets the stored answer instead of a new API call. Entries expire
+# after LLM_CACHE_TTL; past LLM_CACHE_MAX_BYTES the least recently used ones are evicted.
+LLM_CACHE_TTL = 7 * 24 * 3600
+LLM_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_LLM_CACHE_ON = contextvars.ContextVar("llm_cache_on", default=None)
+
+def _llm_cache_enabled():
+    """Sidebar toggle (on by default). Batch worker threads carry the script context; background
+    jobs have none, so the switch is handed to them through _LLM_CACHE_ON instead."""
+    if _LLM_CACHE_ON.get() is not None: return _LLM_CACHE_ON.get()
+    if get_script_run_ctx() is None: return True
+    try: return bool(st.session_state.get("llm_cache_on", True))
+    except Exception: return True
+
+def _llm_cache_key(provider, model_id, payload):
+    h = hashlib.sha256(f"{provider}\n{model_id}\n".encode())
+    h.update(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode())
+    return h.hexdigest()
+
+def _llm_cache_get(key):
+    try:
+        with _db() as conn:
+            row = conn.execute("SELECT response, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if not row: return None
+            if time.time() - row["created"] > LLM_CACHE_TTL:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE llm_cache SET accessed = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            return row["response"]
+    except sqlite3.Error:
+        return None
+
+def _llm_cache_put(key, provider, model_id, response):
+    if not response: return
+    now = time.time()
+    try:
+        with _db() as conn:
+            conn.execute("INSERT OR REPLACE INTO llm_cache (key, provider, model, created, accessed, size, hits, response) "
+                         "VALUES (?, ?, ?, ?, ?, ?, 0, ?)",
+                         (key, provider, model_id, now, now, len(response.encode("utf-8")), response))
+            conn.execute("DELETE FROM llm_cache WHERE created < ?", (now - LLM_CACHE_TTL,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            if total > LLM_CACHE_MAX_BYTES:
+                doomed = []
+                for r in conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed"):
+                    if total <= LLM_CACHE_MAX_BYTES: break
+                    doomed.append((r["key"],)); total -= r["size"]
+                conn.executemany("DELETE FROM llm_cache WHERE key = ?", doomed)
+    except sqlite3.Error:
+        pass
+
+def llm_cache_stats():
+    """(entries, bytes, total hits) for the sidebar."""
+    try:
+        with _db() as conn:
+            row = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM llm_cache").fetchone()
+        return tuple(row)
+    except sqlite3.Error:
+        return (0, 0, 0)
+
+def llm_cache_clear():
+    with _db() as conn:
+        conn.execute("DELETE FROM llm_cache")
 
 # ============================================================
-# --- OPENAI API FUNCTION (NEW) ---
+# --- LLM USAGE LEDGER ---
 # ============================================================
-def call_openai_api(openai_key, prompt, img_pil_list=None, model_id="gpt-5.6-terra"):
-    """Call OpenAI API for Text/SEO tasks with optional image support"""
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {openai_key}"}
-    
-    content = []
-    if img_pil_list:
-        for idx, img in enumerate(img_pil_list):
-            content.append({"type": "text", "text": f"[IMAGE {idx+1} of {len(img_pil_list)}]"})
+# Every model call (text and image, cache hits and failures too) is recorded with its token
+# counts, image count, latency and an estimated USD cost, tagged with the task and the run
+# it belonged to (a Batch Writer job id, a background job id, ...). The Models tab sums it
+# per day / model / task / run so model choices for whole-catalog rewrites can be priced.
+# USD per 1M tokens (input, output). Estimates — override per model id in secrets [LLM_PRICES].
+LLM_PRICES = {
+    "claude-sonnet-5": (2.00, 10.00),
+    "claude-opus-5": (5.00, 25.00),
+    "gpt-5.6-terra": (1.25, 10.00),
+    "gpt-5.6-sol": (2.50, 20.00),
+    "gpt-5.6-luna": (0.25, 2.00),
+    "models/gemini-3.1-pro-preview": (2.00, 12.00),
+    "models/gemini-3.6-flash": (0.30, 2.50),
+    "models/gemini-3-pro-image": (2.00, 120.00),   # output = image tokens
+}
+
+# Provider prompt caching: cached prefix tokens bill at a fraction of the input price; writing
+# an Anthropic cache entry costs a premium (OpenAI/Gemini report no write tokens).
+LLM_CACHE_READ_RATE = 0.10
+LLM_CACHE_WRITE_RATE = 1.25
+# Requests sent through a provider batch API (offline Batch Writer) bill at half price.
+LLM_BATCH_RATE = 0.5
+
+_LLM_RUN_ID = contextvars.ContextVar("llm_run_id", default=None)
+
+@contextlib.contextmanager
+def llm_run(run_id):
+    """Tag every model call made inside the block (and in batch workers started from it) with run_id."""
+    token = _LLM_RUN_ID.set(run_id)
+    try: yield run_id
+    finally: _LLM_RUN_ID.reset(token)
+
+def llm_price(model):
+    """(input, output) USD per 1M tokens, or None when the model has no known price."""
+    try: override = dict(st.secrets.get("LLM_PRICES", {}))
+    except Exception: override = {}
+    for table in (override, LLM_PRICES):
+        price = table.get(model) or table.get(str(model).replace("models/", ""))
+        if price: return float(price[0]), float(price[1])
+    return None
+
+def llm_cost(model, input_tokens, output_tokens, cache_read_tokens=0, cache_write_tokens=0):
+    """USD for one call. input_tokens is the whole prompt, cached parts included."""
+    price = llm_price(model)
+    if not price: return None
+    read, write = cache_read_tokens or 0, cache_write_tokens or 0
+    fresh = max((input_tokens or 0) - read - write, 0)
+    usd_in = (fresh + read * LLM_CACHE_READ_RATE + write * LLM_CACHE_WRITE_RATE) * price[0]
+    return (usd_in + (output_tokens or 0) * price[1]) / 1_000_000
+
+def llm_usage_record(provider, model, task=None, images=0, input_tokens=None, output_tokens=None,
+                     latency_s=None, cached=False, ok=True, cache_read_tokens=None, cache_write_tokens=None, batch=False):
+    now = time.time()
+    cost = 0.0 if cached else llm_cost(model, input_tokens, output_tokens, cache_read_tokens, cache_write_tokens)
+    if batch and cost: cost *= LLM_BATCH_RATE
+    try:
+        with _db() as conn:
+            conn.execute("INSERT INTO llm_usage (ts, day, run_id, provider, model, task, images, input_tokens, "
+                         "output_tokens, latency_s, cost_usd, cached, ok, cache_read_tokens, cache_write_tokens) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (now, time.strftime("%Y-%m-%d", time.localtime(now)), _LLM_RUN_ID.get(), provider, model,
+                          task, images, input_tokens, output_tokens, latency_s, cost, int(cached), int(ok),
+                          cache_read_tokens, cache_write_tokens))
+    except sqlite3.Error:
+        pass
+
+LLM_USAGE_GROUPS = ("day", "model", "task", "run_id", "provider")
+
+def llm_usage_summary(group_by="day", since=None, run_ids=None):
+    """Totals per group_by (one of LLM_USAGE_GROUPS), newest / most expensive first.
+    since = unix time lower bound; run_ids = only these runs."""
+    if group_by not in LLM_USAGE_GROUPS: raise ValueError(group_by)
+    where, args = ["1=1"], []
+    if since: where.append("ts >= ?"); args.append(since)
+    if run_ids is not None:
+        run_ids = list(run_ids)
+        if not run_ids: return []
+        where.append(f"run_id IN ({','.join('?' * len(run_ids))})"); args.extend(run_ids)
+    order = "MAX(ts) DESC" if group_by in ("day", "run_id") else "cost_usd DESC"
+    sql = (f"SELECT {group_by} AS key, COUNT(*) AS calls, SUM(ok = 0) AS failed, SUM(cached) AS cached, "
+           "SUM(images) AS images, COALESCE(SUM(input_tokens), 0) AS input_tokens, "
+           "COALESCE(SUM(output_tokens), 0) AS output_tokens, COALESCE(SUM(cache_read_tokens), 0) AS prefix_cached_tokens, "
+           "ROUND(COALESCE(SUM(cost_usd), 0), 4) AS cost_usd, "
+           "ROUND(AVG(CASE WHEN cached = 0 AND ok = 1 THEN latency_s END), 2) AS avg_latency_s, "
+           "ROUND(SUM(CASE WHEN cached = 0 AND latency_s IS NOT NULL THEN output_tokens END) / "
+           "NULLIF(SUM(CASE WHEN cached = 0 THEN latency_s END), 0), 1) AS out_tok_per_s, "
+           "SUM(cost_usd IS NULL AND cached = 0 AND ok = 1) AS unpriced "
+           f"FROM llm_usage WHERE {' AND '.join(where)} GROUP BY {group_by} ORDER BY {order}")
+    try:
+        with _db() as conn:
+            return [dict(r) for r in conn.execute(sql, args)]
+    except sqlite3.Error:
+        return []
+
+# ============================================================
+# --- STRUCTURED OUTPUT SCHEMAS ---
+# ============================================================
+# Every generator that answers in JSON names one of these. llm_call sends it through the
+# provider's native mode — Claude: a forced tool call, OpenAI: response_format json_schema
+# (strict), Gemini: responseJsonSchema — and checks the answer locally with json_schema_errors.
+# Strict mode wants every property required and no extra keys, so the schemas are written that way.
+def _schema_object(**props):
+    return {"type": "object", "properties": props, "required": list(props), "additionalProperties": False}
+
+_IMAGE_SEO_ITEM = _schema_object(file_name={"type": "string"}, alt_tag={"type": "string"})
+LLM_SCHEMAS = {
+    "product_content": _schema_object(
+        url_slug={"type": "string"}, meta_title={"type": "string"}, meta_description={"type": "string"},
+        product_title_h1={"type": "string"}, html_content={"type": "string"},
+        image_seo={"type": "array", "items": _IMAGE_SEO_ITEM}),
+    "collection_content": _schema_object(
+        collection_title={"type": "string"}, collection_description_html={"type": "string"},
+        meta_title={"type": "string"}, meta_description={"type": "string"}, keyword_analysis={"type": "string"}),
+    "image_seo": _IMAGE_SEO_ITEM,
+    "name_slug": _schema_object(product_name={"type": "string"}, url_slug={"type": "string"}),
+}
+_SCHEMA_TYPES = {"object": dict, "array": list, "string": str, "integer": int, "number": (int, float), "boolean": bool}
+
+def json_schema_errors(value, schema, path="$"):
+    """What is wrong with value under the JSON Schema subset used above (type, properties, required,
+    additionalProperties, items, enum). [] when it conforms."""
+    kind = schema.get("type")
+    if kind and (not isinstance(value, _SCHEMA_TYPES[kind]) or (isinstance(value, bool) and kind in ("integer", "number"))):
+        return [f"{path}: expected {kind}, got {type(value).__name__}"]
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} not in {schema['enum']}")
+    if kind == "object":
+        props = schema.get("properties", {})
+        errors += [f"{path}.{k}: missing" for k in schema.get("required", []) if k not in value]
+        for k, v in value.items():
+            if k in props: errors += json_schema_errors(v, props[k], f"{path}.{k}")
+            elif schema.get("additionalProperties") is False: errors.append(f"{path}.{k}: unexpected")
+    elif kind == "array":
+        for i, item in enumerate(value):
+            errors += json_schema_errors(item, schema.get("items", {}), f"{path}[{i}]")
+    return errors
+
+# ============================================================
+# --- LLM CLIENT ---
+# ============================================================
+# One request path for Claude, OpenAI and Gemini text calls: the same cache lookup, the same
+# retry policy (exponential backoff with full jitter, honoring Retry-After), and streamed
+# responses, so a long answer never hits a whole-response timeout — `timeout` is the longest
+# silence allowed between chunks. Every call returns usage/latency metadata alongside the text.
+LLM_MAX_ATTEMPTS = 4
+LLM_BACKOFF_BASE = 1.0     # seconds; attempt n waits up to BASE * 2**n
+LLM_BACKOFF_CAP = 30.0
+LLM_RETRY_STATUSES = (408, 409, 429, 500, 502, 503, 504, 529)
+LLM_TRUNCATED_REASONS = ("max_tokens", "length", "MAX_TOKENS")
+# Prompt prefix caching (prefix= on llm_call): Claude gets a cache_control breakpoint after the
+# prefix, OpenAI caches identical prefixes on its own (prompt_cache_key keeps them on one
+# cache shard), and Gemini gets an explicit cachedContents entry once the prefix is big enough.
+GEMINI_PREFIX_CACHE_MIN_CHARS = 16000   # ≈ 4k tokens — below the explicit-cache minimum it isn't worth it
+GEMINI_PREFIX_CACHE_TTL = 900
+
+def _llm_retry_delay(attempt, res=None):
+    """Seconds to wait before the next attempt: the server's Retry-After when it sent one,
+    otherwise exponential backoff with full jitter (spreads out parallel batch workers)."""
+    if res is not None:
+        hdr_ms = res.headers.get("retry-after-ms")
+        hdr = res.headers.get("retry-after")
+        try:
+            if hdr_ms: return min(float(hdr_ms) / 1000, LLM_BACKOFF_CAP)
+            if hdr: return min(max(float(hdr), 0), LLM_BACKOFF_CAP)
+        except ValueError:
+            try: return min(max(email.utils.parsedate_to_datetime(hdr).timestamp() - time.time(), 0), LLM_BACKOFF_CAP)
+            except Exception: pass
+    return random.uniform(0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * 2 ** attempt))
+
+LLM_API_BASES = {"claude": "https://api.anthropic.com", "openai": "https://api.openai.com",
+                 "gemini": "https://generativelanguage.googleapis.com"}
+
+def _llm_base(provider):
+    """API root for a provider. ANTHROPIC_API_BASE_URL / OPENAI_API_BASE_URL / GEMINI_API_BASE_URL
+    (secrets) point its calls at a local stand-in server — used to exercise batch runs offline."""
+    name = {"claude": "ANTHROPIC", "openai": "OPENAI", "gemini": "GEMINI"}[provider] + "_API_BASE_URL"
+    try: override = str(st.secrets.get(name, "") or "").rstrip("/")
+    except Exception: override = ""
+    return override or LLM_API_BASES[provider]
+
+def _llm_headers(provider, api_key):
+    if provider == "claude": return {"Content-Type": "application/json", "x-api-key": api_key, "anthropic-version": "2023-06-01"}
+    if provider == "openai": return {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+    return {"Content-Type": "application/json"}   # Gemini takes the key as ?key=
+
+def _llm_request(provider, api_key, model_id, prompt, images=None, temperature=0.5, max_tokens=None, prefix=None,
+                 schema=None):
+    """(url, headers, payload) for a non-streaming request. The payload is also the cache key input.
+    Images are labelled "[IMAGE i of n]" when there is more than one so the model can refer to them.
+    A prefix is sent first, ahead of the images and the prompt, and marked for provider caching.
+    schema = an LLM_SCHEMAS name the answer must follow (provider-native structured output)."""
+    images = images or []
+    labels = [f"[IMAGE {i+1} of {len(images)}]" if len(images) > 1 else None for i in range(len(images))]
+    if provider == "claude":
+        content = [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}] if prefix else []
+        for label, img in zip(labels, images):
+            if label: content.append({"type": "text", "text": label})
+            content.append({"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": img_to_base64(img)}})
+        content.append({"type": "text", "text": prompt})
+        payload = {"model": model_id, "max_tokens": max_tokens or 8192, "messages": [{"role": "user", "content": content}]}
+        if schema:   # the answer comes back as the tool call's input
+            payload["tools"] = [{"name": schema, "description": "Return the result.", "input_schema": LLM_SCHEMAS[schema]}]
+            payload["tool_choice"] = {"type": "tool", "name": schema}
+        return f"{_llm_base('claude')}/v1/messages", _llm_headers("claude", api_key), payload
+    if provider == "openai":
+        content = [{"type": "text", "text": prefix}] if prefix else []
+        for label, img in zip(labels, images):
+            if label: content.append({"type": "text", "text": label})
             content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_to_base64(img)}"}})
-    content.append({"type": "text", "text": prompt})
-    
-    payload = {
-        "model": model_id, 
-        "max_completion_tokens": 8192,  # Increased for product descriptions with many images
-        "messages": [{"role": "user", "content": content}]
-    }
-    
-    for attempt in range(3):
+        content.append({"type": "text", "text": prompt})
+        payload = {"model": model_id, "max_completion_tokens": max_tokens or 8192, "messages": [{"role": "user", "content": content}]}
+        if prefix: payload["prompt_cache_key"] = "prefix-" + hashlib.sha256(prefix.encode()).hexdigest()[:32]
+        if schema:
+            payload["response_format"] = {"type": "json_schema",
+                                          "json_schema": {"name": schema, "schema": LLM_SCHEMAS[schema], "strict": True}}
+        return f"{_llm_base('openai')}/v1/chat/completions", _llm_headers("openai", api_key), payload
+    # gemini — temperature only applies here (the Claude/OpenAI defaults are what the prompts were tuned on)
+    parts = ([{"text": prefix}] if prefix else []) + [{"text": prompt}]
+    for label, img in zip(labels, images):
+        if label: parts.append({"text": label})
+        parts.append({"inline_data": {"mime_type": "image/jpeg", "data": img_to_base64(img)}})
+    config = {"temperature": temperature, "responseMimeType": "application/json"}
+    if max_tokens: config["maxOutputTokens"] = max_tokens
+    if schema: config["responseJsonSchema"] = LLM_SCHEMAS[schema]
+    return (f"{_llm_base('gemini')}/v1beta/{model_id}:generateContent?key={clean_key(api_key)}",
+            _llm_headers("gemini", api_key), {"contents": [{"parts": parts}], "generationConfig": config})
+
+@st.cache_resource(show_spinner=False)
+def _gemini_prefix_caches():
+    return {"entries": {}, "locks": {}, "lock": threading.Lock()}
+
+def _gemini_prefix_cache(api_key, model, prefix):
+    """Name of a Gemini cachedContents entry holding `prefix`, created on first use and shared by
+    every call (and session) until shortly before it expires. None when the prefix is too small or
+    the API refuses — the caller then sends the prefix inline (implicit caching may still apply)."""
+    if not prefix or len(prefix) < GEMINI_PREFIX_CACHE_MIN_CHARS: return None
+    reg = _gemini_prefix_caches()
+    key = (model, hashlib.sha256(prefix.encode()).hexdigest())
+    with reg["lock"]:
+        create_lock = reg["locks"].setdefault(key, threading.Lock())
+    with create_lock:   # parallel batch workers wait for one create instead of making one each
+        with reg["lock"]:
+            hit = reg["entries"].get(key)
+        if hit and hit[1] > time.time(): return hit[0]
+        name = None
         try:
-            res = requests.post(url, json=payload, headers=headers, timeout=180)
-            if res.status_code == 200:
-                data = res.json()
-                choice = data.get("choices", [{}])[0]
-                text = choice.get("message", {}).get("content", "")
-                # Check if response was truncated
-                if choice.get("finish_reason") == "length":
-                    text += "}"  # Try to close truncated JSON
-                return text, None
-            elif res.status_code == 429: time.sleep(3); continue
-            else: return None, f"OpenAI API Error {res.status_code}: {res.text}"
-        except: time.sleep(2)
-    return None, "OpenAI API failed after retries"
+            res = http_post(f"{_llm_base('gemini')}/v1beta/cachedContents?key={clean_key(api_key)}",
+                            json={"model": model, "contents": [{"role": "user", "parts": [{"text": prefix}]}],
+                                  "ttl": f"{GEMINI_PREFIX_CACHE_TTL}s"},
+                            headers={"Content-Type": "application/json"}, timeout=30)
+            if res.status_code == 200: name = res.json().get("name")
+        except (requests.RequestException, ValueError):
+            pass
+        # a refusal is remembered for a few minutes so every call doesn't retry the create
+        expires = time.time() + (GEMINI_PREFIX_CACHE_TTL - 60 if name else 300)
+        with reg["lock"]:
+            reg["entries"][key] = (name, expires)
+        return name
+
+def _gemini_prefix_cache_drop(model, prefix):
+    reg = _gemini_prefix_caches()
+    with reg["lock"]:
+        reg["entries"].pop((model, hashlib.sha256(prefix.encode()).hexdigest()), None)
+
+def _llm_stream_request(provider, url, payload):
+    """Turn a request from _llm_request into its server-sent-events variant."""
+    if provider == "claude": return url, {**payload, "stream": True}
+    if provider == "openai": return url, {**payload, "stream": True, "stream_options": {"include_usage": True}}
+    return url.replace(":generateContent?", ":streamGenerateContent?alt=sse&", 1), payload
+
+def _sse_events(res):
+    """JSON objects from a text/event-stream response, one per `data:` line."""
+    for raw in res.iter_lines():
+        line = raw.decode("utf-8", "replace") if isinstance(raw, bytes) else raw
+        if not line.startswith("data:"): continue
+        data = line[5:].strip()
+        if not data or data == "[DONE]": continue
+        yield json.loads(data)
+
+def _llm_claude_usage(out, usage):
+    """Anthropic reports uncached, cache-write and cache-read input tokens separately; keep the total."""
+    read, write = usage.get("cache_read_input_tokens") or 0, usage.get("cache_creation_input_tokens") or 0
+    if usage.get("input_tokens") is not None:
+        out["input_tokens"] = usage["input_tokens"] + read + write
+    out["cache_read_tokens"], out["cache_write_tokens"] = read, write
+
+def _llm_out():
+    """Empty accumulator for _llm_absorb."""
+    return {"chunks": [], "finish_reason": None, "input_tokens": None, "output_tokens": None, "ttft_s": None,
+            "cache_read_tokens": None, "cache_write_tokens": None, "t0": time.time(), "json": json_stream(), "json_s": None}
+
+def _llm_feed_json(out, seen):
+    """Feed text chunks added since index `seen` to the answer's JSON scanner."""
+    for piece in out["chunks"][seen:]:
+        if json_stream_feed(out["json"], piece) is not None:
+            out["json_s"] = out["json_s"] or round(time.time() - out["t0"], 3)
+            break
+
+def _llm_absorb(provider, out, event):
+    """Fold one response object (a stream event, or the whole body when not streamed) into out."""
+    if provider == "claude":
+        kind = event.get("type")
+        if kind == "error":
+            raise ValueError(f"stream error: {event.get('error', {}).get('message', event)}")
+        if kind == "message_start":
+            _llm_claude_usage(out, event.get("message", {}).get("usage") or {})
+        elif kind == "content_block_delta" and event.get("delta", {}).get("type") == "text_delta":
+            out["chunks"].append(event["delta"].get("text", ""))
+        elif kind == "content_block_delta" and event.get("delta", {}).get("type") == "input_json_delta":
+            out["chunks"].append(event["delta"].get("partial_json", ""))   # structured answer (tool call)
+        elif kind == "message_delta":
+            out["finish_reason"] = event.get("delta", {}).get("stop_reason") or out["finish_reason"]
+            out["output_tokens"] = (event.get("usage") or {}).get("output_tokens", out["output_tokens"])
+        elif kind == "message":   # non-streamed body
+            out["chunks"].extend(b.get("text", "") if b.get("type") == "text" else json.dumps(b.get("input", {}))
+                                 for b in event.get("content", []) if b.get("type") in ("text", "tool_use"))
+            out["finish_reason"] = event.get("stop_reason")
+            _llm_claude_usage(out, event.get("usage") or {})
+            out["output_tokens"] = (event.get("usage") or {}).get("output_tokens")
+    elif provider == "openai":
+        for choice in event.get("choices") or []:
+            piece = (choice.get("delta") or choice.get("message") or {}).get("content")
+            if piece: out["chunks"].append(piece)
+            out["finish_reason"] = choice.get("finish_reason") or out["finish_reason"]
+        usage = event.get("usage") or {}
+        if usage:
+            out["input_tokens"], out["output_tokens"] = usage.get("prompt_tokens"), usage.get("completion_tokens")
+            out["cache_read_tokens"] = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    else:
+        for cand in (event.get("candidates") or [])[:1]:
+            out["chunks"].extend(p.get("text", "") for p in cand.get("content", {}).get("parts", []) if not p.get("thought"))
+            out["finish_reason"] = cand.get("finishReason") or out["finish_reason"]
+        usage = event.get("usageMetadata") or {}
+        if usage:
+            out["input_tokens"], out["output_tokens"] = usage.get("promptTokenCount"), usage.get("candidatesTokenCount")
+            out["cache_read_tokens"] = usage.get("cachedContentTokenCount")
+    if out["chunks"] and out["ttft_s"] is None:
+        out["ttft_s"] = round(time.time() - out["t0"], 3)
+
+def _llm_error(provider, model_id, res):
+    if provider == "claude": return f"Claude API Error {res.status_code}: {res.text}"
+    if provider == "openai": return f"OpenAI API Error {res.status_code}: {res.text}"
+    return f"Error {res.status_code} ({model_id}): {res.text}"
+
+def llm_call(provider, api_key, model_id, prompt, images=None, temperature=0.5, max_tokens=None,
+             timeout=60, use_cache=True, stream=True, task=None, prefix=None, schema=None):
+    """One text completion from provider "claude" | "openai" | "gemini". Returns (result, err) where
+    result = {text, json, schema_errors, provider, model, finish_reason, truncated, input_tokens,
+    output_tokens, latency_s, ttft_s, json_s, attempts, cached, cache_read_tokens, cache_write_tokens}
+    — json is the answer's JSON payload (parsed while it streamed, repaired if truncated; None when
+    there is none) and json_s the time until it was complete. `prefix` is a
+    stable leading block (rules, catalog) that providers can cache across calls; `prompt` is the
+    per-call remainder. `schema` (an LLM_SCHEMAS name) requests provider-native structured output;
+    an answer that still doesn't match it counts as a failed attempt. Gemini falls back to
+    MODEL_TEXT_GEMINI_FALLBACK; truncated answers are returned (json is repaired, schema_errors
+    says what is missing) but never cached.
+    Each call, hit or failure lands in the usage ledger under `task`."""
+    models = [model_id] + ([MODEL_TEXT_GEMINI_FALLBACK] if provider == "gemini" and model_id != MODEL_TEXT_GEMINI_FALLBACK else [])
+    _, _, key_payload = _llm_request(provider, api_key, model_id, prompt, images, temperature, max_tokens, prefix, schema)
+    cache_key = _llm_cache_key(provider, model_id, key_payload) if use_cache and _llm_cache_enabled() else None
+    t_start = time.time()
+    cached = _llm_cache_get(cache_key) if cache_key else None
+    if cached is not None:
+        llm_usage_record(provider, model_id, task, len(images or []), 0, 0, round(time.time() - t_start, 3), cached=True)
+        return {"text": cached, "json": parse_json_response(cached), "schema_errors": [], "provider": provider,
+                "model": model_id, "finish_reason": "cached", "truncated": False, "input_tokens": 0, "output_tokens": 0,
+                "latency_s": round(time.time() - t_start, 3), "ttft_s": None, "json_s": None, "attempts": 0,
+                "cached": True, "cache_read_tokens": 0, "cache_write_tokens": 0}, None
+    last_error, attempts, recorded_error = f"{provider} API failed after retries", 0, None
+    for model in models:
+        url, headers, payload = _llm_request(provider, api_key, model, prompt, images, temperature, max_tokens, prefix, schema)
+        gemini_cache = _gemini_prefix_cache(api_key, model, prefix) if provider == "gemini" else None
+        if gemini_cache:   # the prefix lives server-side; send only the per-call parts
+            payload = {**payload, "cachedContent": gemini_cache,
+                       "contents": [{"role": "user", "parts": payload["contents"][0]["parts"][1:]}]}
+        if stream: url, payload = _llm_stream_request(provider, url, payload)
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            attempts += 1
+            out = _llm_out()
+            try:
+                with http_post(url, json=payload, headers=headers, timeout=(10, timeout), stream=stream) as res:
+                    if res.status_code in LLM_RETRY_STATUSES:
+                        last_error = _llm_error(provider, model, res)
+                        if attempt < LLM_MAX_ATTEMPTS - 1: time.sleep(_llm_retry_delay(attempt, res))
+                        continue
+                    if res.status_code != 200 and gemini_cache:
+                        # cache entry expired or was evicted early — resend with the prefix inline
+                        _gemini_prefix_cache_drop(model, prefix)
+                        gemini_cache = None
+                        url, headers, payload = _llm_request(provider, api_key, model, prompt, images, temperature, max_tokens, prefix, schema)
+                        if stream: url, payload = _llm_stream_request(provider, url, payload)
+                        continue
+                    if res.status_code != 200:
+                        last_error = _llm_error(provider, model, res)
+                        break   # not retryable — next model (Gemini) or give up
+                    if "text/event-stream" in res.headers.get("Content-Type", ""):
+                        for event in _sse_events(res):
+                            seen = len(out["chunks"])
+                            _llm_absorb(provider, out, event)
+                            _llm_feed_json(out, seen)   # the payload is parsed as it arrives
+                    else:
+                        body = res.json()
+                        if provider == "claude": body.setdefault("type", "message")
+                        _llm_absorb(provider, out, body)
+                        _llm_feed_json(out, 0)
+            except (requests.RequestException, ValueError) as e:
+                last_error = f"{provider} ({model}): {e}"
+                if attempt < LLM_MAX_ATTEMPTS - 1: time.sleep(_llm_retry_delay(attempt))
+                continue
+            text = "".join(out["chunks"])
+            truncated = out["finish_reason"] in LLM_TRUNCATED_REASONS
+            value = json_stream_result(out["json"])
+            schema_errors = json_schema_errors(value, LLM_SCHEMAS[schema]) if schema else []
+            llm_usage_record(provider, model, task, len(images or []), out["input_tokens"], out["output_tokens"],
+                             round(time.time() - t_start, 3), ok=not truncated and not schema_errors,
+                             cache_read_tokens=out["cache_read_tokens"], cache_write_tokens=out["cache_write_tokens"])
+            if schema_errors and not truncated:
+                last_error = recorded_error = f"{provider} ({model}): answer does not match the {schema} schema — {'; '.join(schema_errors[:3])}"
+                continue
+            if provider == "gemini" and get_script_run_ctx(): st.session_state["_gemini_active_model"] = model
+            if cache_key and text and not truncated:
+                _llm_cache_put(cache_key, provider, model, text)
+            return {"text": text, "json": value, "schema_errors": schema_errors, "provider": provider, "model": model,
+                    "finish_reason": out["finish_reason"], "truncated": truncated, "input_tokens": out["input_tokens"],
+                    "output_tokens": out["output_tokens"], "latency_s": round(time.time() - t_start, 3),
+                    "ttft_s": out["ttft_s"], "json_s": out["json_s"],
+                    "attempts": attempts, "cached": False, "cache_read_tokens": out["cache_read_tokens"],
+                    "cache_write_tokens": out["cache_write_tokens"]}, None
+    if last_error != recorded_error:   # a schema mismatch was recorded with its tokens already
+        llm_usage_record(provider, models[-1], task, len(images or []), latency_s=round(time.time() - t_start, 3), ok=False)
+    return None, last_error
+
+def llm_route(gemini_key, claude_key, openai_key, selected_model):
+    """(provider, api_key, model_id) that a call for selected_model goes to."""
+    if selected_model in CLAUDE_MODELS and claude_key: return "claude", claude_key, CLAUDE_MODELS[selected_model]
+    if selected_model in OPENAI_MODELS and openai_key: return "openai", openai_key, OPENAI_MODELS[selected_model]
+    return "gemini", gemini_key, MODEL_TEXT_GEMINI
+
+def llm_generate(gemini_key, claude_key, openai_key, selected_model, prompt, images=None,
+                 temperature=0.5, max_tokens=None, timeout=60, use_cache=True, task=None, prefix=None, schema=None):
+    """Route a prompt (+ optional PIL images, optional cacheable prefix, optional output schema) to
+    the selected model. Returns (text, err) like the old per-provider helpers; the generate_*
+    functions all go through here. A cut-off or schema-invalid answer is an error, never text —
+    a repaired fragment must not reach Shopify as if it were complete."""
+    provider, api_key, model_id = llm_route(gemini_key, claude_key, openai_key, selected_model)
+    result, err = llm_call(provider, api_key, model_id, prompt, images, temperature=temperature, max_tokens=max_tokens,
+                           timeout=timeout, use_cache=use_cache, task=task, prefix=prefix, schema=schema)
+    if not result:
+        return None, err
+    if result["truncated"]:
+        return None, f"{provider} ({result['model']}): answer was cut off ({result['finish_reason']}) — not used, retry"
+    if result["schema_errors"]:
+        return None, f"{provider} ({result['model']}): answer does not match the {schema} schema — {'; '.join(result['schema_errors'][:3])}"
+    return result["text"], None
 
 # ============================================================
 # --- AI FUNCTIONS (GEMINI & CLAUDE) ---
 # ============================================================
-def generate_image(api_key, image_list, prompt):
+def generate_image(api_key, image_list, prompt, task="image_gen"):
     """Image Generation - Gemini Only"""
     key = clean_key(api_key)
-    url = f"https://generativelanguage.googleapis.com/v1beta/{MODEL_IMAGE_GEN}:generateContent?key={key}"
+    url = f"{_llm_base('gemini')}/v1beta/{MODEL_IMAGE_GEN}:generateContent?key={key}"
     full_prompt = f"Instruction: {prompt} \nImportant Constraint: Keep the main jewelry product in the input image EXACTLY as it looks. Only improve lighting, background, and photography quality."
     
     parts = [{"text": full_prompt}]
     for img in image_list: parts.append({"inline_data": {"mime_type": "image/jpeg", "data": img_to_base64(img)}})
     
+    t0 = time.time()
     try:
-        res = requests.post(url, json={"contents": [{"parts": parts}], "generationConfig": {"temperature": 0.3}}, headers={"Content-Type": "application/json"})
-        if res.status_code != 200: return None, f"API Error {res.status_code}: {res.text}"
-        content = res.json().get("candidates", [])[0].get("content", {}).get("parts", [])[0]
+        res = http_post(url, json={"contents": [{"parts": parts}], "generationConfig": {"temperature": 0.3}}, headers={"Content-Type": "application/json"}, timeout=180)
+        if res.status_code != 200:
+            llm_usage_record("gemini_image", MODEL_IMAGE_GEN, task, len(image_list), latency_s=round(time.time() - t0, 3), ok=False)
+            return None, f"API Error {res.status_code}: {res.text}"
+        body = res.json()
+        usage = body.get("usageMetadata") or {}
+        llm_usage_record("gemini_image", MODEL_IMAGE_GEN, task, len(image_list), usage.get("promptTokenCount"),
+                         usage.get("candidatesTokenCount"), round(time.time() - t0, 3))
+        content = body.get("candidates", [])[0].get("content", {}).get("parts", [])[0]
         if "inline_data" in content: return base64.b64decode(content["inline_data"]["data"]), None
         if "inlineData" in content: return base64.b64decode(content["inlineData"]["data"]), None
         if "text" in content: return None, f"Model returned text: {content['text']}"
         return None, "Unknown format"
     except Exception as e: return None, str(e)
 
-def _call_gemini_text(gemini_key, payload, timeout=60):
-    """Helper: Call Gemini text model with automatic fallback from 3.1 to 3.0"""
-    key = clean_key(gemini_key)
-    models_to_try = [MODEL_TEXT_GEMINI, MODEL_TEXT_GEMINI_FALLBACK]
-    last_error = "Failed"
-    for model in models_to_try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/{model}:generateContent?key={key}"
-        for attempt in range(3):
-            try:
-                res = requests.post(url, json=payload, headers={"Content-Type": "application/json"}, timeout=timeout)
-                if res.status_code == 200:
-                    st.session_state["_gemini_active_model"] = model
-                    return res.json().get("candidates", [])[0].get("content", {}).get("parts", [])[0].get("text"), None
-                elif res.status_code in (503, 429):
-                    time.sleep(2); continue
-                else:
-                    last_error = f"Error {res.status_code} ({model}): {res.text}"
-                    break  # Try next model
-            except Exception as e:
-                last_error = f"Exception ({model}): {str(e)}"
-                time.sleep(1)
-        else:
-            continue  # All 3 attempts were 503/429 retries, try next model
-        continue  # Broke out of retry loop due to non-retryable error, try next model
-    return None, last_error
-
-def generate_seo_tags_smart(gemini_key, claude_key, openai_key, selected_model, context, product_url=""):
+def generate_seo_tags_smart(gemini_key, claude_key, openai_key, selected_model, context, product_url="", use_cache=True):
     prompt = SEO_PROMPT_SMART_GEN.replace("{context}", context).replace("{product_url}", product_url)
-    
-    # Claude models
-    if selected_model in CLAUDE_MODELS and claude_key:
-        model_id = CLAUDE_MODELS[selected_model]
-        return call_claude_api(claude_key, prompt, model_id=model_id)
-    
-    # OpenAI models
-    if selected_model in OPENAI_MODELS and openai_key:
-        model_id = OPENAI_MODELS[selected_model]
-        return call_openai_api(openai_key, prompt, model_id=model_id)
-    
-    # Default: Gemini (with fallback)
-    payload = {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": {"temperature": 0.5, "responseMimeType": "application/json"}}
-    return _call_gemini_text(gemini_key, payload)
+    return llm_generate(gemini_key, claude_key, openai_key, selected_model, prompt, temperature=0.5, use_cache=use_cache, task="seo_tags", schema="image_seo")
 
-def generate_seo_from_generated_image(gemini_key, claude_key, openai_key, selected_model, generated_image_bytes, product_url=""):
+def generate_seo_from_generated_image(gemini_key, claude_key, openai_key, selected_model, generated_image_bytes, product_url="", use_cache=True):
     """Analyze the generated image and create SEO tags based on visual content + product URL"""
     prompt = SEO_PROMPT_IMAGE_ANALYSIS.replace("{product_url}", product_url if product_url else "No URL provided")
     
@@ -2557,42 +4007,23 @@ def generate_seo_from_generated_image(gemini_key, claude_key, openai_key, select
         img_pil = Image.open(BytesIO(generated_image_bytes))
     except:
         return None, "Failed to process generated image"
-    
-    # Claude models
-    if selected_model in CLAUDE_MODELS and claude_key:
-        model_id = CLAUDE_MODELS[selected_model]
-        return call_claude_api(claude_key, prompt, [img_pil], model_id=model_id)
-    
-    # OpenAI models
-    if selected_model in OPENAI_MODELS and openai_key:
-        model_id = OPENAI_MODELS[selected_model]
-        return call_openai_api(openai_key, prompt, [img_pil], model_id=model_id)
-    
-    # Default: Gemini (with fallback)
-    parts = [{"text": prompt}, {"inline_data": {"mime_type": "image/jpeg", "data": img_to_base64(img_pil)}}]
-    payload = {"contents": [{"parts": parts}], "generationConfig": {"temperature": 0.5, "responseMimeType": "application/json"}}
-    return _call_gemini_text(gemini_key, payload)
+    return llm_generate(gemini_key, claude_key, openai_key, selected_model, prompt, [img_pil], temperature=0.5, use_cache=use_cache, task="seo_generated_image", schema="image_seo")
 
-def generate_seo_for_existing_image(gemini_key, claude_key, openai_key, selected_model, img_pil, product_url):
+def generate_seo_for_existing_image(gemini_key, claude_key, openai_key, selected_model, img_pil, product_url, use_cache=True):
     prompt = SEO_PROMPT_BULK_EXISTING.replace("{product_url}", product_url)
-    
-    # Claude models
-    if selected_model in CLAUDE_MODELS and claude_key:
-        model_id = CLAUDE_MODELS[selected_model]
-        return call_claude_api(claude_key, prompt, [img_pil], model_id=model_id)
-    
-    # OpenAI models
-    if selected_model in OPENAI_MODELS and openai_key:
-        model_id = OPENAI_MODELS[selected_model]
-        return call_openai_api(openai_key, prompt, [img_pil], model_id=model_id)
-    
-    # Default: Gemini (with fallback)
-    payload = {"contents": [{"parts": [{"text": prompt}, {"inline_data": {"mime_type": "image/jpeg", "data": img_to_base64(img_pil)}}]}], "generationConfig": {"temperature": 0.5, "responseMimeType": "application/json"}}
-    return _call_gemini_text(gemini_key, payload)
+    return llm_generate(gemini_key, claude_key, openai_key, selected_model, prompt, [img_pil], temperature=0.5, use_cache=use_cache, task="seo_existing_image", schema="image_seo")
 
-def generate_full_product_content(gemini_key, claude_key, openai_key, selected_model, img_pil_list, raw_input, catalog_text="", design_story="", product_handle="", opening_angle=""):
-    prompt = SEO_PRODUCT_WRITER_PROMPT.replace("{raw_input}", raw_input)
-    num_images = len(img_pil_list) if img_pil_list else 0
+def writer_prompt_prefix(catalog_text=""):
+    """The part of the product writer prompt that is the same for every product — the rules and
+    the catalog block. Sent as a cacheable prefix; the product itself follows in the suffix."""
+    prefix = SEO_PRODUCT_WRITER_PROMPT.replace("{raw_input}", "see PRODUCT INPUT at the end of this prompt")
+    if catalog_text:
+        prefix += f"\n\n--- REAL STORE CATALOG DATA (for 'You Might Also Want' section) ---\n{catalog_text}\n--- END CATALOG DATA ---"
+    return prefix
+
+def product_writer_prompt(raw_input, num_images=0, design_story="", product_handle="", opening_angle=""):
+    """The per-product part of the writer prompt (follows writer_prompt_prefix)."""
+    prompt = f"--- PRODUCT INPUT ---\n{raw_input}\n--- END PRODUCT INPUT ---"
     if num_images > 0:
         prompt += f"\n\nNOTE: This product has {num_images} images. You do NOT need to generate image_seo — it will be handled separately. Return an EMPTY array for image_seo: \"image_seo\": []"
     if product_handle:
@@ -2631,30 +4062,16 @@ INSTRUCTIONS FOR USING THIS:
 - The design story should enhance the product description, not dominate it.
   Maximum 2 sentences woven into existing sections.
 --- END DESIGN STORY ---"""
-    if catalog_text:
-        prompt += f"\n\n--- REAL STORE CATALOG DATA (for 'You Might Also Want' section) ---\n{catalog_text}\n--- END CATALOG DATA ---"
-    
-    # Claude models
-    if selected_model in CLAUDE_MODELS and claude_key:
-        model_id = CLAUDE_MODELS[selected_model]
-        return call_claude_api(claude_key, prompt, img_pil_list, model_id=model_id)
-    
-    # OpenAI models
-    if selected_model in OPENAI_MODELS and openai_key:
-        model_id = OPENAI_MODELS[selected_model]
-        return call_openai_api(openai_key, prompt, img_pil_list, model_id=model_id)
-    
-    # Default: Gemini (with fallback)
-    parts = [{"text": prompt}]
-    if img_pil_list:
-        for idx, img in enumerate(img_pil_list):
-            parts.append({"text": f"[IMAGE {idx+1} of {len(img_pil_list)}]"})
-            parts.append({"inline_data": {"mime_type": "image/jpeg", "data": img_to_base64(img)}})
-    payload = {"contents": [{"parts": parts}], "generationConfig": {"temperature": 0.7, "maxOutputTokens": 8192, "responseMimeType": "application/json"}}
-    return _call_gemini_text(gemini_key, payload, timeout=120)
+    return prompt
+
+def generate_full_product_content(gemini_key, claude_key, openai_key, selected_model, img_pil_list, raw_input, catalog_text="", design_story="", product_handle="", opening_angle="", use_cache=True):
+    prompt = product_writer_prompt(raw_input, len(img_pil_list) if img_pil_list else 0, design_story, product_handle, opening_angle)
+    return llm_generate(gemini_key, claude_key, openai_key, selected_model, prompt, img_pil_list,
+                        temperature=0.7, max_tokens=8192, timeout=120, use_cache=use_cache, task="product_content",
+                        prefix=writer_prompt_prefix(catalog_text), schema="product_content")
 
 
-def generate_image_seo_per_image(gemini_key, claude_key, openai_key, selected_model, img_pil, image_index, total_images, product_name, product_description_snippet, previous_filenames=None, previous_alts=None):
+def generate_image_seo_per_image(gemini_key, claude_key, openai_key, selected_model, img_pil, image_index, total_images, product_name, product_description_snippet, previous_filenames=None, previous_alts=None, use_cache=True):
     """Generate SEO file_name and alt_tag for a SINGLE image.
     
     Sends ONE image at a time with product context so the AI:
@@ -2758,22 +4175,105 @@ multiple visual search queries — repetitive names only rank for one query.
 Return RAW JSON only (no markdown backticks):
 {{"file_name": "descriptive-name.jpg", "alt_tag": "Unique description of what this image shows"}}"""
 
-    # Claude models
-    if selected_model in CLAUDE_MODELS and claude_key:
-        model_id = CLAUDE_MODELS[selected_model]
-        return call_claude_api(claude_key, prompt, [img_pil], model_id=model_id)
-    
-    # OpenAI models
-    if selected_model in OPENAI_MODELS and openai_key:
-        model_id = OPENAI_MODELS[selected_model]
-        return call_openai_api(openai_key, prompt, [img_pil], model_id=model_id)
-    
-    # Default: Gemini
-    parts = [{"text": prompt}, {"inline_data": {"mime_type": "image/jpeg", "data": img_to_base64(img_pil)}}]
-    payload = {"contents": [{"parts": parts}], "generationConfig": {"temperature": 0.4, "responseMimeType": "application/json"}}
-    return _call_gemini_text(gemini_key, payload, timeout=30)
-
-def generate_seo_name_slug(gemini_key, claude_key, openai_key, selected_model, img_list, user_desc):
+    return llm_generate(gemini_key, claude_key, openai_key, selected_model, prompt, [img_pil],
+                        temperature=0.4, timeout=30, use_cache=use_cache, task="image_seo", schema="image_seo")
+
+def _image_seo_fallback(idx):
+    return {"file_name": f"product-image-{idx}.jpg", "alt_tag": f"Product image {idx}"}
+
+def _image_seo_slug_words(text):
+    return [w for w in re.sub(r"[^a-z0-9]+", " ", (text or "").lower()).split() if w]
+
+def dedupe_image_seo(image_seo, product_name=""):
+    """Local post-pass for image SEO generated without seeing the other images:
+    - file names: lowercase-hyphen .jpg; images 2+ lose a leading copy of image 1's opening words
+      (the full product name belongs on image 1 only); collisions get a distinguishing word from
+      the alt tag, then a number.
+    - alt tags: capped at 125 chars on a word boundary; exact repeats get the file name's focus words."""
+    out, used_names, used_alts = [], set(), set()
+    first_words = []
+    for idx, seo in enumerate(image_seo, 1):
+        seo = dict(seo or {}) or _image_seo_fallback(idx)
+        words = _image_seo_slug_words(re.sub(r"\.(jpe?g|png|webp)$", "", seo.get("file_name", ""), flags=re.I))
+        if not words: words = ["product", "image", str(idx)]
+        if idx == 1:
+            first_words = words[:max(3, len(_image_seo_slug_words(product_name)))]
+        else:
+            shared = 0
+            while shared < len(words) and shared < len(first_words) and words[shared] == first_words[shared]: shared += 1
+            if shared >= 3 and len(words) - shared >= 3: words = words[shared:]
+        name = "-".join(words)
+        if name in used_names:
+            extra = [w for w in _image_seo_slug_words(seo.get("alt_tag", "")) if w not in words and len(w) > 3]
+            for w in extra:
+                if f"{name}-{w}" not in used_names: name = f"{name}-{w}"; break
+            n = 2
+            base = name
+            while name in used_names: name = f"{base}-{n}"; n += 1
+        used_names.add(name)
+        seo["file_name"] = name + ".jpg"
+
+        alt = " ".join((seo.get("alt_tag") or "").split())
+        if len(alt) > 125: alt = alt[:125].rsplit(" ", 1)[0].rstrip(",;:-")
+        if not alt: alt = _image_seo_fallback(idx)["alt_tag"]
+        if alt.lower() in used_alts:
+            alt_words = _image_seo_slug_words(alt)
+            focus = " ".join([w for w in name.split("-") if w not in alt_words][-3:])
+            candidate = f"{alt} — {focus}" if focus else alt
+            if candidate.lower() in used_alts or candidate == alt: candidate = f"{alt} — view {idx}"
+            alt = candidate[:125]
+        used_alts.add(alt.lower())
+        seo["alt_tag"] = alt
+        out.append(seo)
+    return out
+
+def generate_image_seo_all(gemini_key, claude_key, openai_key, selected_model, images, product_name,
+                           product_description_snippet, parallel=True, progress_callback=None, use_cache=True):
+    """file_name/alt_tag for every image, in image order (failed images get a placeholder).
+    parallel=True: all images at once (latency ≈ slowest single image), then dedupe_image_seo().
+    parallel=False: one at a time, each call seeing the names/alts already chosen (old behaviour)."""
+    total = len(images)
+    results = [None] * total
+
+    def _parse(img_json):
+        img_d = parse_json_response(img_json) if img_json else None
+        if isinstance(img_d, list) and img_d: img_d = img_d[0]
+        return img_d if isinstance(img_d, dict) else None
+
+    if parallel:
+        def _one(item):
+            idx, img = item
+            img_json, img_err = generate_image_seo_per_image(
+                gemini_key, claude_key, openai_key, selected_model, img, idx + 1, total,
+                product_name, product_description_snippet, use_cache=use_cache)
+            return _parse(img_json)
+        provider = provider_for_model(selected_model, claude_key, openai_key)
+        done = 0
+        for (idx, img), img_d, exc in run_concurrent_batch(list(enumerate(images)), _one, provider,
+                                                           max_workers=PROVIDER_CONCURRENCY.get(provider, 4)):
+            results[idx] = img_d or _image_seo_fallback(idx + 1)
+            done += 1
+            if progress_callback: progress_callback(done, total)
+        return dedupe_image_seo(results, product_name)
+
+    prev_fnames, prev_alts = [], []
+    for idx, img in enumerate(images):
+        try:
+            img_json, img_err = generate_image_seo_per_image(
+                gemini_key, claude_key, openai_key, selected_model, img, idx + 1, total,
+                product_name, product_description_snippet,
+                previous_filenames=prev_fnames if prev_fnames else None,
+                previous_alts=prev_alts if prev_alts else None, use_cache=use_cache)
+            img_d = _parse(img_json)
+        except Exception:
+            img_d = None
+        results[idx] = img_d or _image_seo_fallback(idx + 1)
+        prev_fnames.append(results[idx].get("file_name", ""))
+        prev_alts.append(results[idx].get("alt_tag", ""))
+        if progress_callback: progress_callback(idx + 1, total)
+    return results
+
+def generate_seo_name_slug(gemini_key, claude_key, openai_key, selected_model, img_list, user_desc, use_cache=True):
     prompt = SEO_PROMPT_NAME_SLUG.replace("{user_desc}", user_desc)
     pil_images = []
     if img_list:
@@ -2782,68 +4282,127 @@ def generate_seo_name_slug(gemini_key, claude_key, openai_key, selected_model, i
                 try: pil_images.append(Image.open(BytesIO(item)))
                 except: pass
             elif isinstance(item, Image.Image): pil_images.append(item)
-    
-    # Claude models
-    if selected_model in CLAUDE_MODELS and claude_key:
-        model_id = CLAUDE_MODELS[selected_model]
-        return call_claude_api(claude_key, prompt, pil_images if pil_images else None, model_id=model_id)
-    
-    # OpenAI models
-    if selected_model in OPENAI_MODELS and openai_key:
-        model_id = OPENAI_MODELS[selected_model]
-        return call_openai_api(openai_key, prompt, pil_images if pil_images else None, model_id=model_id)
-    
-    # Default: Gemini (with fallback)
-    parts = [{"text": prompt}]
-    for img in pil_images: parts.append({"inline_data": {"mime_type": "image/jpeg", "data": img_to_base64(img)}})
-    payload = {"contents": [{"parts": parts}], "generationConfig": {"temperature": 0.7, "responseMimeType": "application/json"}}
-    return _call_gemini_text(gemini_key, payload)
-
-def summarize_collection_products(shop_url, access_token, collection_id, max_products=100):
-    """Fetch products in a specific collection and create a summary for AI context.
-    Returns a text summary of materials, product types, and product names."""
-    products, next_cursor, err = get_shopify_products_page(
-        shop_url, access_token, limit=min(max_products, 250), collection_id=collection_id
-    )
-    if not products:
-        return ""
-    
-    # Extract key info
-    titles = []
-    materials_found = {}
-    product_types = {}
-    
-    material_keywords = [
-        "sterling silver", ".925 silver", "925 silver", "silver",
-        "stainless steel", "316l", "steel",
-        "brass", "bronze", "copper",
-        "gold", "gold plated", "gold-plated", "14k", "18k", "10k",
-        "titanium", "tungsten", "pewter", "leather"
-    ]
-    
-    for p in products:
-        titles.append(p.get("title", ""))
-        # Count product types
-        ptype = p.get("product_type", "").strip()
-        if ptype:
-            product_types[ptype] = product_types.get(ptype, 0) + 1
-        # Scan title + body for materials
-        text = (p.get("title", "") + " " + (p.get("body_html", "") or "")).lower()
-        for mat in material_keywords:
-            if mat in text:
-                # Normalize to common name
-                if mat in [".925 silver", "925 silver"]:
-                    mat_key = "sterling silver"
-                elif mat == "316l":
-                    mat_key = "stainless steel"
-                else:
-                    mat_key = mat
-                materials_found[mat_key] = materials_found.get(mat_key, 0) + 1
+    return llm_generate(gemini_key, claude_key, openai_key, selected_model, prompt, pil_images, temperature=0.7, use_cache=use_cache, task="name_slug", schema="name_slug")
+
+# --- COLLECTION PRODUCT SUMMARY ---
+# Collection Writer context (materials, product types, sample names) over EVERY product in the
+# collection. Pages stream in one at a time — local catalog rows with their bodies when the
+# membership index covers the collection, collection products.json pages otherwise — and each
+# title + body is scanned once by a keyword automaton. The aggregate is stored per collection and
+# version (collection updated_at + members' updated_at), so an unchanged collection costs no calls.
+COLLECTION_MATERIAL_KEYWORDS = [
+    "sterling silver", ".925 silver", "925 silver", "silver",
+    "stainless steel", "316l", "steel",
+    "brass", "bronze", "copper",
+    "gold", "gold plated", "gold-plated", "14k", "18k", "10k",
+    "titanium", "tungsten", "pewter", "leather"
+]
+COLLECTION_MATERIAL_ALIASES = {".925 silver": "sterling silver", "925 silver": "sterling silver", "316l": "stainless steel"}
+COLLECTION_SAMPLE_TITLES = 15
+
+def keyword_matcher(keywords):
+    """Compile keywords into one trie-shaped regex (a keyword automaton: shared prefixes are tested once,
+    the text is walked once) plus what makes a non-overlapping scan exact — implies[k]: keywords inside k,
+    follows[k]: keywords that can start inside k and run past its end (rare; checked directly)."""
+    trie = {}
+    for word in keywords:
+        node = trie
+        for ch in word: node = node.setdefault(ch, {})
+        node[""] = {}
+    def emit(node):
+        alts = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not alts: return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body   # greedy — the longest keyword at a position wins
+    words = set(keywords)
+    return {"regex": re.compile(emit(trie)),
+            "implies": {k: {o for o in words if o in k} for k in words},
+            "follows": {k: {o for o in words if o not in k and any(o.startswith(k[i:]) for i in range(1, len(k)))}
+                        for k in words}}
+
+def keyword_scan(matcher, text):
+    """Set of keywords occurring anywhere in text (already lowercased)."""
+    found = set()
+    for hit in set(matcher["regex"].findall(text)):
+        found |= matcher["implies"][hit]
+        found |= {o for o in matcher["follows"][hit] if o not in found and o in text}
+    return found
+
+COLLECTION_MATERIAL_MATCHER = keyword_matcher(COLLECTION_MATERIAL_KEYWORDS)
+
+def _collection_product_pages(shop_url, access_token, collection_id, local=None):
+    """Yield (products, err) a page at a time for every product in a collection, bodies included.
+    local = the collection's rows from the stored catalog (None → stream from Shopify)."""
+    if local is not None:
+        for start in range(0, len(local), CATALOG_BODY_CHUNK):
+            yield catalog_product_bodies(shop_url, access_token, local[start:start + CATALOG_BODY_CHUNK])
+        return
+    cursor = None
+    for _ in range(200):
+        ep = f"collections/{collection_id}/products.json?limit=250&fields=id,title,product_type,body_html,updated_at"
+        if cursor: ep += f"&page_info={cursor}"
+        res, err = _shopify_admin_get(shop_url, access_token, ep, timeout=60)
+        if err:
+            yield [], err
+            return
+        yield res.json().get("products", []), None
+        cursor = _shopify_next_page_info(res)
+        if not cursor: return
+
+def collection_product_summary(shop_url, access_token, collection_id):
+    """{"total", "materials": {name: products}, "types": {product_type: products}, "titles": [first few]}
+    over the whole collection, from the stored aggregate when the collection is unchanged. Returns (summary, err)."""
+    shop, cid = _shopify_domain(shop_url), str(collection_id)
+    with _db() as conn:
+        row = conn.execute("SELECT data FROM collections WHERE shop = ? AND id = ?", (shop, cid)).fetchone()
+    col_updated = json.loads(row["data"]).get("updated_at", "") if row else ""
+    members = catalog_collection_members(shop_url, cid)
+    local = catalog_collection_products(shop_url, cid) if members is not None else None
+    if local is not None and len(local) < len(members):
+        local = None   # members the local catalog doesn't have yet — read the collection from Shopify
+    version = hashlib.sha1("\x1e".join([col_updated] + [f"{p['id']}\x1f{p.get('updated_at', '')}" for p in local or ()]).encode()).hexdigest()
+    cacheable = bool(col_updated) or local is not None
+    if cacheable:
+        with _db() as conn:
+            hit = conn.execute("SELECT summary FROM collection_summaries WHERE shop = ? AND collection_id = ? AND version = ?",
+                               (shop, cid, version)).fetchone()
+        if hit: return json.loads(hit["summary"]), None
+
+    summary = {"total": 0, "materials": {}, "types": {}, "titles": []}
+    for page, err in _collection_product_pages(shop_url, access_token, cid, local):
+        if err: return summary, err   # partial — not stored
+        for p in page:
+            summary["total"] += 1
+            if len(summary["titles"]) < COLLECTION_SAMPLE_TITLES: summary["titles"].append(p.get("title", ""))
+            ptype = (p.get("product_type") or "").strip()
+            if ptype: summary["types"][ptype] = summary["types"].get(ptype, 0) + 1
+            text = f"{p.get('title', '')} {p.get('body_html') or ''}".lower()
+            # One count per product and material, however many spellings of it the text uses
+            for name in {COLLECTION_MATERIAL_ALIASES.get(k, k) for k in keyword_scan(COLLECTION_MATERIAL_MATCHER, text)}:
+                summary["materials"][name] = summary["materials"].get(name, 0) + 1
+    if cacheable:
+        with _db() as conn:
+            conn.execute("DELETE FROM collection_summaries WHERE shop = ? AND collection_id = ?", (shop, cid))
+            conn.execute("INSERT OR REPLACE INTO collection_summaries (shop, collection_id, version, summary, created) VALUES (?, ?, ?, ?, ?)",
+                         (shop, cid, version, json.dumps(summary), time.time()))
+    return summary, None
+
+def summarize_collection_products(shop_url, access_token, collection_id):
+    """Summarize every product in a collection for AI context.
+    Returns (text summary of materials, product types and product names, err). A read that stopped
+    part-way gives ("", err): shares from a partial count would mislabel COMMON/RARE/PRIMARY materials."""
+    summary, err = collection_product_summary(shop_url, access_token, collection_id)
+    if err:
+        return "", err
+    total = summary["total"]
+    if not total:
+        return "", None
     
     # Build summary
     lines = []
-    lines.append(f"Total products in this collection: {len(products)}")
+    lines.append(f"Total products in this collection: {total}")
     
+    materials_found = summary["materials"]
     if materials_found:
         # Sort by count descending
         sorted_mats = sorted(materials_found.items(), key=lambda x: -x[1])
@@ -2852,7 +4411,7 @@ def summarize_collection_products(shop_url, access_token, collection_id, max_pro
         common_mats = []
         rare_mats = []
         for name, count in sorted_mats:
-            pct = int(count / len(products) * 100)
+            pct = int(count / total * 100)
             if pct >= 20:
                 common_mats.append(f"{name} ({count} products, {pct}%)")
             else:
@@ -2865,25 +4424,29 @@ def summarize_collection_products(shop_url, access_token, collection_id, max_pro
         
         # Highlight primary material
         primary = sorted_mats[0]
-        pct = int(primary[1] / len(products) * 100)
+        pct = int(primary[1] / total * 100)
         if pct > 50:
             lines.append(f"⚠️ PRIMARY material: {primary[0]} ({pct}% of products) — use this as the main material in H1, meta title, and meta description")
     
-    if product_types:
-        sorted_types = sorted(product_types.items(), key=lambda x: -x[1])
+    if summary["types"]:
+        sorted_types = sorted(summary["types"].items(), key=lambda x: -x[1])
         type_strs = [f"{name} ({count})" for name, count in sorted_types[:5]]
         lines.append(f"Product types: {', '.join(type_strs)}")
     
-    # Show sample product names (first 15)
-    sample = titles[:15]
-    lines.append(f"Sample product names: {', '.join(sample)}")
+    # Show sample product names
+    lines.append(f"Sample product names: {', '.join(summary['titles'])}")
     
-    return "\n".join(lines)
+    return "\n".join(lines), None
 
-def generate_collection_content(gemini_key, claude_key, openai_key, selected_model, main_keyword, collection_url, catalog_text="", collection_products_summary=""):
-    """Generate SEO collection page content."""
+def generate_collection_content(gemini_key, claude_key, openai_key, selected_model, main_keyword, collection_url, catalog_text="", collection_products_summary="", use_cache=True):
+    """Generate SEO collection page content. The rules and catalog go in a cacheable prefix;
+    keyword, URL, opening format and product summary follow in the per-collection suffix."""
     import random
-    prompt = SEO_COLLECTION_WRITER_PROMPT.replace("{main_keyword}", main_keyword).replace("{collection_url}", collection_url)
+    prefix = (SEO_COLLECTION_WRITER_PROMPT.replace("{main_keyword}", "see COLLECTION INPUT at the end of this prompt")
+              .replace("{collection_url}", "see COLLECTION INPUT at the end of this prompt"))
+    if catalog_text:
+        prefix += f"\n\n--- REAL STORE CATALOG DATA (for internal links) ---\n{catalog_text}\n--- END CATALOG DATA ---"
+    prompt = f"--- COLLECTION INPUT ---\nMain Keyword: {main_keyword}\nCollection URL: {collection_url}\n--- END COLLECTION INPUT ---"
     
     # Randomize opening format to prevent repetitive patterns across collections
     formats = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J"]
@@ -2921,32 +4484,13 @@ CRITICAL RULES FOR USING THIS DATA:
 
 {collection_products_summary}
 --- END COLLECTION PRODUCTS ---"""
-    if catalog_text:
-        prompt += f"\n\n--- REAL STORE CATALOG DATA (for internal links) ---\n{catalog_text}\n--- END CATALOG DATA ---"
-    
-    # Claude models
-    if selected_model in CLAUDE_MODELS and claude_key:
-        model_id = CLAUDE_MODELS[selected_model]
-        return call_claude_api(claude_key, prompt, None, model_id=model_id)
-    
-    # OpenAI models
-    if selected_model in OPENAI_MODELS and openai_key:
-        model_id = OPENAI_MODELS[selected_model]
-        return call_openai_api(openai_key, prompt, None, model_id=model_id)
-    
-    # Default: Gemini (with fallback)
-    parts = [{"text": prompt}]
-    payload = {"contents": [{"parts": parts}], "generationConfig": {"temperature": 0.7, "maxOutputTokens": 8192, "responseMimeType": "application/json"}}
-    return _call_gemini_text(gemini_key, payload)
+    return llm_generate(gemini_key, claude_key, openai_key, selected_model, prompt,
+                        temperature=0.7, max_tokens=8192, use_cache=use_cache, task="collection_content", prefix=prefix,
+                        schema="collection_content")
 
 def update_shopify_collection(shop_url, access_token, collection_id, data, collection_type="custom"):
     """Update a Shopify collection's title, body_html, and meta fields."""
-    shop_url = shop_url.replace("https://", "").replace("http://", "").strip()
-    if not shop_url.endswith(".myshopify.com"): shop_url += ".myshopify.com"
-    
     endpoint_type = "custom_collections" if collection_type == "custom" else "smart_collections"
-    url = f"https://{shop_url}/admin/api/2026-04/{endpoint_type}/{collection_id}.json"
-    headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
     
     col_key = "custom_collection" if collection_type == "custom" else "smart_collection"
     payload = {
@@ -2962,20 +4506,616 @@ def update_shopify_collection(shop_url, access_token, collection_id, data, colle
     }
     
     try:
-        response = requests.put(url, json=payload, headers=headers, timeout=30)
+        response = _shopify_request("PUT", shop_url, access_token, f"{endpoint_type}/{collection_id}.json", json=payload, timeout=30)
         if response.status_code in [200, 201]: return True, "✅ Collection Updated!"
         return False, f"Error {response.status_code}: {response.text[:300]}"
     except Exception as e: return False, str(e)
 
 def list_available_models(api_key):
     key = clean_key(api_key)
-    url = f"https://generativelanguage.googleapis.com/v1beta/models?key={key}"
+    url = f"{_llm_base('gemini')}/v1beta/models?key={key}"
     try:
-        response = requests.get(url, timeout=10)
+        response = http_get(url, timeout=10)
         if response.status_code == 200: return response.json().get("models", [])
         return None
     except: return None
 
+# ============================================================
+# --- CONCURRENT BATCH ENGINE ---
+# ============================================================
+def provider_for_model(selected_model, claude_key="", openai_key=""):
+    """Which provider the generate_* functions will actually call (mirrors their if-chain)."""
+    if selected_model in CLAUDE_MODELS and claude_key: return "claude"
+    if selected_model in OPENAI_MODELS and openai_key: return "openai"
+    return "gemini"
+
+@st.cache_resource(show_spinner=False)
+def _provider_semaphores():
+    """One semaphore per provider for the whole server process, so two batches
+    running in different tabs still share the same PROVIDER_CONCURRENCY cap."""
+    return {p: threading.BoundedSemaphore(n) for p, n in PROVIDER_CONCURRENCY.items()}
+
+def run_concurrent_batch(items, worker, provider, max_workers=4, warmup=0):
+    """Run worker(item) for every item on a thread pool and yield (item, result, error)
+    in completion order. At most max_workers items run for this batch, and never more
+    than PROVIDER_CONCURRENCY[provider] calls across all batches on that provider.
+    The first `warmup` items finish before the rest start (lets a provider prompt cache fill).
+    Consume the generator in the script thread — that is where st.* / session_state writes belong."""
+    sem = _provider_semaphores().get(provider)
+    ctx = get_script_run_ctx()
+
+    def _run(item):
+        # worker threads share the session so helpers like llm_call can note state
+        if ctx: add_script_run_ctx(threading.current_thread(), ctx)
+        if sem is None: return worker(item)
+        with sem:
+            return worker(item)
+
+    items = list(items)
+    groups = [items[:warmup], items[warmup:]] if warmup else [items]
+    with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as pool:
+        for group in groups:
+            # each item runs in a copy of the caller's contextvars (cache switch, run ids, ...)
+            futures = {pool.submit(contextvars.copy_context().run, _run, item): item for item in group}
+            for fut in as_completed(futures):
+                try:
+                    yield futures[fut], fut.result(), None
+                except Exception as e:
+                    yield futures[fut], None, str(e)
+
+def batch_generate_one(prod, gemini_key, claude_key, openai_key, batch_model, catalog=None,
+                       opening_angle="", auto_update=False, shop_url="", access_token="", job_id=None,
+                       catalog_text=None):
+    """Generate (and optionally push) content for ONE Batch Writer product.
+    Thread-safe: no st.* calls — returns the batch_results entry for this product.
+    With job_id, every state change is written to the batch job journal.
+    catalog_text = one catalog block shared by the whole batch (see batch_catalog_text);
+    None builds a block ranked for this product alone."""
+    batch_job_mark(job_id, prod["id"], "generating")
+    raw_input = batch_product_input(prod)
+    if catalog_text is None:
+        catalog_text = batch_product_catalog_text(catalog, raw_input)
+
+    # Generate content (text only — no images for batch speed)
+    json_txt, err = generate_full_product_content(
+        gemini_key, claude_key, openai_key, batch_model,
+        None, raw_input, catalog_text, product_handle=prod.get("handle", ""),
+        opening_angle=opening_angle
+    )
+    return batch_finish_one(prod, json_txt, err, auto_update, shop_url, access_token, job_id)
+
+def batch_product_input(prod):
+    """Writer input for a Batch Writer product, built from its existing Shopify data."""
+    raw_input = prod.get("body_html", "") or ""
+    raw_input = remove_html_tags(raw_input) if raw_input else ""
+    return f"Product Name: {prod['title']}\nProduct Type: {prod.get('product_type', '')}\nSKU: {prod.get('sku', '')}\n\n{raw_input}"
+
+def batch_product_catalog_text(catalog, raw_input):
+    """Smart catalog: filtered by this product's context for relevant links."""
+    if catalog and (catalog.get("collections") or catalog.get("products")):
+        return format_catalog_for_prompt(catalog, product_context=raw_input)
+    return ""
+
+def batch_finish_one(prod, json_txt, err, auto_update=False, shop_url="", access_token="", job_id=None):
+    """Parse one product's writer answer, journal it and (optionally) push it. Thread-safe.
+    Returns the batch_results entry."""
+    if not json_txt:
+        batch_job_mark(job_id, prod["id"], "failed", error=err or "Generation failed")
+        return {"error": err or "Generation failed", "job_id": job_id}
+    d = parse_json_response(json_txt)
+    if isinstance(d, list) and d: d = d[0]
+    if not isinstance(d, dict):
+        batch_job_mark(job_id, prod["id"], "failed", error="Parse failed")
+        return {"error": "Parse failed", "raw": json_txt[:500], "job_id": job_id}
+
+    batch_job_mark(job_id, prod["id"], "generated", payload=d)
+    # Auto-update to Shopify if requested
+    if auto_update:
+        return batch_push_one(prod, d, shop_url, access_token, job_id=job_id)
+    return {"success": True, "data": d, "job_id": job_id}
+
+
+def batch_catalog_text(catalog, products):
+    """One catalog block for a whole batch, ranked against all its products together. Every product
+    then sends the identical writer prefix, so provider prompt caching serves it after the first."""
+    if not catalog or not (catalog.get("collections") or catalog.get("products")): return ""
+    context = " ".join(f"{p.get('title', '')} {p.get('product_type', '')} {p.get('tags', '')}" for p in products)
+    return format_catalog_for_prompt(catalog, product_context=context)
+
+def retouch_image(gemini_key, img, prompt, retries=RETOUCH_RETRIES):
+    """generate_image() for one Retouch image with its own retry budget.
+    Thread-safe (no st.* calls). Returns (image_bytes_or_None, err_or_None)."""
+    err = None
+    for attempt in range(retries + 1):
+        img_bytes, err = generate_image(gemini_key, [img], prompt, task="retouch")
+        if img_bytes: return img_bytes, None
+        if attempt < retries: time.sleep(_llm_retry_delay(attempt))
+    return None, err
+
+def bulk_seo_one(gemini_key, claude_key, openai_key, selected_model, img, product_url, retries=BULK_SEO_RETRIES):
+    """Bulk SEO tags for one image with its own retry budget for failed calls. The answer is
+    schema-checked by llm_call, so a malformed one is not regenerated here. Thread-safe.
+    Returns {file_name, alt_tag, ...} or {"error", "raw"?}; "attempts" is added."""
+    result = {"error": "Not run"}
+    for attempt in range(retries + 1):
+        txt, err = generate_seo_for_existing_image(gemini_key, claude_key, openai_key, selected_model, img, product_url,
+                                                   use_cache=attempt == 0)
+        if txt:
+            d = parse_json_response(txt)
+            if isinstance(d, list) and d: d = d[0]
+            result = d if isinstance(d, dict) else {"error": "Invalid format", "raw": txt}
+            break
+        result = {"error": err}
+        if attempt < retries: time.sleep(_llm_retry_delay(attempt))
+    result["attempts"] = attempt + 1
+    return result
+
+# --- BATCH JOB JOURNAL ---
+# Every Batch Writer run is journaled per product in the local store, so a closed tab, dropped
+# connection or rerun mid-batch loses nothing: finished payloads are kept, and "Resume" only
+# regenerates what never finished and re-pushes what was generated but not yet on Shopify.
+# Item states: queued → generating → generated → pushed, or failed.
+# A run (foreground, background or offline, in any session) claims its job first and the claim's
+# heartbeat moves with every journaled item; Resume only takes over a job whose claim is gone
+# or stale, so rows a live run is still working on are never generated or pushed twice.
+BATCH_JOB_STATES = ("queued", "generating", "generated", "pushed", "failed")
+BATCH_JOB_CLAIM_TTL = 600   # seconds without a journaled item before a run's claim counts as abandoned
+
+def batch_job_create(shop_url, model, auto_update, products, angles=None, mode=None):
+    """Journal a new run (mode "offline" = provider batch API). Returns the job id."""
+    job_id = time.strftime("%Y%m%d-%H%M%S") + "-" + hashlib.sha1(os.urandom(8)).hexdigest()[:6]
+    now = time.time()
+    with _db() as conn:
+        conn.execute("INSERT INTO batch_jobs (id, shop, model, auto_update, created, total, mode) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (job_id, _shopify_domain(shop_url), model, int(bool(auto_update)), now, len(products), mode))
+        conn.executemany(
+            "INSERT INTO batch_job_items (job_id, product_id, position, state, opening_angle, product, updated) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            [(job_id, p["id"], i, (angles or {}).get(p["id"], ""), json.dumps(p), now) for i, p in enumerate(products)])
+    return job_id
+
+def batch_job_mark(job_id, product_id, state, payload=None, error=None, update_msg=None):
+    """Record one product's new state (payload/error/update_msg are kept unless given)."""
+    if not job_id: return
+    try:
+        with _db() as conn:
+            conn.execute(
+                "UPDATE batch_job_items SET state = ?, payload = COALESCE(?, payload), error = ?, "
+                "update_msg = COALESCE(?, update_msg), updated = ? WHERE job_id = ? AND product_id = ?",
+                (state, json.dumps(payload) if payload is not None else None, error, update_msg, time.time(), job_id, product_id))
+            conn.execute("UPDATE batch_jobs SET claimed_at = ? WHERE id = ? AND claimed_by IS NOT NULL", (time.time(), job_id))
+    except sqlite3.Error:
+        pass
+
+def batch_job_claim(job_id, owner):
+    """Take the job for run `owner`. Succeeds when it is unclaimed, already ours, or its claim went
+    stale (no heartbeat for BATCH_JOB_CLAIM_TTL). Returns True when the claim is ours."""
+    now = time.time()
+    with _db() as conn:
+        cur = conn.execute("UPDATE batch_jobs SET claimed_by = ?, claimed_at = ? WHERE id = ? AND "
+                           "(claimed_by IS NULL OR claimed_by = ? OR claimed_at < ?)",
+                           (owner, now, job_id, owner, now - BATCH_JOB_CLAIM_TTL))
+        return cur.rowcount == 1
+
+def batch_job_release(job_id, owner):
+    """Give the job back once run `owner` has finished with it."""
+    with _db() as conn:
+        conn.execute("UPDATE batch_jobs SET claimed_by = NULL, claimed_at = NULL WHERE id = ? AND claimed_by = ?", (job_id, owner))
+
+def _batch_job_claimed(job):
+    return bool(job.get("claimed_by")) and (job.get("claimed_at") or 0) >= time.time() - BATCH_JOB_CLAIM_TTL
+
+def batch_jobs_list(shop_url, limit=10):
+    """Most recent jobs for a shop with per-state counts."""
+    with _db() as conn:
+        jobs = [dict(r) for r in conn.execute(
+            "SELECT * FROM batch_jobs WHERE shop = ? ORDER BY created DESC LIMIT ?", (_shopify_domain(shop_url), limit))]
+        for job in jobs:
+            job["counts"] = {s: 0 for s in BATCH_JOB_STATES}
+            for r in conn.execute("SELECT state, COUNT(*) AS n FROM batch_job_items WHERE job_id = ? GROUP BY state", (job["id"],)):
+                job["counts"][r["state"]] = r["n"]
+            c = job["counts"]
+            job["remaining"] = c["queued"] + c["generating"] + c["failed"] + (c["generated"] if job["auto_update"] else 0)
+            job["provider_batches"] = json.loads(job.get("provider_batches") or "[]")
+            job["pending_batches"] = sum(1 for b in job["provider_batches"] if not b["done"])
+            job["claimed"] = _batch_job_claimed(job)
+    return jobs
+
+def batch_job_get(job_id):
+    """One job row with provider_batches decoded, or None."""
+    with _db() as conn:
+        row = conn.execute("SELECT * FROM batch_jobs WHERE id = ?", (job_id,)).fetchone()
+    if not row: return None
+    job = dict(row)
+    job["provider_batches"] = json.loads(job.get("provider_batches") or "[]")
+    job["claimed"] = _batch_job_claimed(job)
+    return job
+
+def batch_job_set_provider_batches(job_id, batches):
+    with _db() as conn:
+        conn.execute("UPDATE batch_jobs SET provider_batches = ? WHERE id = ?", (json.dumps(batches), job_id))
+
+def batch_job_items(job_id):
+    """Journal rows in the original order, with product and payload decoded."""
+    with _db() as conn:
+        rows = [dict(r) for r in conn.execute("SELECT * FROM batch_job_items WHERE job_id = ? ORDER BY position", (job_id,))]
+    for r in rows:
+        r["product"] = json.loads(r["product"])
+        r["payload"] = json.loads(r["payload"]) if r["payload"] else None
+    return rows
+
+def batch_job_result_entry(row):
+    """batch_results-shaped entry for a journal row (what the Results Review renders)."""
+    if row["state"] in ("generated", "pushed") and row["payload"]:
+        entry = {"success": True, "data": row["payload"], "job_id": row["job_id"]}
+        if row["state"] == "pushed": entry.update(updated=True, update_msg=row["update_msg"] or "✅ Updated")
+        elif row["update_msg"]: entry.update(updated=False, update_msg=row["update_msg"])
+        return entry
+    if row["state"] == "failed": return {"error": row["error"] or "Failed", "job_id": row["job_id"]}
+    return None
+
+def batch_push_one(prod, data, shop_url, access_token, job_id=None):
+    """Push an already generated payload (resume path — no LLM call). Thread-safe."""
+    result_entry = {"success": True, "data": data, "job_id": job_id}
+    try:
+        ok, msg = update_shopify_description_only(shop_url, access_token, prod["id"], data)
+    except Exception as ue:
+        ok, msg = False, str(ue)
+    result_entry["updated"], result_entry["update_msg"] = ok, msg
+    batch_job_mark(job_id, prod["id"], "pushed" if ok else "generated", update_msg=msg)
+    return result_entry
+
+# ============================================================
+# --- PROVIDER BATCH APIS (OFFLINE BATCH WRITER) ---
+# ============================================================
+# Catalog-wide rewrites don't need interactive latency. In offline mode the Batch Writer packs
+# every product's writer request into Anthropic Message Batches / OpenAI Batch / Gemini batch
+# jobs (half the per-token price, no per-call rate limits), polls until the provider is done
+# and ingests the answers into the journal exactly like live results. A provider can take up
+# to 24h: a background watcher polls for PROVIDER_BATCH_WATCH, after that "Check status" in
+# Batch Jobs picks the results up. Payloads are the ones llm_call sends, built by _llm_request.
+PROVIDER_BATCH_LIMITS = {   # (requests, bytes) per submitted batch — bigger runs are split
+    "claude": (100_000, 200 * 1024 * 1024),
+    "openai": (50_000, 180 * 1024 * 1024),
+    "gemini": (10_000, 18 * 1024 * 1024),   # inline requests: the whole call must stay under 20 MB
+}
+PROVIDER_BATCH_POLL = 30           # seconds between status checks
+PROVIDER_BATCH_WATCH = 2 * 3600    # how long the background watcher keeps polling
+
+def provider_batch_chunks(provider, batch_requests):
+    """Split [(custom_id, payload)] into lists that fit one provider batch."""
+    max_n, max_bytes = PROVIDER_BATCH_LIMITS[provider]
+    chunk, size = [], 0
+    for custom_id, payload in batch_requests:
+        n = len(json.dumps(payload)) + 256   # + per-line envelope
+        if chunk and (len(chunk) >= max_n or size + n > max_bytes):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append((custom_id, payload))
+        size += n
+    if chunk: yield chunk
+
+def provider_batch_submit(provider, api_key, model_id, batch_requests, label="", base=None):
+    """Submit [(custom_id, payload)] as one provider batch. Returns (batch_id, err)."""
+    base, headers = base or _llm_base(provider), _llm_headers(provider, api_key)
+    try:
+        if provider == "claude":
+            res = http_post(f"{base}/v1/messages/batches", headers=headers, timeout=300,
+                            json={"requests": [{"custom_id": c, "params": p} for c, p in batch_requests]})
+            if res.status_code != 200: return None, _llm_error(provider, model_id, res)
+            return res.json()["id"], None
+        if provider == "openai":
+            lines = "".join(json.dumps({"custom_id": c, "method": "POST", "url": "/v1/chat/completions", "body": p}) + "\n"
+                            for c, p in batch_requests)
+            res = http_post(f"{base}/v1/files", headers={"Authorization": headers["Authorization"]}, timeout=300,
+                            files={"file": ("batch.jsonl", lines.encode(), "application/jsonl")}, data={"purpose": "batch"})
+            if res.status_code != 200: return None, _llm_error(provider, model_id, res)
+            res = http_post(f"{base}/v1/batches", headers=headers, timeout=60,
+                            json={"input_file_id": res.json()["id"], "endpoint": "/v1/chat/completions",
+                                  "completion_window": "24h", "metadata": {"description": label[:500]}})
+            if res.status_code != 200: return None, _llm_error(provider, model_id, res)
+            return res.json()["id"], None
+        body = {"batch": {"display_name": label, "input_config": {"requests": {"requests": [
+            {"request": p, "metadata": {"key": c}} for c, p in batch_requests]}}}}
+        res = http_post(f"{base}/v1beta/{model_id}:batchGenerateContent?key={clean_key(api_key)}",
+                        headers=headers, timeout=300, json=body)
+        if res.status_code != 200: return None, _llm_error(provider, model_id, res)
+        return res.json()["name"], None
+    except (requests.RequestException, ValueError, KeyError) as e:
+        return None, f"{provider} batch submit: {e}"
+
+def _provider_batch_answer(provider, body):
+    """llm_call-style fields from one answer body in a batch's results."""
+    out = _llm_out()
+    _llm_absorb(provider, out, {**body, "type": "message"} if provider == "claude" else body)
+    return {"text": "".join(out["chunks"]), "finish_reason": out["finish_reason"],
+            "truncated": out["finish_reason"] in LLM_TRUNCATED_REASONS, "input_tokens": out["input_tokens"],
+            "output_tokens": out["output_tokens"], "cache_read_tokens": out["cache_read_tokens"],
+            "cache_write_tokens": out["cache_write_tokens"]}
+
+def _provider_batch_reject(answer, schema="product_content"):
+    """Why a batch answer must not be used (cut off, or not matching the schema) — None when it is fine.
+    The live path gets the same checks from llm_call / llm_generate."""
+    if answer["truncated"]:
+        return f"Batch answer was cut off ({answer['finish_reason']}) — resume to regenerate"
+    errors = json_schema_errors(parse_json_response(answer["text"]), LLM_SCHEMAS[schema])
+    if errors:
+        return f"Batch answer does not match the {schema} schema — {'; '.join(errors[:3])}"
+    return None
+
+def _jsonl_rows(text):
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def provider_batch_fetch(provider, api_key, batch_id, base=None):
+    """Check a submitted batch once. Returns (results, err):
+    (None, None) still running · (None, err) status check failed, try again later ·
+    ({custom_id: (answer, item_err)}, err) finished — err set when the batch as a whole failed,
+    expired or was cancelled (its missing items share that error)."""
+    base, headers = base or _llm_base(provider), _llm_headers(provider, api_key)
+    results = {}
+    try:
+        if provider == "claude":
+            res = http_get(f"{base}/v1/messages/batches/{batch_id}", headers=headers, timeout=60)
+            if res.status_code != 200: return None, _llm_error(provider, batch_id, res)
+            info = res.json()
+            if info.get("processing_status") != "ended": return None, None
+            res = http_get(info.get("results_url") or f"{base}/v1/messages/batches/{batch_id}/results", headers=headers, timeout=300)
+            if res.status_code != 200: return None, _llm_error(provider, batch_id, res)
+            for row in _jsonl_rows(res.text):
+                result = row.get("result") or {}
+                if result.get("type") == "succeeded":
+                    results[row["custom_id"]] = (_provider_batch_answer(provider, result["message"]), None)
+                else:
+                    results[row["custom_id"]] = (None, f"{result.get('type', 'errored')}: {json.dumps(result.get('error'))[:300]}")
+            return results, None
+        if provider == "openai":
+            res = http_get(f"{base}/v1/batches/{batch_id}", headers=headers, timeout=60)
+            if res.status_code != 200: return None, _llm_error(provider, batch_id, res)
+            info = res.json()
+            status = info.get("status")
+            if status in ("validating", "in_progress", "finalizing", "cancelling"): return None, None
+            for file_id in (info.get("output_file_id"), info.get("error_file_id")):
+                if not file_id: continue
+                res = http_get(f"{base}/v1/files/{file_id}/content", headers=headers, timeout=300)
+                if res.status_code != 200: return None, _llm_error(provider, batch_id, res)
+                for row in _jsonl_rows(res.text):
+                    response = row.get("response") or {}
+                    if response.get("status_code") == 200:
+                        results[row["custom_id"]] = (_provider_batch_answer(provider, response.get("body") or {}), None)
+                    else:
+                        results[row["custom_id"]] = (None, json.dumps(row.get("error") or response.get("body"))[:300])
+            if status == "completed": return results, None
+            errors = (info.get("errors") or {}).get("data") or [{}]
+            return results, f"batch {status}: {errors[0].get('message', '')}".strip()
+        res = http_get(f"{base}/v1beta/{batch_id}?key={clean_key(api_key)}", headers=headers, timeout=60)
+        if res.status_code != 200: return None, _llm_error(provider, batch_id, res)
+        op = res.json()
+        meta = op.get("metadata") or {}
+        state = meta.get("state") or op.get("state") or ""
+        if not op.get("done") and not state.endswith(("SUCCEEDED", "FAILED", "CANCELLED", "EXPIRED")): return None, None
+        # the finished operation carries the answers in response (older payloads: metadata.output)
+        inlined = (op.get("response") or {}).get("inlinedResponses") or (meta.get("output") or {}).get("inlinedResponses") or {}
+        for row in inlined.get("inlinedResponses", []) if isinstance(inlined, dict) else inlined:
+            key = (row.get("metadata") or {}).get("key")
+            if row.get("response"): results[key] = (_provider_batch_answer(provider, row["response"]), None)
+            else: results[key] = (None, json.dumps(row.get("error"))[:300])
+        if state.endswith("SUCCEEDED") or (op.get("done") and not state and not op.get("error")): return results, None
+        return results, f"batch {state or 'failed'}: {(op.get('error') or {}).get('message', '')}".strip()
+    except (requests.RequestException, ValueError, KeyError) as e:
+        return None, f"{provider} batch status: {e}"
+
+@st.cache_resource(show_spinner=False)
+def _batch_offline_lock():
+    """Serializes ingests, so the watcher and a "Check status" click never ingest a batch twice."""
+    return threading.Lock()
+
+def batch_offline_submit(job_id, items, gemini_key, claude_key, openai_key, batch_model, catalog=None, catalog_text=None,
+                         base=None):
+    """Build the writer request for every (prod, opening_angle) in items and submit them as provider
+    batches (to base, default _llm_base). Submitted items go to "generating"; a chunk the provider
+    refuses is marked failed (Resume retries those live). Returns (requests submitted, error of the
+    last refused chunk)."""
+    provider, api_key, model_id = llm_route(gemini_key, claude_key, openai_key, batch_model)
+    batch_requests = []
+    for prod, angle in items:
+        raw_input = batch_product_input(prod)
+        text = catalog_text if catalog_text is not None else batch_product_catalog_text(catalog, raw_input)
+        prompt = product_writer_prompt(raw_input, product_handle=prod.get("handle", ""), opening_angle=angle)
+        _, _, payload = _llm_request(provider, api_key, model_id, prompt, temperature=0.7, max_tokens=8192,
+                                     prefix=writer_prompt_prefix(text), schema="product_content")
+        batch_requests.append((str(prod["id"]), payload))
+    base = base or _llm_base(provider)
+    batches, sent, err = batch_job_get(job_id)["provider_batches"], 0, None
+    chunks = list(provider_batch_chunks(provider, batch_requests))
+    for n, chunk in enumerate(chunks):
+        ids = [c for c, _ in chunk]
+        batch_id, chunk_err = provider_batch_submit(provider, api_key, model_id, chunk, f"{job_id} {n + 1}/{len(chunks)}", base)
+        for pid in ids:
+            batch_job_mark(job_id, pid, "generating" if batch_id else "failed", error=chunk_err)
+        if not batch_id:
+            err = chunk_err
+            continue
+        batches.append({"provider": provider, "model": model_id, "id": batch_id, "base": base, "ids": ids,
+                        "submitted": time.time(), "done": False})
+        batch_job_set_provider_batches(job_id, batches)
+        sent += len(ids)
+    return sent, err
+
+def batch_offline_poll(job_id, gemini_key, claude_key, openai_key, shop_url="", access_token="", max_workers=4):
+    """Check a job's pending provider batches once and ingest the finished ones: usage is recorded
+    at the batch rate, each answer is parsed and journaled, and pushed when the job auto-updates.
+    Returns ({product_id: batch_results entry}, batches still pending, [status errors])."""
+    keys = {"claude": claude_key, "openai": openai_key, "gemini": gemini_key}
+    entries, errors = {}, []
+    with _batch_offline_lock():
+        job = batch_job_get(job_id)
+        batches, auto_update = job["provider_batches"], bool(job["auto_update"])
+        products = {str(r["product_id"]): r["product"] for r in batch_job_items(job_id)}
+        for batch in batches:
+            if batch["done"]: continue
+            results, err = provider_batch_fetch(batch["provider"], keys[batch["provider"]], batch["id"], batch.get("base"))
+            if results is None:
+                if err: errors.append(err)
+                continue
+            finished = []
+            with llm_run(job_id):
+                for pid in batch["ids"]:
+                    answer, item_err = results.get(pid, (None, err or "No result in the provider batch"))
+                    if answer:
+                        # Rejected answers are journaled as failed, so Resume regenerates them live
+                        item_err = _provider_batch_reject(answer) or item_err
+                        llm_usage_record(batch["provider"], batch["model"], "product_content_batch", 0,
+                                         answer["input_tokens"], answer["output_tokens"],
+                                         cache_read_tokens=answer["cache_read_tokens"],
+                                         cache_write_tokens=answer["cache_write_tokens"], ok=item_err is None, batch=True)
+                        if item_err: answer = None
+                    else:
+                        llm_usage_record(batch["provider"], batch["model"], "product_content_batch", ok=False, batch=True)
+                    if pid in products:
+                        finished.append((products[pid], answer["text"] if answer else None, item_err))
+
+            def _ingest(item):
+                prod, text, item_err = item
+                return batch_finish_one(prod, text, item_err, auto_update, shop_url, access_token, job_id)
+            for (prod, _, _), entry, exc in run_concurrent_batch(finished, _ingest, "shopify", max_workers=max_workers):
+                if not entry:
+                    batch_job_mark(job_id, prod["id"], "failed", error=exc)
+                    entry = {"error": exc, "job_id": job_id}
+                entries[prod["id"]] = entry
+            batch["done"] = True
+            batch_job_set_provider_batches(job_id, batches)
+    return entries, sum(1 for b in batches if not b["done"]), errors
+
+# ============================================================
+# --- BACKGROUND JOB RUNNER ---
+# ============================================================
+# Long loops (Batch Writer, Retouch, Bulk SEO, audit fix queue) can run on a process-wide
+# worker pool instead of inside the Streamlit script run: the page stays usable, other tabs
+# keep working, and closing the browser tab doesn't stop the job. Jobs report progress into
+# a shared dict that the sidebar panel polls; results are picked up by the tab on the next
+# rerun. Job functions run without a script context — they must not touch st.*.
+BACKGROUND_JOB_WORKERS = 3    # jobs running at the same time (each fans out on its own pool)
+BACKGROUND_JOB_KEEP = 30      # finished jobs kept for the status panel
+BACKGROUND_JOB_LOG_LINES = 30
+
+@st.cache_resource(show_spinner=False)
+def _job_runner():
+    return {"jobs": OrderedDict(), "lock": threading.Lock(),
+            "pool": ThreadPoolExecutor(max_workers=BACKGROUND_JOB_WORKERS, thread_name_prefix="bg-job")}
+
+def submit_background_job(kind, label, total, fn, *args, ref=None, **kwargs):
+    """Queue fn(job, *args, **kwargs) on the runner. Returns the job id.
+    fn reports with job_progress()/job_result() and should stop early once job["cancel"] is set.
+    ref names what the job works on (e.g. a Batch Writer journal id) so any session can see it is busy."""
+    runner = _job_runner()
+    job_id = f"{kind}-{time.strftime('%H%M%S')}-{hashlib.sha1(os.urandom(8)).hexdigest()[:4]}"
+    job = {"id": job_id, "kind": kind, "ref": ref, "label": label, "total": total, "done": 0, "status": "queued",
+           "message": "", "log": [], "results": {}, "error": None, "created": time.time(),
+           "started": None, "finished": None, "cancel": threading.Event()}
+    cache_on, db_path = _llm_cache_enabled(), _db_path()
+    ctx = contextvars.copy_context()   # run id etc. set by the caller
+
+    def _run():
+        _LLM_CACHE_ON.set(cache_on)   # carry the session's cache switch and store path into the job
+        _DB_PATH.set(db_path)
+        if _LLM_RUN_ID.get() is None: _LLM_RUN_ID.set(job_id)   # usage ledger groups the job's calls
+        with runner["lock"]:
+            job["status"], job["started"] = "running", time.time()
+        try:
+            fn(job, *args, **kwargs)
+            status, error = ("cancelled" if job["cancel"].is_set() else "done"), None
+        except Exception as e:
+            status, error = "failed", str(e)
+        with runner["lock"]:
+            job["status"], job["error"], job["finished"] = status, error, time.time()
+
+    with runner["lock"]:
+        runner["jobs"][job_id] = job
+        finished = [j for j in runner["jobs"].values() if j["finished"]]
+        for old in finished[:max(0, len(finished) - BACKGROUND_JOB_KEEP)]:
+            runner["jobs"].pop(old["id"], None)
+    runner["pool"].submit(ctx.run, _run)
+    return job_id
+
+def job_progress(job, done=None, message=None, log=None):
+    with _job_runner()["lock"]:
+        if done is not None: job["done"] = done
+        if message is not None: job["message"] = message
+        if log is not None: job["log"] = list(log)[-BACKGROUND_JOB_LOG_LINES:]
+
+def job_result(job, key, value, message=None):
+    """Store one item's result and count it as done."""
+    with _job_runner()["lock"]:
+        job["results"][key] = value
+        job["done"] = len(job["results"])
+        if message is not None: job["message"] = message
+
+_JOB_SKIPPED = object()
+
+def job_run_concurrent(job, items, worker, provider, max_workers, key, warmup=0):
+    """run_concurrent_batch inside a background job: stores (result, error) per item under key(item).
+    Once the job is cancelled, items that have not started yet are skipped and left out of results."""
+    def _guarded(item):
+        if job["cancel"].is_set(): return _JOB_SKIPPED
+        return worker(item)
+    for item, result, err in run_concurrent_batch(items, _guarded, provider, max_workers=max_workers, warmup=warmup):
+        if result is not _JOB_SKIPPED:
+            job_result(job, key(item), (result, err))
+
+def background_job(job_id):
+    """Snapshot of one job (safe to read while it runs), or None once it has been pruned."""
+    runner = _job_runner()
+    with runner["lock"]:
+        job = runner["jobs"].get(job_id)
+        return {**job, "results": dict(job["results"]), "log": list(job["log"])} if job else None
+
+def background_jobs():
+    """Snapshots of all known jobs, newest first."""
+    runner = _job_runner()
+    with runner["lock"]:
+        ids = list(runner["jobs"].keys())
+    return [j for j in (background_job(i) for i in reversed(ids)) if j]
+
+def background_job_refs(kind):
+    """refs of this kind's jobs that are queued or running on the runner — from any session."""
+    return {j["ref"] for j in background_jobs() if j["kind"] == kind and j["ref"] and j["status"] in ("queued", "running")}
+
+def cancel_background_job(job_id):
+    runner = _job_runner()
+    with runner["lock"]:
+        job = runner["jobs"].get(job_id)
+        if job and not job["finished"]: job["cancel"].set()
+
+def track_background_job(job_id):
+    """Remember a job this session started, so the panel reruns the page when it finishes."""
+    st.session_state.setdefault("_bg_jobs_seen", {})[job_id] = "queued"
+
+@st.fragment(run_every=3)
+def background_jobs_panel():
+    """Sidebar status panel — refreshes itself every few seconds without rerunning the page."""
+    jobs = background_jobs()
+    seen = st.session_state.setdefault("_bg_jobs_seen", {})
+    if not jobs:
+        st.caption("No background jobs.")
+    icons = {"queued": "🕓", "running": "⏳", "done": "✅", "failed": "❌", "cancelled": "⏹️"}
+    for job in jobs[:8]:
+        total = max(job["total"] or 0, 1)
+        st.write(f"{icons.get(job['status'], '•')} **{job['label']}**")
+        if job["status"] in ("queued", "running"):
+            st.progress(min(job["done"] / total, 1.0), text=f"{job['done']}/{job['total']} {job['message']}"[:80])
+            if st.button("⏹️ Cancel", key=f"bg_cancel_{job['id']}"):
+                cancel_background_job(job["id"])
+        else:
+            took = (job["finished"] or 0) - (job["started"] or job["finished"] or 0)
+            st.caption(f"{job['done']}/{job['total']} · {took:.0f}s" + (f" · {job['error']}" if job["error"] else ""))
+    # One of this session's jobs just finished → rerun the whole page so its tab shows the results
+    changed = False
+    for job in jobs:
+        if job["id"] in seen and seen[job["id"]] != job["status"] and job["status"] not in ("queued", "running"):
+            seen[job["id"]] = job["status"]
+            changed = True
+    if changed: st.rerun()
+
 # ============================================================
 # --- UI LOGIC ---
 # ============================================================
@@ -2987,6 +5127,7 @@ if "gen_tags_result" not in st.session_state: st.session_state.gen_tags_result =
 if "bulk_results" not in st.session_state: st.session_state.bulk_results = None
 if "writer_result" not in st.session_state: st.session_state.writer_result = None
 if "retouch_results" not in st.session_state: st.session_state.retouch_results = None
+if "retouch_errors" not in st.session_state: st.session_state.retouch_errors = {}
 if "seo_name_result" not in st.session_state: st.session_state.seo_name_result = None
 if "bulk_key_counter" not in st.session_state: st.session_state.bulk_key_counter = 0
 if "writer_key_counter" not in st.session_state: st.session_state.writer_key_counter = 0
@@ -2994,6 +5135,8 @@ if "retouch_key_counter" not in st.session_state: st.session_state.retouch_key_c
 if "batch_products" not in st.session_state: st.session_state.batch_products = []
 if "batch_collections" not in st.session_state: st.session_state.batch_collections = []
 if "batch_results" not in st.session_state: st.session_state.batch_results = {}
+if "batch_selected" not in st.session_state: st.session_state.batch_selected = set()
+if "batch_grid_counter" not in st.session_state: st.session_state.batch_grid_counter = 0
 if "batch_running" not in st.session_state: st.session_state.batch_running = False
 if "colwriter_result" not in st.session_state: st.session_state.colwriter_result = None
 if "colwriter_collections" not in st.session_state: st.session_state.colwriter_collections = []
@@ -3072,6 +5215,17 @@ with st.sidebar:
     st.divider()
     if "JSONBIN_API_KEY" in st.secrets: st.caption("✅ Database Connected")
     else: st.warning("⚠️ Local Mode")
+    st.checkbox("♻️ Reuse cached AI responses", value=True, key="llm_cache_on",
+                help="Identical requests (same model, prompt, images and settings) return the stored answer "
+                     "instead of calling the API again. Untick to get a fresh sample.")
+    cache_n, cache_bytes, cache_hits = llm_cache_stats()
+    st.caption(f"💾 AI cache: {cache_n} responses · {cache_bytes / 1024 / 1024:.1f} MB · {cache_hits} hits")
+    if cache_n and st.button("🗑️ Clear AI cache", key="llm_cache_clear_btn"):
+        llm_cache_clear()
+        st.rerun()
+    st.divider()
+    st.caption("🧵 **Background jobs**")
+    background_jobs_panel()
     st.divider()
     st.caption(f"**Active Text Model:** {selected_text_model}")
     st.caption(f"**Active Image Model:** Gemini")
@@ -3311,6 +5465,25 @@ with tab_retouch:
     st.header("🎨 Retouch (via Gemini)")
     if "shopify_fetched_imgs" not in st.session_state: st.session_state.shopify_fetched_imgs = []
     rt_key_id = st.session_state.retouch_key_counter
+    # Background run: fold finished tiles into the results; the rest show as still processing
+    rt_pending = set()
+    rt_bg = st.session_state.get("retouch_bg_job")
+    if rt_bg:
+        bg = background_job(rt_bg["id"])
+        rt_res = st.session_state.retouch_results or []
+        for i, (res, exc) in (bg["results"] if bg else {}).items():
+            if i >= len(rt_res): continue
+            gen_img_bytes, err = res if res else (None, exc)
+            rt_res[i] = gen_img_bytes
+            if gen_img_bytes: st.session_state.retouch_errors.pop(i, None)
+            else: st.session_state.retouch_errors[i] = err
+        rt_pending = {i for i in rt_bg["idx"] if i < len(rt_res) and not rt_res[i] and i not in st.session_state.retouch_errors}
+        if not bg or bg["finished"]:
+            for i in rt_pending: st.session_state.retouch_errors[i] = "cancelled"
+            rt_pending = set()
+            st.session_state.retouch_bg_job = None
+        else:
+            st.info(f"🧵 Retouching in the background — {bg['done']}/{bg['total']} done.")
     rt_c1, rt_c2 = st.columns([1, 1.2])
     
     with rt_c1:
@@ -3428,27 +5601,68 @@ with tab_retouch:
             # Editable text area - value comes from session state key automatically
             rt_prompt_edit = st.text_area("✏️ Custom Instruction (edit if needed)", height=100, key=rt_prompt_widget_key)
             
-            c_rt1, c_rt2 = st.columns([1, 1])
+            rt_prev = st.session_state.retouch_results
+            rt_failed = [i for i, r in enumerate(rt_prev) if not r] if rt_prev and len(rt_prev) == len(rt_imgs) else []
+            c_rt1, c_rt2, c_rt3 = st.columns([1, 1, 1])
             run_retouch = c_rt1.button("🚀 Run Batch", type="primary", disabled=(not rt_imgs), key=f"rt_run_btn_{rt_key_id}")
-            clear_retouch = c_rt2.button("🔄 Start Over", key=f"rt_startover_btn_{rt_key_id}")
+            retry_retouch = c_rt2.button(f"🔁 Retry failed ({len(rt_failed)})", disabled=not rt_failed, key=f"rt_retry_btn_{rt_key_id}")
+            clear_retouch = c_rt3.button("🔄 Start Over", key=f"rt_startover_btn_{rt_key_id}")
+            rt_background = st.checkbox("🧵 Run in background", value=False, key="rt_background",
+                                        help="Keep retouching on the server while you use other tabs; finished images appear here.")
             if clear_retouch:
-                st.session_state.retouch_results = None; st.session_state.seo_name_result = None
+                if rt_bg: cancel_background_job(rt_bg["id"]); st.session_state.retouch_bg_job = None
+                st.session_state.retouch_results = None; st.session_state.seo_name_result = None; st.session_state.retouch_errors = {}
                 st.session_state.shopify_fetched_imgs = []; st.session_state.retouch_key_counter += 1
                 if 'rt_upload_id' in st.session_state: del st.session_state['rt_upload_id']
                 st.rerun()
-            if run_retouch:
+            if (run_retouch or retry_retouch) and rt_pending:
+                st.warning("A background retouch is still running — wait for it or Start Over.")
+            elif run_retouch or retry_retouch:
                 if not gemini_key: st.error("Missing Gemini API Key!")
+                elif rt_background:
+                    rt_run_idx = list(range(len(rt_imgs))) if run_retouch else rt_failed
+                    if run_retouch:
+                        st.session_state.retouch_results = [None] * len(rt_imgs)
+                    for i in rt_run_idx: st.session_state.retouch_errors.pop(i, None)
+                    rt_job_imgs, rt_job_prompt = list(rt_imgs), rt_prompt_edit
+                    bg_id = submit_background_job(
+                        "retouch", f"Retouch · {len(rt_run_idx)} images", len(rt_run_idx),
+                        lambda job: job_run_concurrent(job, rt_run_idx, lambda i: retouch_image(gemini_key, rt_job_imgs[i], rt_job_prompt),
+                                                       "gemini_image", PROVIDER_CONCURRENCY["gemini_image"], key=lambda i: i))
+                    track_background_job(bg_id)
+                    st.session_state.retouch_bg_job = {"id": bg_id, "idx": rt_run_idx}
+                    st.rerun()
                 else:
-                    rt_temp_results = []
-                    rt_pbar = st.progress(0)
-                    for i, img in enumerate(rt_imgs):
-                        with st.spinner(f"Processing #{i+1}..."):
-                            gen_img_bytes, err = generate_image(gemini_key, [img], rt_prompt_edit)
-                            rt_pbar.progress((i+1)/len(rt_imgs))
-                            rt_temp_results.append(gen_img_bytes if gen_img_bytes else None)
-                            if err: st.error(f"Failed #{i+1}: {err}")
-                    st.session_state.retouch_results = rt_temp_results
-                    st.success("Batch Complete!"); st.rerun()
+                    # All images run at once (within the Gemini image cap); each tile fills in as it
+                    # finishes and is saved to session_state immediately, so a failure elsewhere
+                    # never loses the images that already came back.
+                    rt_run_idx = list(range(len(rt_imgs))) if run_retouch else rt_failed
+                    if run_retouch:
+                        st.session_state.retouch_results = [None] * len(rt_imgs)
+                        st.session_state.retouch_errors = {}
+                    rt_pbar = st.progress(0, text=f"Retouching {len(rt_run_idx)} images...")
+                    rt_tile_cols = st.columns(3)
+                    rt_tiles = {i: rt_tile_cols[pos % 3].empty() for pos, i in enumerate(rt_run_idx)}
+                    for i in rt_run_idx: rt_tiles[i].info(f"#{i+1} ⏳ processing...")
+                    rt_done = 0
+                    with llm_run(f"retouch-{time.strftime('%Y%m%d-%H%M%S')}"):
+                        for i, res, exc in run_concurrent_batch(
+                                rt_run_idx, lambda i: retouch_image(gemini_key, rt_imgs[i], rt_prompt_edit),
+                                "gemini_image", max_workers=PROVIDER_CONCURRENCY["gemini_image"]):
+                            gen_img_bytes, err = res if res else (None, exc)
+                            st.session_state.retouch_results[i] = gen_img_bytes
+                            if gen_img_bytes:
+                                st.session_state.retouch_errors.pop(i, None)
+                                rt_tiles[i].image(gen_img_bytes, caption=f"#{i+1}", width="stretch")
+                            else:
+                                st.session_state.retouch_errors[i] = err
+                                rt_tiles[i].error(f"#{i+1} failed: {err}")
+                            rt_done += 1
+                            rt_pbar.progress(rt_done / len(rt_run_idx), text=f"Retouched {rt_done}/{len(rt_run_idx)}")
+                    rt_failed_now = len(st.session_state.retouch_errors)
+                    if rt_failed_now: st.warning(f"Batch finished — {rt_failed_now} image(s) failed, use 🔁 Retry failed.")
+                    else: st.success("Batch Complete!")
+                    st.rerun()
 
     if st.session_state.retouch_results:
         st.divider(); st.subheader("🎨 Retouched Results")
@@ -3464,7 +5678,8 @@ with tab_retouch:
             with cols[i%3]:
                 st.write(f"**#{i+1}**")
                 if res_bytes: st.image(res_bytes, width="stretch")
-                else: st.error("Failed")
+                elif i in rt_pending: st.info("⏳ processing...")
+                else: st.error(f"Failed: {st.session_state.retouch_errors.get(i, 'unknown error')}")
         st.markdown("---"); st.subheader("🚀 Upload to Shopify")
         with st.container(border=True):
             rt_shop = st.secrets.get("SHOPIFY_SHOP_URL", "")
@@ -3529,11 +5744,34 @@ with tab2:
         if bimgs: st.success(f"{len(bimgs)} images")
     with bc2:
         burl = st.text_input("Product URL:", key=f"bulk_url_{bulk_key_id}")
-        c_btn1, c_btn2 = st.columns([1, 1])
+        bulk_provider = provider_for_model(current_text_model, claude_key, openai_key)
+        bulk_cap = PROVIDER_CONCURRENCY.get(bulk_provider, 4)
+        c_par1, c_par2 = st.columns([1, 1])
+        bulk_workers = c_par1.slider("⚡ Parallel images", 1, max(2, bulk_cap), bulk_cap, key=f"bulk_workers_{bulk_provider}",
+                                     help=f"Capped at {bulk_cap} in-flight calls for {bulk_provider} across all tabs.")
+        bulk_retries = c_par2.number_input("🔁 Retries per image", 0, 5, BULK_SEO_RETRIES, key="bulk_retries")
+        bulk_background = st.checkbox("🧵 Run in background", value=False, key="bulk_background",
+                                      help="Keep tagging on the server while you use other tabs; results fill in here as they finish.")
+        # Background run: fold finished images into the results (the rest stay "not processed yet")
+        bulk_bg = st.session_state.get("bulk_bg_job")
+        if bulk_bg:
+            bg = background_job(bulk_bg)
+            for i, (res, exc) in (bg["results"] if bg else {}).items():
+                if st.session_state.bulk_results and i < len(st.session_state.bulk_results):
+                    st.session_state.bulk_results[i] = res if res else {"error": exc}
+            if not bg or bg["finished"]: st.session_state.bulk_bg_job = bulk_bg = None
+            else: st.info(f"🧵 Tagging in the background — {bg['done']}/{bg['total']} done.")
+        bulk_prev = st.session_state.bulk_results
+        bulk_failed = [i for i, r in enumerate(bulk_prev) if not r or "error" in r] if bulk_prev and len(bulk_prev) == len(bimgs) else []
+        c_btn1, c_btn2, c_btn3 = st.columns([1, 1, 1])
         run_batch = c_btn1.button("🚀 Run Batch", type="primary", disabled=(not bimgs), key=f"bulk_run_btn_{bulk_key_id}")
-        if c_btn2.button("🔄 Start Over", key=f"bulk_startover_btn_{bulk_key_id}"):
+        retry_batch = c_btn2.button(f"🔁 Retry failed ({len(bulk_failed)})", disabled=not bulk_failed, key=f"bulk_retry_btn_{bulk_key_id}")
+        if c_btn3.button("🔄 Start Over", key=f"bulk_startover_btn_{bulk_key_id}"):
+            if bulk_bg: cancel_background_job(bulk_bg); st.session_state.bulk_bg_job = None
             st.session_state.bulk_results = None; st.session_state.bulk_key_counter += 1; st.rerun()
-        if run_batch:
+        if (run_batch or retry_batch) and bulk_bg:
+            st.warning("A background run is still going — wait for it or Start Over.")
+        elif run_batch or retry_batch:
             # Check API key based on selected model
             missing_key = False
             if current_text_model == "Gemini" and not gemini_key: missing_key = True
@@ -3543,17 +5781,33 @@ with tab2:
             if missing_key: st.error("Missing API Key")
             elif not burl: st.error("Missing URL")
             else:
-                pbar = st.progress(0); temp_results = []
-                for i, img in enumerate(bimgs):
-                    with st.spinner(f"Processing #{i+1}..."):
-                        txt, err = generate_seo_for_existing_image(gemini_key, claude_key, openai_key, current_text_model, img, burl)
-                        pbar.progress((i+1)/len(bimgs))
-                        if txt:
-                            d = parse_json_response(txt)
-                            if isinstance(d, list) and d: d = d[0]
-                            temp_results.append(d if isinstance(d, dict) else {"error": "Invalid format", "raw": txt})
-                        else: temp_results.append({"error": err})
-                st.session_state.bulk_results = temp_results; st.success("Done!"); st.rerun()
+                # Each image is written to bulk_results the moment it finishes — a slow image no
+                # longer holds up the rest, and a crash keeps everything already done.
+                run_idx = list(range(len(bimgs))) if run_batch else bulk_failed
+                if run_batch: st.session_state.bulk_results = [None] * len(bimgs)
+                if bulk_background:
+                    for i in run_idx: st.session_state.bulk_results[i] = None
+                    job_imgs, job_model, job_retries = list(bimgs), current_text_model, int(bulk_retries)
+                    bg_id = submit_background_job(
+                        "bulk_seo", f"Bulk SEO · {len(run_idx)} images", len(run_idx),
+                        lambda job: job_run_concurrent(job, run_idx, lambda i: bulk_seo_one(gemini_key, claude_key, openai_key, job_model, job_imgs[i], burl, retries=job_retries),
+                                                       bulk_provider, bulk_workers, key=lambda i: i))
+                    track_background_job(bg_id)
+                    st.session_state.bulk_bg_job = bg_id
+                    st.rerun()
+                pbar = st.progress(0, text=f"Processing {len(run_idx)} images...")
+                done = 0
+                with llm_run(f"bulk_seo-{time.strftime('%Y%m%d-%H%M%S')}"):
+                    for i, res, exc in run_concurrent_batch(
+                            run_idx, lambda i: bulk_seo_one(gemini_key, claude_key, openai_key, current_text_model, bimgs[i], burl, retries=int(bulk_retries)),
+                            bulk_provider, max_workers=bulk_workers):
+                        st.session_state.bulk_results[i] = res if res else {"error": exc}
+                        done += 1
+                        pbar.progress(done / len(run_idx), text=f"Processed {done}/{len(run_idx)}")
+                n_err = sum(1 for r in st.session_state.bulk_results if not r or "error" in r)
+                if n_err: st.warning(f"Done — {n_err} image(s) failed, use 🔁 Retry failed.")
+                else: st.success("Done!")
+                st.rerun()
     if st.session_state.bulk_results and bimgs:
         st.divider()
         for i, res in enumerate(st.session_state.bulk_results):
@@ -3561,7 +5815,8 @@ with tab2:
                 rc1, rc2 = st.columns([1, 3])
                 with rc1: st.image(bimgs[i], width=150)
                 with rc2:
-                    if "error" in res: st.error(res.get('error')); st.code(res.get('raw', '')) if 'raw' in res else None
+                    if res is None: st.info("⏳ Not processed yet")
+                    elif "error" in res: st.error(res.get('error')); st.code(res.get('raw', '')) if 'raw' in res else None
                     else: st.write("**File Name:**"); st.code(res.get('file_name', '')); st.write("**Alt Tag:**"); st.code(res.get('alt_tag', ''))
                 st.divider()
 
@@ -3599,7 +5854,8 @@ with tab3:
                             else:
                                 sh_writer_id = sh_writer_input
                             
-                            imgs, _ = get_shopify_product_images(sh_secret_shop, sh_secret_token, sh_writer_id)
+                            # Writer only feeds images to the AI (encoded at ≤1024px) — the CDN variant is plenty
+                            imgs, _ = get_shopify_product_images(sh_secret_shop, sh_secret_token, sh_writer_id, max_side=1024)
                             desc_html, prod_title, prod_handle, _ = get_shopify_product_details(sh_secret_shop, sh_secret_token, sh_writer_id)
                             if imgs: st.session_state.writer_shopify_imgs = imgs
                             if desc_html: st.session_state[text_area_key] = remove_html_tags(desc_html)
@@ -3641,6 +5897,9 @@ with tab3:
         gen_mode = st.radio("Generation Mode:", 
             ["📝 Content + Image SEO", "📝 Content Only", "🖼️ Image SEO Only", "🔗 URL Slug Only"],
             key=f"writer_gen_mode_{writer_key_id}", horizontal=True)
+        img_seo_parallel = st.checkbox("⚡ Image SEO: all images at once", value=True, key="writer_img_seo_parallel",
+                                       help="Generate every image's file name + alt tag in parallel, then make them unique locally. "
+                                            "Untick for the slower one-by-one mode where each image sees the names already used.")
         wb1, wb2 = st.columns([1, 1])
         run_write = wb1.button("🚀 Generate", type="primary", key=f"writer_run_btn_{writer_key_id}")
         if wb2.button("🔄 Start Over", key=f"writer_startover_btn_{writer_key_id}"):
@@ -3680,42 +5939,11 @@ with tab3:
                     with st.spinner(f"Generating Image SEO with {current_text_model}..."):
                         product_name = raw[:100] if raw else "Product"
                         desc_snippet = raw[:300] if raw else ""
-                        image_seo_results = []
-                        prev_fnames = []
-                        prev_alts = []
                         progress_bar = st.progress(0, text="🖼️ Generating Image SEO...")
-                        for idx, img in enumerate(writer_imgs):
-                            progress_bar.progress((idx + 1) / len(writer_imgs), text=f"🖼️ Image SEO {idx+1}/{len(writer_imgs)}...")
-                            try:
-                                img_json, img_err = generate_image_seo_per_image(
-                                    gemini_key, claude_key, openai_key, current_text_model,
-                                    img, idx + 1, len(writer_imgs), product_name, desc_snippet,
-                                    previous_filenames=prev_fnames if prev_fnames else None,
-                                    previous_alts=prev_alts if prev_alts else None
-                                )
-                                if img_json:
-                                    img_d = parse_json_response(img_json)
-                                    if isinstance(img_d, list) and img_d: img_d = img_d[0]
-                                    if isinstance(img_d, dict):
-                                        image_seo_results.append(img_d)
-                                        prev_fnames.append(img_d.get("file_name", ""))
-                                        prev_alts.append(img_d.get("alt_tag", ""))
-                                    else:
-                                        fallback = {"file_name": f"product-image-{idx+1}.jpg", "alt_tag": f"Product image {idx+1}"}
-                                        image_seo_results.append(fallback)
-                                        prev_fnames.append(fallback["file_name"])
-                                        prev_alts.append(fallback["alt_tag"])
-                                else:
-                                    fallback = {"file_name": f"product-image-{idx+1}.jpg", "alt_tag": f"Product image {idx+1}"}
-                                    image_seo_results.append(fallback)
-                                    prev_fnames.append(fallback["file_name"])
-                                    prev_alts.append(fallback["alt_tag"])
-                            except Exception as img_e:
-                                fallback = {"file_name": f"product-image-{idx+1}.jpg", "alt_tag": f"Product image {idx+1}"}
-                                image_seo_results.append(fallback)
-                                prev_fnames.append(fallback["file_name"])
-                                prev_alts.append(fallback["alt_tag"])
-                            time.sleep(0.3)
+                        image_seo_results = generate_image_seo_all(
+                            gemini_key, claude_key, openai_key, current_text_model, writer_imgs,
+                            product_name, desc_snippet, parallel=img_seo_parallel,
+                            progress_callback=lambda done, total: progress_bar.progress(done / total, text=f"🖼️ Image SEO {done}/{total}..."))
                         progress_bar.empty()
                         # Store as image_seo_only result (no content)
                         st.session_state.writer_result = {"_image_seo_only": True, "image_seo": image_seo_results}
@@ -3744,42 +5972,11 @@ with tab3:
                                 if writer_imgs and gen_mode == "📝 Content + Image SEO":
                                     product_name = d.get('product_title_h1', '') or raw[:100]
                                     desc_snippet = raw[:300]
-                                    image_seo_results = []
-                                    prev_fnames = []
-                                    prev_alts = []
                                     progress_bar = st.progress(0, text="🖼️ Generating Image SEO...")
-                                    for idx, img in enumerate(writer_imgs):
-                                        progress_bar.progress((idx + 1) / len(writer_imgs), text=f"🖼️ Image SEO {idx+1}/{len(writer_imgs)}...")
-                                        try:
-                                            img_json, img_err = generate_image_seo_per_image(
-                                                gemini_key, claude_key, openai_key, current_text_model,
-                                                img, idx + 1, len(writer_imgs), product_name, desc_snippet,
-                                                previous_filenames=prev_fnames if prev_fnames else None,
-                                                previous_alts=prev_alts if prev_alts else None
-                                            )
-                                            if img_json:
-                                                img_d = parse_json_response(img_json)
-                                                if isinstance(img_d, list) and img_d: img_d = img_d[0]
-                                                if isinstance(img_d, dict):
-                                                    image_seo_results.append(img_d)
-                                                    prev_fnames.append(img_d.get("file_name", ""))
-                                                    prev_alts.append(img_d.get("alt_tag", ""))
-                                                else:
-                                                    fallback = {"file_name": f"product-image-{idx+1}.jpg", "alt_tag": f"Product image {idx+1}"}
-                                                    image_seo_results.append(fallback)
-                                                    prev_fnames.append(fallback["file_name"])
-                                                    prev_alts.append(fallback["alt_tag"])
-                                            else:
-                                                fallback = {"file_name": f"product-image-{idx+1}.jpg", "alt_tag": f"Product image {idx+1}"}
-                                                image_seo_results.append(fallback)
-                                                prev_fnames.append(fallback["file_name"])
-                                                prev_alts.append(fallback["alt_tag"])
-                                        except Exception as img_e:
-                                            fallback = {"file_name": f"product-image-{idx+1}.jpg", "alt_tag": f"Product image {idx+1}"}
-                                            image_seo_results.append(fallback)
-                                            prev_fnames.append(fallback["file_name"])
-                                            prev_alts.append(fallback["alt_tag"])
-                                        time.sleep(0.3)  # Rate limit safety
+                                    image_seo_results = generate_image_seo_all(
+                                        gemini_key, claude_key, openai_key, current_text_model, writer_imgs,
+                                        product_name, desc_snippet, parallel=img_seo_parallel,
+                                        progress_callback=lambda done, total: progress_bar.progress(done / total, text=f"🖼️ Image SEO {done}/{total}..."))
                                     progress_bar.empty()
                                     d["image_seo"] = image_seo_results
                                 st.session_state.writer_result = d; st.rerun()
@@ -3958,25 +6155,22 @@ with tab_batch:
         with bw_top2:
             st.write("")  # spacer
             st.write("")
+            bw_sync = catalog_sync_info(bw_shop)
             if st.button("📦 Load Products from Shopify", type="primary", use_container_width=True, key="batch_load_btn"):
                 load_progress = st.empty()
                 load_status = st.empty()
+                full_reload = st.session_state.get("batch_full_reload", False) or not (bw_sync and bw_sync.get("synced_at"))
                 
                 load_status.info("📂 Loading collections...")
-                collections = get_shopify_all_collections(bw_shop, bw_token)
-                
-                # Get total product count first
-                total_count = "?"
-                count_res, _ = _shopify_admin_get(bw_shop, bw_token, "products/count.json")
-                if count_res:
-                    total_count = count_res.json().get("count", "?")
+                collections = catalog_collections(bw_shop, bw_token, refresh=True)
                 
-                load_status.info(f"✅ {len(collections)} collections. Loading products (total: {total_count})...")
+                load_status.info(f"✅ {len(collections)} collections. " +
+                                 ("Loading full catalog..." if full_reload else "Syncing products changed since last load..."))
                 
-                def progress_cb(count, page):
-                    load_progress.progress(min(page / 50, 0.99), text=f"Loaded {count} products (page {page})...")
+                def progress_cb(count, phase):
+                    load_progress.info(f"⏳ {phase}: {count} loaded...")
                 
-                products, err = get_shopify_all_products(bw_shop, bw_token, progress_callback=progress_cb)
+                products, sync_info, err = catalog_sync(bw_shop, bw_token, full=full_reload, progress_callback=progress_cb)
                 load_progress.empty()
                 
                 if err and not products:
@@ -3985,13 +6179,219 @@ with tab_batch:
                     st.session_state.batch_products = products
                     st.session_state.batch_collections = collections
                     st.session_state.batch_results = {}
-                    # Clear collection filter cache
-                    for k in list(st.session_state.keys()):
-                        if k.startswith("_batch_col_cache_"): del st.session_state[k]
                     warn_msg = f" ⚠️ {err}" if err else ""
-                    count_msg = f" (of {total_count} total)" if total_count != "?" else ""
-                    load_status.success(f"✅ Loaded {len(products)}{count_msg} products, {len(collections)} collections{warn_msg}")
+                    if sync_info["mode"] == "full":
+                        sync_msg = "full load"
+                    else:
+                        sync_msg = f"{sync_info['changed']} changed, {sync_info['deleted']} removed since last sync"
+                    load_status.success(f"✅ Loaded {len(products)} products ({sync_msg}), {len(collections)} collections{warn_msg}")
                     st.rerun()
+            st.checkbox("Full reload (ignore local catalog)", key="batch_full_reload",
+                        help="Normally only products changed since the last load are fetched from Shopify.")
+            if bw_sync and bw_sync.get("synced_at"):
+                st.caption(f"💾 Local catalog: {bw_sync.get('product_count') or 0} products · last sync {bw_sync['synced_at'][:19].replace('T', ' ')} UTC")
+        
+        # Reopening the tab (new session, browser refresh) starts from the local catalog — no Shopify calls
+        if not st.session_state.batch_products and bw_sync and bw_sync.get("synced_at"):
+            st.session_state.batch_products = catalog_products(bw_shop)
+            st.session_state.batch_collections = catalog_collections(bw_shop, bw_token)
+        
+        def _batch_missing_key(model):
+            if model == "Gemini" and not gemini_key: return True
+            if model in CLAUDE_MODELS and not claude_key: return True
+            if model in OPENAI_MODELS and not openai_key: return True
+            return False
+        
+        def _batch_execute(job_id, run_items, run_model, run_auto_update, offline=False):
+            """Run journaled items — (prod, payload, opening_angle); payload None = generate, else push only.
+            offline=True sends the generate items through the provider's batch API instead."""
+            run_owner = f"run-{hashlib.sha1(os.urandom(8)).hexdigest()[:8]}"
+            if not batch_job_claim(job_id, run_owner):
+                st.warning(f"🧵 Job `{job_id}` is being worked on by another run — left alone")
+                return
+            # Fetch catalog once for internal linking
+            catalog = None
+            if any(data is None for _, data, _ in run_items):
+                try:
+                    catalog = fetch_store_catalog("www.bikerringshop.com")
+                except: pass
+            
+            progress_bar = st.progress(0)
+            status_container = st.container()
+            
+            # Show which model is being used
+            if run_model == "Gemini":
+                active_m = st.session_state.get("_gemini_active_model", MODEL_TEXT_GEMINI).replace("models/", "")
+                model_tag = f"Gemini (`{active_m}`)"
+            elif run_model in CLAUDE_MODELS:
+                model_tag = f"{run_model} (`{CLAUDE_MODELS[run_model]}`)"
+            elif run_model in OPENAI_MODELS:
+                model_tag = f"{run_model} (`{OPENAI_MODELS[run_model]}`)"
+            else:
+                model_tag = run_model
+            
+            run_provider = provider_for_model(run_model, claude_key, openai_key)
+            run_workers = st.session_state.get(f"batch_workers_{run_provider}", PROVIDER_CONCURRENCY.get(run_provider, 4))
+            for prod, _, _ in run_items:
+                st.session_state.batch_results[prod["id"]] = {"generating": True}
+            
+            # Shared catalog block → identical prompt prefix for every product (provider-cached);
+            # the first product runs alone so the cache exists before the rest start
+            shared_catalog = st.session_state.get("batch_shared_catalog", True)
+            run_catalog_text = batch_catalog_text(catalog, [p for p, d, _ in run_items if d is None]) if shared_catalog else None
+            run_warmup = 1 if shared_catalog and sum(1 for _, d, _ in run_items if d is None) > 2 else 0
+            
+            if offline:
+                # Provider batch API: submit everything at once, then poll and ingest on the job runner
+                run_base = _llm_base(run_provider)   # read here: job threads have no secrets context
+                def _offline_job(job):
+                    try: _offline_watch(job)
+                    finally: batch_job_release(job_id, run_owner)
+                def _offline_watch(job):
+                    job_progress(job, message="submitting to the provider batch API")
+                    sent, err = batch_offline_submit(job_id, [(p, a) for p, _, a in run_items], gemini_key, claude_key,
+                                                     openai_key, run_model, catalog, run_catalog_text, run_base)
+                    log = [f"📦 {sent}/{len(run_items)} requests submitted ({run_provider} batch API)"] + ([f"❌ {err}"] if err else [])
+                    submitted = {pid for b in batch_job_get(job_id)["provider_batches"] for pid in b["ids"]}
+                    for prod, _, _ in run_items:
+                        if str(prod["id"]) not in submitted: job_result(job, prod["id"], (None, err))
+                    deadline = time.time() + PROVIDER_BATCH_WATCH
+                    while submitted:
+                        entries, pending, errors = batch_offline_poll(job_id, gemini_key, claude_key, openai_key,
+                                                                      bw_shop, bw_token, run_workers)
+                        for pid, entry in entries.items(): job_result(job, pid, (entry, None))
+                        log += errors
+                        job_progress(job, message=f"· {pending} provider batch(es) pending" if pending else "", log=log)
+                        batch_job_claim(job_id, run_owner)   # heartbeat while waiting on the provider
+                        if not pending or time.time() > deadline or job["cancel"].wait(PROVIDER_BATCH_POLL): break
+                with llm_run(job_id):
+                    bg_id = submit_background_job("batch", f"Batch Writer (offline) · {len(run_items)} products", len(run_items),
+                                                  _offline_job, ref=job_id)
+                track_background_job(bg_id)
+                st.session_state.batch_bg_jobs[bg_id] = {"job_id": job_id, "ids": [p["id"] for p, _, _ in run_items]}
+                st.rerun()
+            
+            def _batch_worker(item):
+                prod, data, angle = item
+                if data is not None:
+                    return batch_push_one(prod, data, bw_shop, bw_token, job_id=job_id)
+                return batch_generate_one(
+                    prod, gemini_key, claude_key, openai_key, run_model, catalog,
+                    opening_angle=angle, auto_update=run_auto_update,
+                    shop_url=bw_shop, access_token=bw_token, job_id=job_id, catalog_text=run_catalog_text
+                )
+            
+            if st.session_state.get("batch_background", True):
+                # Hand the run to the background runner; results are merged in on later reruns
+                def _batch_job(job):
+                    def _journaled(item):
+                        try: return _batch_worker(item)
+                        except Exception as e:
+                            batch_job_mark(job_id, item[0]["id"], "failed", error=str(e))
+                            raise
+                    try: job_run_concurrent(job, run_items, _journaled, run_provider, run_workers, key=lambda it: it[0]["id"], warmup=run_warmup)
+                    finally: batch_job_release(job_id, run_owner)
+                with llm_run(job_id):
+                    bg_id = submit_background_job("batch", f"Batch Writer · {len(run_items)} products", len(run_items), _batch_job, ref=job_id)
+                track_background_job(bg_id)
+                st.session_state.batch_bg_jobs[bg_id] = {"job_id": job_id, "ids": [p["id"] for p, _, _ in run_items]}
+                st.rerun()
+            
+            # Results stream in as each product finishes (completion order, not list order)
+            done = 0
+            with llm_run(job_id):
+                for (prod, _, _), result_entry, exc in run_concurrent_batch(run_items, _batch_worker, run_provider, max_workers=run_workers, warmup=run_warmup):
+                    done += 1
+                    if not result_entry:
+                        batch_job_mark(job_id, prod["id"], "failed", error=exc)
+                        result_entry = {"error": exc, "job_id": job_id}
+                    st.session_state.batch_results[prod["id"]] = result_entry
+                    icon = "✅" if result_entry.get("success") else "❌"
+                    with status_container:
+                        st.write(f"{icon} [{done}/{len(run_items)}] **{prod['title'][:60]}** — {model_tag}")
+                    progress_bar.progress(done / len(run_items))
+            # An interrupted script run keeps its claim until the heartbeat goes stale: its workers may still be busy
+            batch_job_release(job_id, run_owner)
+            
+            st.success(f"✅ Batch complete! {len(run_items)} products processed (job `{job_id}`).")
+            st.rerun()
+        
+        # --- BACKGROUND RUNS: pick up results of batches running on the job runner ---
+        if "batch_bg_jobs" not in st.session_state: st.session_state.batch_bg_jobs = {}
+        for bg_id, bg_run in list(st.session_state.batch_bg_jobs.items()):
+            bg = background_job(bg_id)
+            for pid, (entry, exc) in (bg["results"] if bg else {}).items():
+                st.session_state.batch_results[pid] = entry or {"error": exc, "job_id": bg_run["job_id"]}
+            if not bg or bg["finished"]:
+                # cancelled / never started items stay "queued" in the journal — Resume picks them up
+                for pid in bg_run["ids"]:
+                    if st.session_state.batch_results.get(pid, {}).get("generating"):
+                        st.session_state.batch_results.pop(pid, None)
+                st.session_state.batch_bg_jobs.pop(bg_id, None)
+        if st.session_state.batch_bg_jobs:
+            bg_left = sum(len(r["ids"]) for r in st.session_state.batch_bg_jobs.values())
+            st.info(f"🧵 {len(st.session_state.batch_bg_jobs)} batch run(s) working in the background ({bg_left} products) — "
+                    "progress is in the sidebar; you can switch tabs or close the page.")
+        
+        # --- JOB JOURNAL: every run is recorded per product; unfinished runs can be resumed ---
+        bw_jobs = batch_jobs_list(bw_shop)
+        if bw_jobs:
+            bw_unfinished = [j for j in bw_jobs if j["remaining"]]
+            # Runs on the process-wide runner, whichever session started them (a reopened page has no batch_bg_jobs)
+            bw_running = background_job_refs("batch")
+            bw_costs = {r["key"]: r for r in llm_usage_summary("run_id", run_ids=[j["id"] for j in bw_jobs])}
+            resume_job = None
+            with st.expander(f"🧾 Batch Jobs ({len(bw_unfinished)} unfinished)", expanded=bool(bw_unfinished)):
+                for job in bw_jobs:
+                    jc = job["counts"]
+                    jcol1, jcol2, jcol3 = st.columns([3, 1, 1])
+                    jcol1.write(f"**{job['id']}** · {job['model']} · {'generate + update' if job['auto_update'] else 'generate only'} · {job['total']} products"
+                                + (" · 📦 offline" if job["mode"] == "offline" else ""))
+                    jcost = bw_costs.get(job["id"])
+                    jcol1.caption(" · ".join(f"{s}: {jc[s]}" for s in BATCH_JOB_STATES if jc[s])
+                                  + (f" · {job['pending_batches']} provider batch(es) pending" if job["pending_batches"] else "")
+                                  + (f" · 💰 ${jcost['cost_usd']:.3f} ({jcost['input_tokens'] + jcost['output_tokens']:,} tokens, "
+                                     f"{jcost['calls']} calls)" if jcost else ""))
+                    if jcol2.button("📥 Show results", key=f"batch_job_show_{job['id']}"):
+                        for row in batch_job_items(job["id"]):
+                            entry = batch_job_result_entry(row)
+                            if entry: st.session_state.batch_results[row["product_id"]] = entry
+                        st.rerun()
+                    if job["id"] in bw_running:
+                        jcol3.caption("🧵 running")
+                    elif job["claimed"] and not job["pending_batches"]:
+                        jcol3.caption("🧵 running elsewhere")
+                    elif job["pending_batches"]:
+                        if jcol3.button("🔄 Check status", key=f"batch_job_poll_{job['id']}"):
+                            with st.spinner("Checking provider batches..."):
+                                poll_entries, poll_pending, poll_errors = batch_offline_poll(
+                                    job["id"], gemini_key, claude_key, openai_key, bw_shop, bw_token)
+                            st.session_state.batch_results.update(poll_entries)
+                            st.session_state["batch_poll_msg"] = (f"📦 `{job['id']}`: {len(poll_entries)} results ingested, "
+                                                                  f"{poll_pending} provider batch(es) still pending"
+                                                                  + "".join(f" · ⚠️ {e}" for e in poll_errors))
+                            st.rerun()
+                    elif job["remaining"] and jcol3.button(f"▶️ Resume ({job['remaining']})", key=f"batch_job_resume_{job['id']}"):
+                        resume_job = job
+            if st.session_state.get("batch_poll_msg"):
+                st.info(st.session_state.pop("batch_poll_msg"))
+            if resume_job:
+                if _batch_missing_key(resume_job["model"]):
+                    st.error(f"❌ Missing API Key for {resume_job['model']}")
+                elif resume_job["id"] in background_job_refs("batch"):
+                    st.warning(f"🧵 Job `{resume_job['id']}` is already running in the background — not resumed")
+                else:
+                    run_items = []
+                    for row in batch_job_items(resume_job["id"]):
+                        entry = batch_job_result_entry(row)
+                        if row["state"] == "generated" and resume_job["auto_update"]:
+                            run_items.append((row["product"], row["payload"], row["opening_angle"]))   # push only
+                        elif row["state"] in ("queued", "generating", "failed"):
+                            run_items.append((row["product"], None, row["opening_angle"]))
+                        elif entry:
+                            st.session_state.batch_results[row["product_id"]] = entry
+                    st.info(f"▶️ Resuming job `{resume_job['id']}` — {len(run_items)} products left")
+                    _batch_execute(resume_job["id"], run_items, resume_job["model"], bool(resume_job["auto_update"]))
         
         if st.session_state.batch_products:
             products_df = st.session_state.batch_products
@@ -4011,150 +6411,74 @@ with tab_batch:
             with fc3:
                 stock_filter = st.selectbox("Stock Filter:", ["All", "In Stock (> 0)", "Out of Stock (≤ 0)"], key="batch_stock_filter")
             
-            # Apply filters
-            filtered = products_df.copy()
-            
-            if search_term:
-                term = search_term.lower()
-                filtered = [p for p in filtered if term in p["title"].lower() or term in p.get("sku", "").lower() or term in p.get("all_skus", "").lower()]
-            
+            # Apply filters — vectorized over the cached product frame
+            product_index = batch_product_frame(batch_frame_version(products_df), products_df)
+            col_product_ids = None
             if selected_collection != "All Collections":
                 sel_col = next((c for c in st.session_state.batch_collections if c["title"] == selected_collection), None)
                 if sel_col:
-                    cache_key = f"_batch_col_cache_{sel_col['id']}"
-                    if cache_key not in st.session_state:
-                        col_product_ids = set()
-                        
-                        # Method 1: Collects API — works for custom collections
-                        collect_cursor = None
-                        for _ in range(20):
-                            ep = f"collects.json?collection_id={sel_col['id']}&limit=250"
-                            if collect_cursor: ep += f"&page_info={collect_cursor}"
-                            res, _ = _shopify_admin_get(bw_shop, bw_token, ep)
-                            if not res: break
-                            collects = res.json().get("collects", [])
-                            if not collects: break
-                            for c in collects: col_product_ids.add(str(c.get("product_id", "")))
-                            lh = res.headers.get("Link", "")
-                            collect_cursor = None
-                            if 'rel="next"' in lh:
-                                import urllib.parse
-                                for part in lh.split(","):
-                                    if 'rel="next"' in part:
-                                        qp = urllib.parse.parse_qs(urllib.parse.urlparse(part.split(";")[0].strip().strip("<>")).query)
-                                        collect_cursor = qp.get("page_info", [None])[0]
-                            if not collect_cursor: break
-                            time.sleep(0.2)
-                        
-                        # Method 2: If Collects returned nothing — smart collection
-                        if not col_product_ids:
-                            prod_cursor = None
-                            for _ in range(20):
-                                ep = f"collections/{sel_col['id']}/products.json?limit=250"
-                                if prod_cursor: ep += f"&page_info={prod_cursor}"
-                                res, _ = _shopify_admin_get(bw_shop, bw_token, ep)
-                                if not res: break
-                                prods = res.json().get("products", [])
-                                if not prods: break
-                                for p in prods: col_product_ids.add(str(p.get("id", "")))
-                                lh = res.headers.get("Link", "")
-                                prod_cursor = None
-                                if 'rel="next"' in lh:
-                                    import urllib.parse
-                                    for part in lh.split(","):
-                                        if 'rel="next"' in part:
-                                            qp = urllib.parse.parse_qs(urllib.parse.urlparse(part.split(";")[0].strip().strip("<>")).query)
-                                            prod_cursor = qp.get("page_info", [None])[0]
-                                if not prod_cursor: break
-                                time.sleep(0.2)
-                        
-                        st.session_state[cache_key] = col_product_ids
-                    
-                    filtered = [p for p in filtered if p["id"] in st.session_state[cache_key]]
-            
-            if stock_filter == "In Stock (> 0)":
-                filtered = [p for p in filtered if p["total_inventory"] > 0]
-            elif stock_filter == "Out of Stock (≤ 0)":
-                filtered = [p for p in filtered if p["total_inventory"] <= 0]
+                    col_product_ids = catalog_collection_members(bw_shop, sel_col["id"])
+                    if col_product_ids is None:
+                        # Not indexed yet (e.g. last sync failed mid-crawl) — crawl this one collection once and keep it
+                        with st.spinner(f"Indexing collection '{selected_collection}'..."):
+                            col_product_ids, _ = catalog_index_collection(bw_shop, bw_token, sel_col["id"])
+            filtered = batch_frame_filter(product_index, search_term, col_product_ids, stock_filter)
             
             st.caption(f"Showing **{len(filtered)}** of {len(products_df)} products")
             
-            # --- PRODUCT TABLE WITH CHECKBOXES ---
-            if filtered:
+            # --- PRODUCT TABLE (one data-editor grid; the ✓ column is the selection) ---
+            if len(filtered):
+                shown_ids = filtered["id"].tolist()
                 # Select all / deselect
                 sa_col1, sa_col2, sa_col3 = st.columns([1, 1, 4])
                 select_all = sa_col1.button("☑️ Select All", key="batch_select_all")
                 deselect_all = sa_col2.button("☐ Deselect All", key="batch_deselect_all")
                 
-                if select_all:
-                    for p in filtered:
-                        st.session_state[f"batch_chk_{p['id']}"] = True
-                    st.rerun()
-                if deselect_all:
-                    for p in filtered:
-                        st.session_state[f"batch_chk_{p['id']}"] = False
+                if select_all or deselect_all:
+                    if select_all: st.session_state.batch_selected |= set(shown_ids)
+                    else: st.session_state.batch_selected -= set(shown_ids)
+                    st.session_state.batch_grid_counter += 1   # fresh grid — drop edits made on the old one
                     st.rerun()
                 
-                # Table header
-                hdr_cols = st.columns([0.3, 0.5, 2.5, 1, 0.8, 1])
-                hdr_cols[0].write("**✓**")
-                hdr_cols[1].write("**Image**")
-                hdr_cols[2].write("**Product Name**")
-                hdr_cols[3].write("**SKU**")
-                hdr_cols[4].write("**Stock**")
-                hdr_cols[5].write("**Status**")
-                st.markdown("<hr style='margin:2px 0'>", unsafe_allow_html=True)
+                def _batch_status(pid):
+                    result_status = st.session_state.batch_results.get(pid)
+                    if not result_status: return "⬜ Pending"
+                    if result_status.get("success"): return "✅ Done"
+                    if result_status.get("error"): return "❌ Fail"
+                    if result_status.get("generating"): return "⏳ ..."
+                    return "⬜ Pending"
                 
-                # Show products (paginated to avoid lag)
-                page_size = 50
-                total_pages = max(1, (len(filtered) + page_size - 1) // page_size)
-                if "batch_page" not in st.session_state: st.session_state.batch_page = 0
-                current_page_items = filtered[st.session_state.batch_page * page_size : (st.session_state.batch_page + 1) * page_size]
-                
-                for p in current_page_items:
-                    row_cols = st.columns([0.3, 0.5, 2.5, 1, 0.8, 1])
-                    result_status = st.session_state.batch_results.get(p["id"])
-                    
-                    with row_cols[0]:
-                        st.checkbox("", key=f"batch_chk_{p['id']}", label_visibility="collapsed")
-                    with row_cols[1]:
-                        if p.get("image_url"):
-                            try: st.image(p["image_url"], width=40)
-                            except: st.write("📷")
-                        else: st.write("—")
-                    with row_cols[2]:
-                        st.write(f"**{p['title'][:50]}**" + ("..." if len(p['title']) > 50 else ""))
-                        st.caption(f"ID: {p['id']}")
-                    with row_cols[3]:
-                        st.caption(p.get("sku", "—") or "—")
-                    with row_cols[4]:
-                        inv = p["total_inventory"]
-                        if inv > 0: st.write(f"🟢 {inv}")
-                        else: st.write(f"🔴 {inv}")
-                    with row_cols[5]:
-                        if result_status:
-                            if result_status.get("success"):
-                                st.write("✅ Done")
-                            elif result_status.get("error"):
-                                st.write("❌ Fail")
-                            elif result_status.get("generating"):
-                                st.write("⏳ ...")
-                        else:
-                            st.write("⬜ Pending")
-                
-                # Pagination
-                if total_pages > 1:
-                    pg_cols = st.columns([1, 2, 1])
-                    if pg_cols[0].button("◀ Prev", disabled=(st.session_state.batch_page == 0), key="batch_prev"):
-                        st.session_state.batch_page -= 1; st.rerun()
-                    pg_cols[1].write(f"Page {st.session_state.batch_page + 1} of {total_pages}")
-                    if pg_cols[2].button("Next ▶", disabled=(st.session_state.batch_page >= total_pages - 1), key="batch_next"):
-                        st.session_state.batch_page += 1; st.rerun()
+                grid = pd.DataFrame({
+                    "selected": [pid in st.session_state.batch_selected for pid in shown_ids],
+                    "image_url": filtered["image_url"].to_numpy(),
+                    "title": filtered["title"].to_numpy(),
+                    "id": shown_ids,
+                    "sku": filtered["sku"].to_numpy(),
+                    "total_inventory": filtered["total_inventory"].to_numpy(),
+                    "status": [_batch_status(pid) for pid in shown_ids],
+                })
+                # Grid edits are kept by row position, so a different row set needs a different widget
+                grid_rows = hashlib.sha1("\x1f".join(shown_ids).encode()).hexdigest()[:12]
+                edited = st.data_editor(
+                    grid, key=f"batch_grid_{grid_rows}_{st.session_state.batch_grid_counter}",
+                    hide_index=True, use_container_width=True, height=min(38 + 35 * len(grid), 600),
+                    disabled=["image_url", "title", "id", "sku", "total_inventory", "status"],
+                    column_config={
+                        "selected": st.column_config.CheckboxColumn("✓", width="small"),
+                        "image_url": st.column_config.ImageColumn("Image", width="small"),
+                        "title": st.column_config.TextColumn("Product Name", width="large"),
+                        "id": st.column_config.TextColumn("ID"),
+                        "sku": st.column_config.TextColumn("SKU"),
+                        "total_inventory": st.column_config.NumberColumn("Stock", format="%d"),
+                        "status": st.column_config.TextColumn("Status"),
+                    })
+                picked = set(edited.loc[edited["selected"], "id"])
+                st.session_state.batch_selected = (st.session_state.batch_selected - set(shown_ids)) | picked
                 
                 st.divider()
                 
                 # --- BATCH ACTIONS ---
-                selected_products = [p for p in filtered if st.session_state.get(f"batch_chk_{p['id']}", False)]
+                selected_products = [products_df[pos] for pos, pid in zip(filtered.index, shown_ids) if pid in picked]
                 st.write(f"**Selected: {len(selected_products)} products**")
                 
                 act_col1, act_col2, act_col3 = st.columns([1, 1, 1])
@@ -4166,95 +6490,41 @@ with tab_batch:
                 if act_col3.button("🔄 Clear Results", key="batch_clear_results"):
                     st.session_state.batch_results = {}
                     st.rerun()
+                batch_provider_sel = provider_for_model(batch_model, claude_key, openai_key)
+                batch_provider_cap = max(2, PROVIDER_CONCURRENCY.get(batch_provider_sel, 4))
+                batch_workers = st.slider("⚡ Products in parallel:", 1, batch_provider_cap, batch_provider_cap, key=f"batch_workers_{batch_provider_sel}",
+                                          help="How many products are generated at the same time. Capped by the provider's concurrency limit (shared with other running batches).")
+                st.checkbox("♻️ One catalog block for the whole batch", value=True, key="batch_shared_catalog",
+                            help="Every product gets the same catalog list (ranked for the batch as a whole), so the "
+                                 "large rules + catalog prompt prefix is served from the provider's prompt cache after "
+                                 "the first product — cheaper and faster. Untick to rank the catalog per product.")
+                st.checkbox("🧵 Run in background", value=True, key="batch_background",
+                            help="The batch keeps running on the server while you use other tabs or close the page. "
+                                 "Progress is shown in the sidebar; results appear here when you come back.")
+                st.checkbox("📦 Offline batch (provider batch API)", value=False, key="batch_offline",
+                            help="Send all selected products as one provider batch job (Anthropic / OpenAI / Gemini batch API): "
+                                 "about half the token price and no rate limits, but results can take minutes to hours. "
+                                 "Runs in the background; 'Check status' under Batch Jobs picks up late results.")
                 
                 auto_update = gen_and_update  # Flag: auto-update to Shopify after gen
                 
                 if gen_only or gen_and_update:
                     if len(selected_products) == 0:
                         st.warning("No products selected")
+                    elif _batch_missing_key(batch_model):
+                        st.error(f"❌ Missing API Key for {batch_model}")
                     else:
-                        # Check API key
-                        batch_missing_key = False
-                        if batch_model == "Gemini" and not gemini_key: batch_missing_key = True
-                        elif batch_model in CLAUDE_MODELS and not claude_key: batch_missing_key = True
-                        elif batch_model in OPENAI_MODELS and not openai_key: batch_missing_key = True
-                        
-                        if batch_missing_key:
-                            st.error(f"❌ Missing API Key for {batch_model}")
-                        else:
-                            # Fetch catalog once for internal linking
-                            catalog = None
-                            try:
-                                catalog = fetch_store_catalog("www.bikerringshop.com")
-                            except: pass
-                            
-                            progress_bar = st.progress(0)
-                            status_container = st.container()
-                            
-                            for idx, prod in enumerate(selected_products):
-                                pid = prod["id"]
-                                st.session_state.batch_results[pid] = {"generating": True}
-                                
-                                with status_container:
-                                    # Show which model is being used
-                                    if batch_model == "Gemini":
-                                        active_m = st.session_state.get("_gemini_active_model", MODEL_TEXT_GEMINI).replace("models/", "")
-                                        model_tag = f"Gemini (`{active_m}`)"
-                                    elif batch_model in CLAUDE_MODELS:
-                                        model_tag = f"{batch_model} (`{CLAUDE_MODELS[batch_model]}`)"
-                                    elif batch_model in OPENAI_MODELS:
-                                        model_tag = f"{batch_model} (`{OPENAI_MODELS[batch_model]}`)"
-                                    else:
-                                        model_tag = batch_model
-                                    st.write(f"⏳ [{idx+1}/{len(selected_products)}] **{prod['title'][:60]}** — {model_tag}")
-                                
-                                # Build input from existing product data
-                                raw_input = prod.get("body_html", "") or ""
-                                raw_input = remove_html_tags(raw_input) if raw_input else ""
-                                raw_input = f"Product Name: {prod['title']}\nProduct Type: {prod.get('product_type', '')}\nSKU: {prod.get('sku', '')}\n\n{raw_input}"
-                                
-                                # Generate content (text only — no images for batch speed)
-                                try:
-                                    # Smart catalog: filter by this product's context for relevant links
-                                    catalog_text = ""
-                                    if catalog and (catalog.get("collections") or catalog.get("products")):
-                                        catalog_text = format_catalog_for_prompt(catalog, product_context=raw_input)
-                                    
-                                    json_txt, err = generate_full_product_content(
-                                        gemini_key, claude_key, openai_key, batch_model, 
-                                        None, raw_input, catalog_text, product_handle=prod.get("handle", ""),
-                                        opening_angle=OPENING_ANGLE_POOL[idx % len(OPENING_ANGLE_POOL)]
-                                    )
-                                    
-                                    if json_txt:
-                                        d = parse_json_response(json_txt)
-                                        if isinstance(d, list) and d: d = d[0]
-                                        if isinstance(d, dict):
-                                            result_entry = {"success": True, "data": d}
-                                            
-                                            # Auto-update to Shopify if requested
-                                            if auto_update:
-                                                try:
-                                                    ok, msg = update_shopify_description_only(bw_shop, bw_token, pid, d)
-                                                    result_entry["updated"] = ok
-                                                    result_entry["update_msg"] = msg
-                                                except Exception as ue:
-                                                    result_entry["updated"] = False
-                                                    result_entry["update_msg"] = str(ue)
-                                            
-                                            st.session_state.batch_results[pid] = result_entry
-                                        else:
-                                            st.session_state.batch_results[pid] = {"error": "Parse failed", "raw": json_txt[:500]}
-                                    else:
-                                        st.session_state.batch_results[pid] = {"error": err or "Generation failed"}
-                                except Exception as e:
-                                    st.session_state.batch_results[pid] = {"error": str(e)}
-                                
-                                progress_bar.progress((idx + 1) / len(selected_products))
-                                time.sleep(0.5)  # Small delay between API calls
-                            
-                            st.success(f"✅ Batch complete! {len(selected_products)} products processed.")
-                            st.rerun()
+                        # The listing carries no descriptions — load them for just the selected products
+                        with st.spinner(f"Loading descriptions for {len(selected_products)} products..."):
+                            selected_products, body_err = catalog_product_bodies(bw_shop, bw_token, selected_products)
+                        if body_err:
+                            st.warning(f"⚠️ Some product descriptions could not be loaded ({body_err}) — those products are written from title, type and SKU only.")
+                        angles = {p["id"]: OPENING_ANGLE_POOL[idx % len(OPENING_ANGLE_POOL)] for idx, p in enumerate(selected_products)}
+                        batch_offline = st.session_state.get("batch_offline", False)
+                        job_id = batch_job_create(bw_shop, batch_model, auto_update, selected_products, angles,
+                                                  mode="offline" if batch_offline else None)
+                        _batch_execute(job_id, [(p, None, angles[p["id"]]) for p in selected_products], batch_model, auto_update,
+                                       offline=batch_offline)
                 
                 # --- RESULTS REVIEW ---
                 if st.session_state.batch_results:
@@ -4296,6 +6566,7 @@ with tab_batch:
                                         with st.spinner("Updating..."):
                                             ok, msg = update_shopify_description_only(bw_shop, bw_token, pid, d)
                                             if ok:
+                                                batch_job_mark(result.get("job_id"), pid, "pushed", update_msg=msg)
                                                 st.session_state.batch_results[pid]["updated"] = True
                                                 st.session_state.batch_results[pid]["update_msg"] = msg
                                                 st.success(msg)
@@ -4333,7 +6604,7 @@ with tab_colwriter:
             st.write(""); st.write("")
             if st.button("📦 Load Collections", type="primary", use_container_width=True, key="cw_load_btn"):
                 with st.spinner("Loading collections from Shopify..."):
-                    collections = get_shopify_all_collections(cw_shop, cw_token)
+                    collections = catalog_collections(cw_shop, cw_token, refresh=True)
                     if collections:
                         st.session_state.colwriter_collections = collections
                         st.session_state.colwriter_result = None
@@ -4342,6 +6613,10 @@ with tab_colwriter:
                     else:
                         st.error("Failed to load collections")
         
+        if not st.session_state.colwriter_collections and catalog_sync_info(cw_shop):
+            # Collections saved by an earlier load (this or the Batch Writer tab) — no Shopify call needed
+            st.session_state.colwriter_collections = catalog_collections(cw_shop, cw_token)
+        
         if st.session_state.colwriter_collections:
             st.divider()
             
@@ -4400,13 +6675,15 @@ with tab_colwriter:
                             # Fetch real products in THIS collection for accurate content
                             collection_products_summary = ""
                             try:
-                                collection_products_summary = summarize_collection_products(
+                                collection_products_summary, cps_err = summarize_collection_products(
                                     cw_shop, cw_token, selected_col["id"]
                                 )
-                                if collection_products_summary:
-                                    st.toast(f"📦 Loaded product data from collection")
-                            except Exception as cps_err:
-                                pass  # Continue without product data
+                            except Exception as e:
+                                cps_err = f"Connection Error: {e}"
+                            if cps_err:
+                                st.warning(f"⚠️ Could not read this collection's products ({cps_err}) — writing without product data")
+                            elif collection_products_summary:
+                                st.toast(f"📦 Loaded product data from collection")
                             
                             # Fetch catalog for internal links
                             catalog_text = ""
@@ -4611,6 +6888,37 @@ with tab5:
         else: st.warning("⚠️ Claude API Key: Not Set")
         if openai_key: st.success("✅ OpenAI API Key: Configured")
         else: st.warning("⚠️ OpenAI API Key: Not Set")
+        st.write("**📡 Connection Pool (per host, since server start):**")
+        host_stats = http_metrics()
+        if host_stats: st.dataframe(pd.DataFrame(host_stats), use_container_width=True, hide_index=True)
+        else: st.caption("No outbound calls yet.")
+    st.divider()
+    st.write("**💰 AI Usage & Cost** (estimated from each provider's reported tokens × LLM_PRICES)")
+    usage_period = st.radio("Period:", ["Today", "7 days", "30 days", "All time"], index=1, horizontal=True, key="usage_period")
+    usage_since = {"Today": time.mktime(time.strptime(time.strftime("%Y-%m-%d"), "%Y-%m-%d")),
+                   "7 days": time.time() - 7 * 86400, "30 days": time.time() - 30 * 86400, "All time": None}[usage_period]
+    usage_by_model = llm_usage_summary("model", since=usage_since)
+    if not usage_by_model:
+        st.caption("No AI calls recorded in this period.")
+    else:
+        u_total = sum(r["cost_usd"] for r in usage_by_model)
+        u1, u2, u3, u4 = st.columns(4)
+        u1.metric("Estimated cost", f"${u_total:.2f}")
+        u2.metric("Calls", f"{sum(r['calls'] for r in usage_by_model):,}")
+        u3.metric("Tokens in / out", f"{sum(r['input_tokens'] for r in usage_by_model):,} / {sum(r['output_tokens'] for r in usage_by_model):,}")
+        u4.metric("Cache hits", f"{sum(r['cached'] for r in usage_by_model):,}")
+        if any(r["unpriced"] for r in usage_by_model):
+            st.caption("⚠️ Some models have no price in LLM_PRICES — their cost is counted as $0.")
+        for r in usage_by_model:
+            billed = r["calls"] - r["cached"] - r["failed"]
+            r["usd_per_call"] = round(r["cost_usd"] / billed, 4) if billed else None
+        ut1, ut2, ut3, ut4 = st.tabs(["Per model", "Per task", "Per day", "Per run"])
+        ut1.dataframe(pd.DataFrame(usage_by_model).drop(columns=["unpriced"]), use_container_width=True, hide_index=True)
+        ut2.dataframe(pd.DataFrame(llm_usage_summary("task", since=usage_since)).drop(columns=["unpriced"]), use_container_width=True, hide_index=True)
+        ut3.dataframe(pd.DataFrame(llm_usage_summary("day", since=usage_since)).drop(columns=["unpriced"]), use_container_width=True, hide_index=True)
+        u_runs = [r for r in llm_usage_summary("run_id", since=usage_since) if r["key"]]
+        if u_runs: ut4.dataframe(pd.DataFrame(u_runs[:50]).drop(columns=["unpriced"]), use_container_width=True, hide_index=True)
+        else: ut4.caption("No batch runs in this period.")
     st.divider()
     if st.button("📡 Scan Gemini Models", key="models_scan_btn"):
         if not gemini_key: st.error("No Key")
@@ -4634,6 +6942,7 @@ import glob as _glob
 import os as _os
 import sys as _sys
 from datetime import date as _date
+from types import SimpleNamespace as _NS
 
 SHOPIFY_AI_DIR = st.secrets.get("SHOPIFY_AI_DIR", r"C:\Users\pc1\shopify-ai")
 AUDIT_EXCLUDE_HANDLES = {"express-service"}  # service SKUs — not real products, never audit/fix
@@ -4730,6 +7039,30 @@ def _run_fix_agent(handle, audit_file, model, budget, box):
     return ok, fl, proc.returncode
 
 
+def _fix_queue_row(handle, model, ok, fl):
+    return {"handle": handle, "ผล": "✅ สำเร็จ" if ok else "❌ ตรวจ log",
+            "re-audit": fl.get("reaudit_verdict", "?"),
+            "model": model.replace("claude-", ""),
+            "cost_usd": round(fl.get("cost_usd") or 0, 2),
+            "turns": fl.get("num_turns")}
+
+
+def _run_fix_queue_job(job, plan, budget):
+    """Background-runner body for the fix queue: plan = [(handle, audit_file, model)], run one
+    after another. The agent's live log goes to the job log; stops between products on cancel."""
+    for qi, (qh, q_file, q_model) in enumerate(plan, 1):
+        if job["cancel"].is_set():
+            break
+        job_progress(job, message=f"[{qi}/{len(plan)}] {qh} ({q_model})", log=[])
+        box = _NS(code=lambda text: job_progress(job, log=text.splitlines()))
+        try:
+            ok, fl, rc = _run_fix_agent(qh, q_file, q_model, budget, box)
+        except Exception as e:
+            ok, fl = False, {}
+            job_progress(job, log=[str(e)])
+        job_result(job, qh, _fix_queue_row(qh, q_model, ok, fl))
+
+
 def _load_verified_registry():
     try:
         with open(_os.path.join(SHOPIFY_AI_DIR, "audit_results", "verified_clean.json"),
@@ -4840,6 +7173,14 @@ with tab_audit:
     target_val = tcol2.text_input("handle / SKU / collection-handle", key="audit_target_val",
                                   placeholder="e.g. 3601 or spade-skull-crossbones-ring or skull-rings",
                                   disabled=is_all)
+    audit_shop = st.secrets.get("SHOPIFY_SHOP_URL", "")
+    if audit_shop and not is_all and target_kind.startswith("Product") and target_val.strip():
+        hit = catalog_find(audit_shop, target_val)
+        if hit:
+            st.caption(f"💾 {hit['title']} · handle `{hit['handle']}` · SKU {hit.get('sku') or '—'} · "
+                       f"{hit.get('status', '')} · updated {(hit.get('updated_at') or '')[:10]}")
+        elif catalog_sync_info(audit_shop):
+            st.caption("💾 ไม่พบใน local catalog (Batch Writer → Load Products เพื่อ sync) — script จะค้นจาก Shopify เอง")
     if is_all:
         st.caption("🏪 ทั้งร้าน ≈ 1,160 products · Quick scan รอบแรก ~20–30 นาที (มี pagination ครบ) — "
                    "ถ้าเปิด ⏭️ ข้ามตัวที่ผ่านแล้ว รอบถัดไปจะเหลือเฉพาะตัวที่เปลี่ยน/ยังไม่เคยตรวจ · "
@@ -5041,11 +7382,33 @@ with tab_audit:
                         n_son = len(q_plan) - n_opus
                         lo = n_son * 1.0 + n_opus * 2.0
                         hi = n_son * 2.0 + n_opus * 3.5
+                        q_bg_on = st.session_state.get("audit_fix_queue_bg", True)
                         st.caption(f"แผนคิว: Sonnet {n_son} ตัว + Opus {n_opus} ตัว · "
                                    f"ประมาณการ ~${lo:.0f}–{hi:.0f} รวม · "
-                                   f"ใช้เวลา ~{len(queue)*5}–{len(queue)*15} นาที · เปิดหน้านี้ค้างไว้จนจบ")
-                    if st.button(f"🧺 Fix ทั้งคิว ({len(queue)} ตัว)", key="audit_fix_queue_btn",
-                                 disabled=not queue):
+                                   f"ใช้เวลา ~{len(queue)*5}–{len(queue)*15} นาที · "
+                                   + ("รันเบื้องหลัง — ปิดหน้านี้ได้ ดูความคืบหน้าที่ sidebar" if q_bg_on else "เปิดหน้านี้ค้างไว้จนจบ"))
+                    st.checkbox("🧵 Run in background", value=True, key="audit_fix_queue_bg",
+                                help="คิวรันต่อบน server แม้ปิดหน้า/สลับแท็บ — ความคืบหน้าอยู่ที่ sidebar, ผลสรุปขึ้นที่นี่เมื่อจบ")
+                    q_job = st.session_state.get("audit_queue_job")
+                    q_bg = background_job(q_job) if q_job else None
+                    if q_job and (not q_bg or q_bg["finished"]):
+                        if q_bg:
+                            st.session_state.audit_last_queue = list(q_bg["results"].values())
+                        st.session_state.audit_queue_job = q_bg = None
+                    if q_bg:
+                        st.info(f"🧵 คิวกำลังรันเบื้องหลัง — {q_bg['done']}/{q_bg['total']} · {q_bg['message']}")
+                        if q_bg["log"]:
+                            st.code("\n".join(q_bg["log"]))
+                    q_go = st.button(f"🧺 Fix ทั้งคิว ({len(queue)} ตัว)", key="audit_fix_queue_btn",
+                                     disabled=not queue or bool(q_bg))
+                    if q_go and st.session_state.audit_fix_queue_bg:
+                        q_run = [(qh, next(r for r in fixable if r["handle"] == qh)["_file"], q_plan[qh]) for qh in queue]
+                        bg_id = submit_background_job("audit_fix", f"Audit fix queue · {len(queue)} products",
+                                                      len(queue), _run_fix_queue_job, q_run, fix_budget)
+                        track_background_job(bg_id)
+                        st.session_state.audit_queue_job = bg_id
+                        st.rerun()
+                    elif q_go:
                         q_results = []
                         prog = st.progress(0.0, text=f"0/{len(queue)}")
                         for qi, qh in enumerate(queue, 1):
@@ -5063,11 +7426,7 @@ with tab_audit:
                                 qs.update(label=("✅" if ok else "❌") + f" [{qi}/{len(queue)}] {qh}"
                                           + (f" — {qv} · ${(fl.get('cost_usd') or 0):.2f}" if ok else " — ดู log"),
                                           state="complete" if ok else "error")
-                            q_results.append({"handle": qh, "ผล": "✅ สำเร็จ" if ok else "❌ ตรวจ log",
-                                              "re-audit": fl.get("reaudit_verdict", "?"),
-                                              "model": q_model.replace("claude-", ""),
-                                              "cost_usd": round(fl.get("cost_usd") or 0, 2),
-                                              "turns": fl.get("num_turns")})
+                            q_results.append(_fix_queue_row(qh, q_model, ok, fl))
                             prog.progress(qi / len(queue), text=f"{qi}/{len(queue)}")
                         st.session_state.audit_last_queue = q_results
                         if all(r["ผล"].startswith("✅") for r in q_results):
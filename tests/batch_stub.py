@@ -0,0 +1,146 @@
+"""Local stand-in for the Anthropic / OpenAI / Gemini batch APIs.
+
+Serves just enough of each provider's batch endpoints for batch_offline_submit / batch_offline_poll:
+submit, status (ended after `polls_needed` polls) and results in each provider's own format —
+Claude results JSONL, OpenAI output file, Gemini inlinedResponses. Point them at it with base=stub.base.
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+ANSWER = {"url_slug": "gold-ring", "meta_title": "Gold Ring", "meta_description": "A solid gold ring.",
+          "product_title_h1": "Gold Ring", "html_content": "<p>" + "Solid gold. " * 40 + "</p>", "image_seo": []}
+
+
+def provider_answer(provider, text, cut=False):
+    """One successful completion body the way each provider's batch results carry it."""
+    if provider == "claude":
+        return {"id": "msg_1", "type": "message", "stop_reason": "max_tokens" if cut else "end_turn",
+                "content": [{"type": "tool_use", "name": "product_content", "input": json.loads(text)}],
+                "usage": {"input_tokens": 800, "cache_read_input_tokens": 200, "output_tokens": 500}}
+    if provider == "openai":
+        return {"choices": [{"message": {"content": text}, "finish_reason": "length" if cut else "stop"}],
+                "usage": {"prompt_tokens": 1000, "completion_tokens": 500}}
+    return {"candidates": [{"content": {"parts": [{"text": text}]}, "finishReason": "MAX_TOKENS" if cut else "STOP"}],
+            "usageMetadata": {"promptTokenCount": 1000, "candidatesTokenCount": 500}}
+
+
+class BatchStub:
+    """Running stand-in server. Per-request knobs (sets of custom ids / flags):
+    fail_ids — answered with a provider error; cut_ids — answer cut off at the token limit;
+    bad_ids — answer that does not match the product_content schema;
+    gemini_legacy — finished Gemini batches put their answers in metadata.output (older payloads)."""
+
+    def __init__(self, polls_needed=2):
+        self.batches, self.files, self.calls = {}, {}, []
+        self.polls_needed = polls_needed
+        self.fail_ids, self.cut_ids, self.bad_ids = set(), set(), set()
+        self.gemini_legacy = False
+        self._n = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self.base = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def new_id(self, prefix):
+        self._n += 1
+        return f"{prefix}{self._n}"
+
+    def answer(self, provider, custom_id):
+        text = json.dumps({"title": "only a title"} if custom_id in self.bad_ids else ANSWER)
+        return provider_answer(provider, text, cut=custom_id in self.cut_ids)
+
+    def poll(self, batch_id):
+        batch = self.batches[batch_id]
+        batch["polls"] += 1
+        return batch["polls"] >= self.polls_needed
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, status=200, ctype="application/json"):
+            data = body if isinstance(body, bytes) else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _jsonl(self, rows):
+            self._send("\n".join(json.dumps(r) for r in rows).encode(), ctype="application/binary")
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            path = urlparse(self.path).path
+            stub.calls.append(("POST", path))
+            if path == "/v1/messages/batches":
+                reqs = json.loads(raw)["requests"]
+                batch_id = stub.new_id("msgbatch_")
+                stub.batches[batch_id] = {"provider": "claude", "ids": [r["custom_id"] for r in reqs], "polls": 0, "requests": reqs}
+                return self._send({"id": batch_id, "processing_status": "in_progress"})
+            if path == "/v1/files":
+                # multipart upload: keep the JSONL lines of the batch input file
+                lines = [json.loads(l) for l in raw.decode().splitlines() if l.startswith('{"custom_id"')]
+                file_id = stub.new_id("file-")
+                stub.files[file_id] = lines
+                return self._send({"id": file_id})
+            if path == "/v1/batches":
+                lines = stub.files[json.loads(raw)["input_file_id"]]
+                batch_id = stub.new_id("batch_")
+                stub.batches[batch_id] = {"provider": "openai", "ids": [l["custom_id"] for l in lines], "polls": 0, "requests": lines}
+                return self._send({"id": batch_id, "status": "validating"})
+            if path.endswith(":batchGenerateContent"):
+                reqs = json.loads(raw)["batch"]["input_config"]["requests"]["requests"]
+                batch_id = "batches/" + stub.new_id("gb")
+                stub.batches[batch_id] = {"provider": "gemini", "ids": [r["metadata"]["key"] for r in reqs], "polls": 0, "requests": reqs}
+                return self._send({"name": batch_id, "metadata": {"state": "BATCH_STATE_PENDING"}})
+            self._send({"error": f"unknown {path}"}, 404)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            stub.calls.append(("GET", path))
+            m = re.match(r"/v1/messages/batches/([^/]+)(/results)?$", path)
+            if m:
+                batch_id, ids = m.group(1), stub.batches[m.group(1)]["ids"]
+                if m.group(2):
+                    return self._jsonl([{"custom_id": c, "result": {"type": "errored", "error": {"type": "invalid_request"}}
+                                         if c in stub.fail_ids else {"type": "succeeded", "message": stub.answer("claude", c)}}
+                                        for c in ids])
+                ended = stub.poll(batch_id)
+                return self._send({"id": batch_id, "processing_status": "ended" if ended else "in_progress",
+                                   "results_url": f"{stub.base}{path}/results" if ended else None})
+            m = re.match(r"/v1/batches/([^/]+)$", path)
+            if m:
+                ended = stub.poll(m.group(1))
+                return self._send({"id": m.group(1), "status": "completed" if ended else "in_progress",
+                                   "output_file_id": f"out-{m.group(1)}" if ended else None})
+            m = re.match(r"/v1/files/out-([^/]+)/content$", path)
+            if m:
+                return self._jsonl([{"custom_id": c, "error": None,
+                                     "response": {"status_code": 400, "body": {"error": {"message": "bad request"}}}
+                                     if c in stub.fail_ids else {"status_code": 200, "body": stub.answer("openai", c)}}
+                                    for c in stub.batches[m.group(1)]["ids"]])
+            m = re.match(r"/v1beta/(batches/[^/]+)$", path)
+            if m:
+                batch_id = m.group(1)
+                if not stub.poll(batch_id):
+                    return self._send({"name": batch_id, "metadata": {"state": "BATCH_STATE_RUNNING"}})
+                rows = [{"error": {"code": 400, "message": "bad request"}, "metadata": {"key": c}} if c in stub.fail_ids
+                        else {"response": stub.answer("gemini", c), "metadata": {"key": c}} for c in stub.batches[batch_id]["ids"]]
+                inlined = {"inlinedResponses": {"inlinedResponses": rows}}
+                if stub.gemini_legacy:
+                    return self._send({"name": batch_id, "done": True,
+                                       "metadata": {"state": "BATCH_STATE_SUCCEEDED", "output": inlined}})
+                return self._send({"name": batch_id, "done": True, "metadata": {"state": "BATCH_STATE_SUCCEEDED"},
+                                   "response": inlined})
+            self._send({"error": f"unknown {path}"}, 404)
+
+    return Handler
@@ -0,0 +1,28 @@
+"""Shared fixtures. app.py is a Streamlit script, so the tests load everything above its UI section
+(constants and functions) into a namespace instead of importing it."""
+import logging
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    src = (ROOT / "app.py").read_text(encoding="utf-8")
+    namespace = {"__name__": "app_functions", "__file__": str(ROOT / "app.py")}
+    exec(compile(src[:src.index("# --- UI LOGIC ---")], str(ROOT / "app.py"), "exec"), namespace)
+    return namespace
+
+
+@pytest.fixture
+def app(app_module, tmp_path, monkeypatch):
+    """app.py functions with the local store (and anything written next to the script) in tmp_path."""
+    monkeypatch.setitem(app_module, "__file__", str(tmp_path / "app.py"))
+    token = app_module["_DB_PATH"].set(str(tmp_path / "app_cache.sqlite3"))
+    yield app_module
+    app_module["_DB_PATH"].reset(token)
@@ -0,0 +1,129 @@
+"""Local stand-in for the Shopify Admin API pieces the catalog loaders use.
+
+Serves one small catalog two ways: REST products.json (what get_shopify_products_page reads) and a
+bulk export — bulkOperationRunQuery starts it, node(id:) reports RUNNING until `polls_needed` polls
+and then COMPLETED with a url, and that url streams the JSONL file. Child lines (variants, images,
+collections, metafields) carry __parentId the way Shopify writes them. Point the app at it by making
+_shopify_admin_base return stub.admin_base.
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+API_VERSION_PATH = re.compile(r"^/admin/api/[^/]+/")
+
+CATALOG = [
+    {"id": 101, "title": "Skull Ring", "handle": "skull-ring", "product_type": "Ring", "status": "active",
+     "updated_at": "2026-05-01T10:00:00Z",
+     "variants": [{"id": 1011, "sku": "SR-9", "inventory_quantity": 3}, {"id": 1012, "sku": "SR-10", "inventory_quantity": 2}],
+     "images": [{"id": 5011, "src": "https://cdn.shopify.com/s/files/skull-ring.jpg", "alt": "Skull ring"}],
+     "collections": [77, 78], "metafields": {"global.title_tag": "Skull Ring | Biker Rings"}},
+    {"id": 102, "title": "Eagle Pendant", "handle": "eagle-pendant", "product_type": "Pendant", "status": "draft",
+     "updated_at": "2026-05-02T10:00:00Z",
+     "variants": [{"id": 1021, "sku": "", "inventory_quantity": 0}],
+     "images": [], "collections": [], "metafields": {}},
+    {"id": 103, "title": "Cross Chain", "handle": "cross-chain", "product_type": "Chain", "status": "active",
+     "updated_at": "2026-05-03T10:00:00Z",
+     "variants": [{"id": 1031, "sku": "CC-20", "inventory_quantity": 5}],
+     "images": [{"id": 5031, "src": "https://cdn.shopify.com/s/files/cross-chain.jpg", "alt": ""}],
+     "collections": [78], "metafields": {}},
+]
+
+
+def _gid(kind, num):
+    return f"gid://shopify/{kind}/{num}"
+
+
+def rest_product(p):
+    """The product as products.json returns it."""
+    return {"id": p["id"], "title": p["title"], "handle": p["handle"], "product_type": p["product_type"],
+            "status": p["status"], "updated_at": p["updated_at"],
+            "variants": [{"id": v["id"], "sku": v["sku"], "inventory_quantity": v["inventory_quantity"]} for v in p["variants"]],
+            "image": {"src": p["images"][0]["src"]} if p["images"] else None}
+
+
+def bulk_lines(catalog, orphans_first=()):
+    """JSONL lines of a bulk export of catalog. Children of the product ids in orphans_first are
+    written before their parent line (the parser must hold them until the parent arrives)."""
+    lines = []
+    for p in catalog:
+        parent = _gid("Product", p["id"])
+        node = {"id": parent, "title": p["title"], "handle": p["handle"], "productType": p["product_type"],
+                "status": p["status"].upper(), "updatedAt": p["updated_at"],
+                "featuredImage": {"url": p["images"][0]["src"]} if p["images"] else None}
+        children = [{"id": _gid("ProductVariant", v["id"]), "sku": v["sku"], "inventoryQuantity": v["inventory_quantity"],
+                     "__parentId": parent} for v in p["variants"]]
+        children += [{"id": _gid("ProductImage", i["id"]), "url": i["src"], "altText": i["alt"] or None, "__parentId": parent}
+                     for i in p["images"]]
+        children += [{"id": _gid("Collection", c), "__parentId": parent} for c in p["collections"]]
+        children += [{"id": _gid("Metafield", 900 + n), "namespace": k.split(".", 1)[0], "key": k.split(".", 1)[1],
+                      "value": v, "__parentId": parent} for n, (k, v) in enumerate(p["metafields"].items())]
+        rows = children + [node] if p["id"] in orphans_first else [node] + children
+        lines += [json.dumps(r) for r in rows]
+    return lines
+
+
+class ShopifyBulkStub:
+    """Running stand-in server. `lines` is the export file; `calls` records (method, path, graphql op)."""
+
+    def __init__(self, catalog=CATALOG, polls_needed=2, orphans_first=()):
+        self.catalog, self.polls_needed, self.polls, self.calls = catalog, polls_needed, 0, []
+        self.lines = bulk_lines(catalog, orphans_first)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self.base = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self.admin_base = f"{self.base}/admin/api/2024-01"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, status=200, ctype="application/json"):
+            data = body if isinstance(body, bytes) else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            path = API_VERSION_PATH.sub("/", urlparse(self.path).path)
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            query = body.get("query", "")
+            if path != "/graphql.json":
+                return self._send({"errors": f"unknown {path}"}, 404)
+            cost = {"throttleStatus": {"maximumAvailable": 1000.0, "currentlyAvailable": 990, "restoreRate": 50.0}}
+            if "bulkOperationRunQuery" in query:
+                stub.calls.append(("POST", path, "bulkOperationRunQuery"))
+                return self._send({"data": {"bulkOperationRunQuery": {
+                    "bulkOperation": {"id": "gid://shopify/BulkOperation/1", "status": "CREATED"}, "userErrors": []}},
+                    "extensions": {"cost": cost}})
+            if "node(id:" in query:
+                stub.calls.append(("POST", path, "bulkOperation status"))
+                stub.polls += 1
+                done = stub.polls >= stub.polls_needed
+                node = {"id": body["variables"]["id"], "status": "COMPLETED" if done else "RUNNING", "errorCode": None,
+                        "objectCount": str(len(stub.lines) if done else 0),
+                        "url": f"{stub.base}/bulk/export.jsonl" if done else None, "partialDataUrl": None}
+                return self._send({"data": {"node": node}, "extensions": {"cost": cost}})
+            self._send({"errors": [{"message": "unsupported query"}]})
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            path = API_VERSION_PATH.sub("/", parsed.path)
+            stub.calls.append(("GET", path, None))
+            if path == "/bulk/export.jsonl":
+                return self._send(("\n".join(stub.lines) + "\n").encode(), ctype="application/jsonl")
+            if path == "/products.json":
+                return self._send({"products": [rest_product(p) for p in stub.catalog]})
+            self._send({"errors": f"unknown {path}"}, 404)
+
+    return Handler
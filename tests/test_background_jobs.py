@@ -0,0 +1,30 @@
+"""Background job runner: which journal a running job belongs to is visible from any session."""
+import threading
+import time
+
+
+def _wait(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.02)
+    return predicate()
+
+
+def test_refs_list_queued_and_running_jobs_until_they_finish(app):
+    release = threading.Event()
+    bg_id = app["submit_background_job"]("batch", "Batch Writer · 2 products", 2, lambda job: release.wait(5), ref="journal-1")
+    try:
+        assert _wait(lambda: app["background_job"](bg_id)["status"] == "running")
+        assert "journal-1" in app["background_job_refs"]("batch")
+        assert "journal-1" not in app["background_job_refs"]("retouch")
+    finally:
+        release.set()
+    assert _wait(lambda: app["background_job"](bg_id)["status"] == "done")
+    assert "journal-1" not in app["background_job_refs"]("batch")
+
+
+def test_jobs_without_ref_are_not_listed(app):
+    bg_id = app["submit_background_job"]("batch", "no ref", 1, lambda job: None)
+    assert _wait(lambda: app["background_job"](bg_id)["finished"])
+    assert app["background_job"](bg_id)["ref"] is None
+    assert None not in app["background_job_refs"]("batch")
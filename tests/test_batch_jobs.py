@@ -0,0 +1,45 @@
+"""Batch job journal claims: Resume may only take over a job no live run is working on."""
+import time
+
+PRODUCTS = [{"id": "1000", "title": "Gold Ring"}, {"id": "1001", "title": "Silver Ring"}]
+
+
+def _job(app):
+    return app["batch_job_create"]("test-shop", "Gemini", True, PRODUCTS)
+
+
+def _age_claim(app, job, seconds):
+    with app["_db"]() as conn:
+        conn.execute("UPDATE batch_jobs SET claimed_at = ? WHERE id = ?", (time.time() - seconds, job))
+
+
+def test_a_live_claim_keeps_other_runs_out(app):
+    job = _job(app)
+    assert app["batch_job_claim"](job, "run-a")
+    assert app["batch_job_get"](job)["claimed"]
+    assert not app["batch_job_claim"](job, "run-b")
+    assert app["batch_job_claim"](job, "run-a")   # re-claiming our own job refreshes it
+    assert [j["claimed"] for j in app["batch_jobs_list"]("test-shop")] == [True]
+
+
+def test_journaled_items_keep_the_claim_alive(app):
+    job = _job(app)
+    app["batch_job_claim"](job, "run-a")
+    _age_claim(app, job, app["BATCH_JOB_CLAIM_TTL"] - 5)
+    app["batch_job_mark"](job, "1000", "generating")
+    assert app["batch_job_get"](job)["claimed_at"] > time.time() - 5
+    assert not app["batch_job_claim"](job, "run-b")
+
+
+def test_a_stale_or_released_claim_can_be_taken_over(app):
+    job = _job(app)
+    app["batch_job_claim"](job, "run-a")
+    _age_claim(app, job, app["BATCH_JOB_CLAIM_TTL"] + 5)
+    assert not app["batch_job_get"](job)["claimed"]
+    assert app["batch_job_claim"](job, "run-b")
+
+    app["batch_job_release"](job, "run-a")   # a stale owner cannot drop someone else's claim
+    assert app["batch_job_get"](job)["claimed_by"] == "run-b"
+    app["batch_job_release"](job, "run-b")
+    assert not app["batch_job_get"](job)["claimed"]
+    assert app["batch_job_claim"](job, "run-c")
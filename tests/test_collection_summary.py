@@ -0,0 +1,52 @@
+"""Collection Writer product summary: a read that stops part-way must not be summarized or stored."""
+import json
+
+SHOP = "test-shop.myshopify.com"
+
+
+def _pages(*pages):
+    def fake_pages(shop_url, access_token, collection_id, local):
+        yield from pages
+    return fake_pages
+
+
+def _product(i, body):
+    return {"id": str(i), "title": f"Ring {i}", "product_type": "Ring", "body_html": body}
+
+
+def _seed_collection(app, cid="77"):
+    """A stored collection with updated_at — what makes its summary cacheable."""
+    with app["_db"]() as conn:
+        conn.execute("INSERT INTO collections (shop, id, data) VALUES (?, ?, ?)",
+                     (SHOP, cid, json.dumps({"id": cid, "title": "Rings", "updated_at": "2026-05-01T10:00:00Z"})))
+
+
+def _stored_summaries(app):
+    with app["_db"]() as conn:
+        return conn.execute("SELECT COUNT(*) FROM collection_summaries").fetchone()[0]
+
+
+def test_summary_of_a_full_read_is_stored(app, monkeypatch):
+    _seed_collection(app)
+    monkeypatch.setitem(app, "_collection_product_pages", _pages(
+        ([_product(1, "925 sterling silver"), _product(2, "sterling silver skull")], None),
+        ([_product(3, "solid brass")], None)))
+    text, err = app["summarize_collection_products"](SHOP, "tok", "77")
+    assert err is None
+    assert "Total products in this collection: 3" in text
+    assert "COMMON materials" in text and "PRIMARY material" in text
+    assert _stored_summaries(app) == 1
+
+    # unchanged collection: served from the stored summary without reading products again
+    monkeypatch.setitem(app, "_collection_product_pages", _pages(([], "must not be read")))
+    assert app["summarize_collection_products"](SHOP, "tok", "77") == (text, None)
+
+
+def test_partial_read_gives_no_summary_and_is_not_stored(app, monkeypatch):
+    _seed_collection(app)
+    monkeypatch.setitem(app, "_collection_product_pages", _pages(
+        ([_product(1, "925 sterling silver")], None),
+        ([], "Shopify API Error 503: unavailable")))
+    text, err = app["summarize_collection_products"](SHOP, "tok", "77")
+    assert (text, err) == ("", "Shopify API Error 503: unavailable")
+    assert _stored_summaries(app) == 0
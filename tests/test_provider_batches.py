@@ -0,0 +1,74 @@
+"""Offline Batch Writer runs (provider batch APIs) against the local stand-in in batch_stub.py:
+one batch per provider is submitted, polled until it ends, and its results ingested into the journal."""
+import pytest
+
+from batch_stub import ANSWER, BatchStub
+
+PROVIDER_MODELS = {"claude": "Claude Sonnet 5", "openai": "GPT-5.6 Terra", "gemini": "Gemini"}
+KEYS = {"gemini_key": "g-key", "claude_key": "c-key", "openai_key": "o-key"}
+
+
+@pytest.fixture
+def stub():
+    server = BatchStub(polls_needed=2)
+    yield server
+    server.close()
+
+
+def _products(n=3):
+    return [{"id": str(1000 + i), "title": f"Gold Ring {i}", "handle": f"gold-ring-{i}", "product_type": "Ring",
+             "sku": f"GR-{i}", "body_html": f"<p>14k gold ring number {i}.</p>"} for i in range(n)]
+
+
+def _run(app, stub, provider, products):
+    """Submit one offline job and poll it until its provider batch is ingested.
+    Returns (job id, entries from the ingesting poll, {product_id: journal state})."""
+    model = PROVIDER_MODELS[provider]
+    assert app["provider_for_model"](model, KEYS["claude_key"], KEYS["openai_key"]) == provider
+    job = app["batch_job_create"]("test-shop", model, False, products, mode="offline")
+    sent, err = app["batch_offline_submit"](job, [(p, "") for p in products], KEYS["gemini_key"], KEYS["claude_key"],
+                                            KEYS["openai_key"], model, catalog_text="", base=stub.base)
+    assert (sent, err) == (len(products), None)
+    assert {r["state"] for r in app["batch_job_items"](job)} == {"generating"}
+
+    poll = lambda: app["batch_offline_poll"](job, KEYS["gemini_key"], KEYS["claude_key"], KEYS["openai_key"], "test-shop", "tok")
+    entries, pending, errors = poll()
+    assert (entries, pending, errors) == ({}, 1, [])   # still running on the first poll
+    entries, pending, errors = poll()
+    assert (pending, errors) == (0, [])
+    assert poll()[0] == {}   # an ingested batch is not fetched again
+    return job, entries, {r["product_id"]: r["state"] for r in app["batch_job_items"](job)}
+
+
+@pytest.mark.parametrize("provider", ["claude", "openai", "gemini"])
+def test_offline_batch_round_trip(app, stub, provider):
+    products = _products()
+    stub.fail_ids = {products[2]["id"]}
+    job, entries, states = _run(app, stub, provider, products)
+
+    assert len(stub.batches) == 1
+    assert next(iter(stub.batches.values()))["ids"] == [p["id"] for p in products]
+    assert states == {"1000": "generated", "1001": "generated", "1002": "failed"}
+    assert entries["1000"]["success"] and entries["1000"]["data"]["meta_title"] == ANSWER["meta_title"]
+    assert entries["1002"]["error"]
+
+    usage = app["llm_usage_summary"]("task", run_ids=[job])
+    assert [(r["key"], r["calls"], r["failed"]) for r in usage] == [("product_content_batch", 3, 1)]
+
+
+def test_gemini_older_payload_answers_in_metadata_output(app, stub):
+    stub.gemini_legacy = True
+    _, entries, states = _run(app, stub, "gemini", _products(2))
+    assert states == {"1000": "generated", "1001": "generated"}
+    assert entries["1001"]["data"]["url_slug"] == ANSWER["url_slug"]
+
+
+@pytest.mark.parametrize("provider", ["claude", "openai", "gemini"])
+def test_cut_off_and_schema_invalid_answers_are_failed_not_stored(app, stub, provider):
+    products = _products()
+    stub.cut_ids, stub.bad_ids = {products[0]["id"]}, {products[1]["id"]}
+    _, entries, states = _run(app, stub, provider, products)
+
+    assert states == {"1000": "failed", "1001": "failed", "1002": "generated"}
+    assert "cut off" in entries["1000"]["error"]
+    assert "does not match the product_content schema" in entries["1001"]["error"]
@@ -0,0 +1,72 @@
+"""Bulk catalog export (bulkOperationRunQuery) against the local stand-in in shopify_bulk_stub.py.
+The bulk loader must hand the rest of the app the same rows get_shopify_products_page does."""
+import json
+
+import pytest
+
+from shopify_bulk_stub import CATALOG, ShopifyBulkStub, bulk_lines
+
+SHOP = "test-shop.myshopify.com"
+BULK_EXTRA_KEYS = {"collection_ids", "images", "metafields"}
+
+
+@pytest.fixture
+def shopify(app, monkeypatch):
+    def start(**kwargs):
+        stub = ShopifyBulkStub(**kwargs)
+        stubs.append(stub)
+        monkeypatch.setitem(app, "_shopify_admin_base", lambda shop: stub.admin_base)
+        return stub
+    stubs = []
+    yield start
+    for stub in stubs:
+        stub.close()
+
+
+def test_bulk_rows_match_the_products_page_shape(app, shopify):
+    stub = shopify()
+    page, next_cursor, err = app["get_shopify_products_page"](SHOP, "tok")
+    assert (next_cursor, err) == (None, None)
+
+    phases = []
+    bulk, err = app["get_shopify_all_products_bulk"](SHOP, "tok", progress_callback=lambda n, phase: phases.append(phase))
+    assert err is None
+    assert [c[2] for c in stub.calls if c[0] == "POST"] == ["bulkOperationRunQuery", "bulkOperation status", "bulkOperation status"]
+    assert phases[0] == "running" and phases[-1] == "done"
+
+    assert [p["id"] for p in bulk] == [p["id"] for p in page] == ["101", "102", "103"]
+    for rest_row, bulk_row in zip(page, bulk):
+        assert set(bulk_row) == set(rest_row) | BULK_EXTRA_KEYS
+        assert {k: bulk_row[k] for k in rest_row} == rest_row
+        assert {k: type(bulk_row[k]) for k in rest_row} == {k: type(v) for k, v in rest_row.items()}
+
+
+def test_children_are_attached_to_their_parent(app, shopify):
+    shopify()
+    bulk, err = app["get_shopify_all_products_bulk"](SHOP, "tok")
+    ring, pendant, chain = bulk
+    assert (ring["variants_count"], ring["total_inventory"], ring["sku"], ring["all_skus"]) == (2, 5, "SR-9", "SR-9, SR-10")
+    assert ring["images"] == [{"id": "5011", "src": "https://cdn.shopify.com/s/files/skull-ring.jpg", "alt": "Skull ring"}]
+    assert ring["collection_ids"] == ["77", "78"]
+    assert ring["metafields"] == {"global.title_tag": "Skull Ring | Biker Rings"}
+    assert (pendant["variants_count"], pendant["sku"], pendant["images"], pendant["collection_ids"]) == (1, "", [], [])
+    assert chain["collection_ids"] == ["78"]
+
+
+def test_orphan_children_wait_for_their_parent(app, shopify):
+    stub = shopify(orphans_first={101, 103})
+    assert json.loads(stub.lines[0])["__parentId"] == "gid://shopify/Product/101"   # child before its product
+
+    in_order = app["_shopify_bulk_parse"](bulk_lines(CATALOG))
+    bulk, err = app["get_shopify_all_products_bulk"](SHOP, "tok")
+    assert err is None
+    assert bulk == in_order
+
+
+def test_children_of_a_product_missing_from_the_export_are_dropped(app):
+    lines = bulk_lines(CATALOG[:1])
+    lines.insert(0, json.dumps({"id": "gid://shopify/ProductVariant/9", "sku": "GONE", "inventoryQuantity": 9,
+                                "__parentId": "gid://shopify/Product/999"}))
+    products = app["_shopify_bulk_parse"](lines)
+    assert [p["id"] for p in products] == ["101"]
+    assert products[0]["total_inventory"] == 5 and "GONE" not in products[0]["all_skus"]